@@ -1,16 +1,41 @@
 # imports
-import ibis
+import gc
 import uuid
 import typer
 
+from ibis_bench.utils.csv_export import (
+    CSV_COMPRESSIONS,
+    DEFAULT_SCHEMA_MODE,
+    SCHEMA_MODES,
+    get_csv_options,
+)
+from ibis_bench.utils.ipc import IPC_COMPRESSIONS, get_ipc_options
+from ibis_bench.utils.load import DEFAULT_LOAD_MODE, LOAD_MODES
+from ibis_bench.utils.shm_cache import DEFAULT_SHM_DIR
+from ibis_bench.utils.page_cache import CACHE_STATES, DEFAULT_CACHE_STATE
+from ibis_bench.utils.storage import (
+    DEFAULT_DATA_ROOT,
+    get_storage_options,
+    is_url,
+    upload_data,
+)
+from ibis_bench.utils.layout import CODECS, DEFAULT_LAYOUT, PARTITION_BY, get_layout
 from ibis_bench.utils.logging import log
-from ibis_bench.utils.monitor import monitor_it
+from ibis_bench.utils.manifest import read_manifest, validate_manifest
+from ibis_bench.utils.monitor import flush_monitor_results
+from ibis_bench.utils.sampler import DEFAULT_SAMPLE_INTERVAL_MS
 
 ## import tpch functions
-from ibis_bench.tpch.gen_data import generate_data as tpch_generate_data
-from ibis_bench.tpch.read_data import (
-    get_ibis_tables as tpch_get_ibis_tables,
-    get_polars_tables as tpch_get_polars_tables,
+from ibis_bench.tpch.gen_data import (
+    FILE_TYPES,
+    generate_data as tpch_generate_data,
+    get_data_dir as tpch_get_data_dir,
+)
+from ibis_bench.tpch.repartition import repartition_data as tpch_repartition
+from ibis_bench.tpch.run_queries import (
+    get_system_tables as tpch_get_system_tables,
+    get_queries as tpch_get_queries,
+    run_query as tpch_run_query,
 )
 
 ## import tpcds functions
@@ -56,13 +81,245 @@ def tpch_gen_data(
     csv: bool = typer.Option(
         False, "--csv", "-c", help="generate CSV files in addition to Parquet"
     ),
+    csv_compression: str = typer.Option(
+        None,
+        "--csv-compression",
+        help=f"CSV compression ({', '.join(CSV_COMPRESSIONS)})",
+    ),
+    csv_delimiter: str = typer.Option(",", "--csv-delimiter", help="CSV delimiter"),
+    csv_header: bool = typer.Option(
+        True, "--csv-header/--no-csv-header", help="CSV header row"
+    ),
+    ipc: bool = typer.Option(
+        False, "--ipc", help="generate Arrow IPC (Feather) files in addition to Parquet"
+    ),
+    ipc_compression: str = typer.Option(
+        None,
+        "--ipc-compression",
+        help=f"Arrow IPC compression ({', '.join(IPC_COMPRESSIONS)}), uncompressed files are memory-mapped",
+    ),
+    jobs: int = typer.Option(
+        None,
+        "--jobs",
+        "-j",
+        help="number of partitions to generate concurrently (default: bounded by cores and memory)",
+    ),
+    memory_limit: float = typer.Option(
+        None,
+        "--memory-limit",
+        "-m",
+        help="memory limit per job in GB, generating out-of-core in chunks on disk",
+    ),
+    temp_dir: str = typer.Option(
+        None,
+        "--temp-dir",
+        help="directory for out-of-core databases and spill files (default: tpch_data/.tmp)",
+    ),
+    row_group_size: int = typer.Option(
+        None, "--row-group-size", help="Parquet rows per row group"
+    ),
+    page_size: int = typer.Option(
+        None, "--page-size", help="Parquet data page size in bytes"
+    ),
+    compression: str = typer.Option(
+        None, "--compression", help=f"Parquet compression codec ({', '.join(CODECS)})"
+    ),
+    dictionary: bool = typer.Option(
+        True, "--dictionary/--no-dictionary", help="Parquet dictionary encoding"
+    ),
+    sort_by: list[str] = typer.Option(
+        None,
+        "--sort-by",
+        help="columns to sort tables by, where present (e.g. l_shipdate)",
+    ),
+    partition_by: str = typer.Option(
+        None,
+        "--partition-by",
+        help=f"hive-partition lineitem and orders by ship/order date ({', '.join(PARTITION_BY)})",
+    ),
+    floats: bool = typer.Option(
+        False,
+        "--floats",
+        help="store decimal columns as float64 (a separate layout), instead of casting them per query with --decimal-to-float",
+    ),
 ):
     """
     generate tpc-h benchmarking data
     """
+    layout = get_layout_options(
+        row_group_size,
+        page_size,
+        compression,
+        dictionary,
+        sort_by,
+        partition_by,
+        floats,
+    )
+    csv_options = get_csv_options(csv_compression, csv_delimiter, csv_header)
+    ipc_options = get_ipc_options(ipc_compression)
+    for sf in sorted(scale_factors):
+        for n in sorted(n_partitions):
+            tpch_generate_data(
+                sf,
+                n,
+                csv=csv,
+                jobs=jobs,
+                memory_limit=memory_limit,
+                temp_dir=temp_dir,
+                layout=layout,
+                csv_options=csv_options,
+                ipc=ipc,
+                ipc_options=ipc_options,
+            )
+
+
+@tpch_app.command("repartition")
+def tpch_repartition_data(
+    scale_factors: list[int] = typer.Option(
+        DEFAULT_SCALE_FACTORS, "--scale-factor", "-s", help="scale factors"
+    ),
+    n_partitions: list[int] = typer.Option(
+        ..., "--n-partitions", "-n", help="number of partitions to write"
+    ),
+    from_n_partitions: int = typer.Option(
+        1, "--from", help="number of partitions of the existing data"
+    ),
+    target_file_size: float = typer.Option(
+        None,
+        "--target-file-size",
+        help="minimum file size in MB, capping the number of files of small tables",
+    ),
+    jobs: int = typer.Option(
+        None, "--jobs", "-j", help="number of files to write concurrently"
+    ),
+    layout: str = typer.Option(
+        DEFAULT_LAYOUT,
+        "--layout",
+        "-l",
+        help="data layout, as named by `bench tpch gen`",
+    ),
+):
+    """
+    rewrite existing tpc-h benchmarking data with a different number of partitions
+    """
+    for sf in sorted(scale_factors):
+        for n in sorted(n_partitions):
+            tpch_repartition(
+                sf,
+                from_n_partitions,
+                n,
+                target_file_size=int(target_file_size * 1024**2)
+                if target_file_size
+                else None,
+                jobs=jobs,
+                layout=layout,
+            )
+
+
+@tpch_app.command("validate")
+def tpch_validate_data(
+    scale_factors: list[int] = typer.Option(
+        DEFAULT_SCALE_FACTORS, "--scale-factor", "-s", help="scale factors"
+    ),
+    n_partitions: list[int] = typer.Option(
+        DEFAULT_N_PARTITIONS, "--n-partitions", "-n", help="number of partitions"
+    ),
+    use_csv: bool = typer.Option(False, "--csv", "-c", help="validate CSV files"),
+    file_format: str = typer.Option(
+        "parquet",
+        "--format",
+        "-f",
+        help=f"file format to validate ({', '.join(FILE_TYPES)})",
+    ),
+    layout: str = typer.Option(
+        DEFAULT_LAYOUT,
+        "--layout",
+        "-l",
+        help="data layout, as named by `bench tpch gen`",
+    ),
+    checksums: bool = typer.Option(
+        False, "--checksums", help="compare file checksums, not only sizes"
+    ),
+    data_root: str = typer.Option(
+        DEFAULT_DATA_ROOT,
+        "--data-root",
+        help="directory or URL (e.g. s3://bucket/prefix) containing tpch_data",
+    ),
+):
+    """
+    validate tpc-h benchmarking data against its manifest
+    """
+    file_type = get_file_type(use_csv, file_format)
+    failed = False
+    for sf in sorted(scale_factors):
+        for n in sorted(n_partitions):
+            data_directory = tpch_get_data_dir(
+                sf,
+                n,
+                csv=file_type == "csv",
+                layout=layout,
+                ipc=file_type == "ipc",
+                data_root=data_root,
+            )
+            manifest = read_manifest(data_directory)
+            if manifest is None:
+                log.info(f"no manifest for {data_directory}")
+                failed = True
+                continue
+
+            problems = validate_manifest(data_directory, manifest, checksums=checksums)
+            for problem in problems:
+                log.info(f"\t{problem}")
+            log.info(
+                f"{data_directory}: {'invalid' if problems else 'valid'} ({manifest['rows']:,} rows)"
+            )
+            failed |= bool(problems)
+
+    if failed:
+        raise typer.Exit(1)
+
+
+@tpch_app.command("upload")
+def tpch_upload_data(
+    data_root: str = typer.Argument(
+        ..., help="URL to upload tpch_data to (e.g. s3://bucket/prefix)"
+    ),
+    scale_factors: list[int] = typer.Option(
+        DEFAULT_SCALE_FACTORS, "--scale-factor", "-s", help="scale factors"
+    ),
+    n_partitions: list[int] = typer.Option(
+        DEFAULT_N_PARTITIONS, "--n-partitions", "-n", help="number of partitions"
+    ),
+    file_format: str = typer.Option(
+        "parquet",
+        "--format",
+        "-f",
+        help=f"file format to upload ({', '.join(FILE_TYPES)})",
+    ),
+    layout: str = typer.Option(
+        DEFAULT_LAYOUT,
+        "--layout",
+        "-l",
+        help="data layout, as named by `bench tpch gen`",
+    ),
+):
+    """
+    upload tpc-h benchmarking data to object storage
+    """
+    file_type = get_file_type(False, file_format)
     for sf in sorted(scale_factors):
         for n in sorted(n_partitions):
-            tpch_generate_data(sf, n, csv=csv)
+            kwargs = {
+                "csv": file_type == "csv",
+                "layout": layout,
+                "ipc": file_type == "ipc",
+            }
+            data_directory = tpch_get_data_dir(sf, n, **kwargs)
+            if read_manifest(data_directory) is None:
+                raise typer.BadParameter(f"no manifest for {data_directory}")
+            upload_data(
+                data_directory, tpch_get_data_dir(sf, n, data_root=data_root, **kwargs)
+            )
 
 
 @tpch_app.command("run")
@@ -81,130 +338,164 @@ def tpch_run(
         None, "--exclude-queries", "-e", help="exclude query numbers"
     ),
     use_csv: bool = typer.Option(
-        False, "--csv", "-c", help="use CSV files instead of parquet"
+        False, "--csv", "-c", help="use CSV files instead of parquet (--format csv)"
+    ),
+    file_format: str = typer.Option(
+        "parquet",
+        "--format",
+        "-f",
+        help=f"input file format ({', '.join(FILE_TYPES)})",
     ),
     decimal_to_float: bool = typer.Option(
-        False, "--decimal-to-float", "-d", help="convert decimal to float"
+        False,
+        "--decimal-to-float",
+        "-d",
+        help="cast decimal columns to float in each query (stored floats are a layout, see `bench tpch gen --floats`)",
     ),
     instance_type: str = typer.Option(
         None, "--instance-type", "-i", help="instance type"
     ),
+    session_id: str = typer.Option(
+        None, "--session-id", help="session id (defaults to a new uuid)"
+    ),
+    warmup: int = typer.Option(
+        0, "--warmup", "-w", help="number of untimed runs of each query"
+    ),
+    repeat: int = typer.Option(
+        1, "--repeat", "-r", help="number of timed runs of each query"
+    ),
+    phases: bool = typer.Option(
+        False,
+        "--phases",
+        help="time build, compile, plan, execute and write phases separately",
+    ),
+    sample_interval_ms: int = typer.Option(
+        DEFAULT_SAMPLE_INTERVAL_MS,
+        "--sample-interval-ms",
+        help="resource sampling interval in milliseconds (0 to disable)",
+    ),
+    sample_detail: bool = typer.Option(
+        False,
+        "--sample-detail",
+        help="also sample USS (reads /proc/<pid>/smaps, adds overhead)",
+    ),
+    memory_limit: float = typer.Option(
+        None,
+        "--memory-limit",
+        "-m",
+        help="backend memory limit in GB (DuckDB and DataFusion)",
+    ),
+    layout: str = typer.Option(
+        DEFAULT_LAYOUT,
+        "--layout",
+        "-l",
+        help="data layout, as named by `bench tpch gen`",
+    ),
+    schema_mode: str = typer.Option(
+        DEFAULT_SCHEMA_MODE,
+        "--schema-mode",
+        help=f"whether CSV column types are inferred or declared ({', '.join(SCHEMA_MODES)})",
+    ),
+    load_mode: str = typer.Option(
+        DEFAULT_LOAD_MODE,
+        "--load",
+        help=f"query views over the files, or tables loaded into the engine first ({', '.join(LOAD_MODES)})",
+    ),
+    shm_cache: bool = typer.Option(
+        False,
+        "--shm-cache",
+        help=f"read tables decoded once into a shared memory cache ({DEFAULT_SHM_DIR})",
+    ),
+    shm_cache_gb: float = typer.Option(
+        None,
+        "--shm-cache-gb",
+        help="shared memory cache budget in GB (default: half of the tmpfs)",
+    ),
+    cache_state: str = typer.Option(
+        DEFAULT_CACHE_STATE,
+        "--cache-state",
+        help=f"keep data files in the OS page cache, or evict them before each timed run and record the files and bytes read ({', '.join(CACHE_STATES)})",
+    ),
+    data_root: str = typer.Option(
+        DEFAULT_DATA_ROOT,
+        "--data-root",
+        help="directory or URL (e.g. s3://bucket/prefix) containing tpch_data",
+    ),
+    latency_ms: float = typer.Option(
+        0, "--latency-ms", help="latency added to each request to a URL data root"
+    ),
+    bandwidth_mbps: float = typer.Option(
+        0,
+        "--bandwidth-mbps",
+        help="bandwidth limit of reads from a URL data root, in Mbit/s (0 for none)",
+    ),
+    block_cache: str = typer.Option(
+        None,
+        "--block-cache",
+        help="local directory caching blocks read from a URL data root",
+    ),
 ):
     """
     run tpc-h benchmarking queries
     """
-    session_id = str(uuid.uuid4())
+    session_id = session_id or str(uuid.uuid4())
+    file_type = get_file_type(use_csv, file_format)
+    check_cache_state(cache_state, shm_cache, data_root, load_mode, systems)
+    storage_options = get_storage_options(latency_ms, bandwidth_mbps, block_cache)
 
     for sf in sorted(scale_factors):
         for n in sorted(n_partitions):
             for system in systems:
-                system_parts = system.split("-")
-
-                if system_parts[0] == "ibis" and system_parts[-1] != "sql":
-                    backend = system_parts[1]
-                    con = ibis.connect(f"{backend}://")
-                    log.info(f"connected to {backend} backend")
-
-                    from ibis_bench.tpch.queries.ibis import all_queries
-
-                    (
-                        customer,
-                        lineitem,
-                        nation,
-                        orders,
-                        part,
-                        partsupp,
-                        region,
-                        supplier,
-                    ) = tpch_get_ibis_tables(
-                        sf=sf,
-                        n_partitions=n,
-                        con=con,
-                        csv=use_csv,
-                        decimal_to_float=decimal_to_float,
-                    )
-                elif system_parts[0] == "ibis" and system_parts[-1] == "sql":
-                    backend = system_parts[1]
-                    con = ibis.connect(f"{backend}://")
-                    log.info(f"connected to {backend} backend (for SQL)")
-
-                    from ibis_bench.tpch.queries.sql import all_queries
-
-                    (
-                        customer,
-                        lineitem,
-                        nation,
-                        orders,
-                        part,
-                        partsupp,
-                        region,
-                        supplier,
-                    ) = tpch_get_ibis_tables(
-                        sf=sf,
-                        n_partitions=n,
-                        con=con,
-                        csv=use_csv,
-                        decimal_to_float=decimal_to_float,
-                    )
-                elif system_parts[0] == "polars":
-                    backend = system_parts[0]
-                    lazy = system_parts[1] == "lazy"
-                    log.info(f"using Polars with lazy={lazy}")
-
-                    from ibis_bench.tpch.queries.polars import all_queries
-
-                    (
-                        customer,
-                        lineitem,
-                        nation,
-                        orders,
-                        part,
-                        partsupp,
-                        region,
-                        supplier,
-                    ) = tpch_get_polars_tables(
+                all_queries, backend, tables = tpch_get_system_tables(
+                    system,
+                    sf=sf,
+                    n_partitions=n,
+                    file_type=file_type,
+                    decimal_to_float=decimal_to_float,
+                    memory_limit=memory_limit,
+                    layout=layout,
+                    schema_mode=schema_mode,
+                    load_mode=load_mode,
+                    shm_cache=shm_cache,
+                    shm_cache_gb=shm_cache_gb,
+                    data_root=data_root,
+                    storage_options=storage_options,
+                )
+
+                queries = tpch_get_queries(all_queries, q_number, exclude_queries)
+
+                for q, query in queries.items():
+                    tpch_run_query(
+                        query,
+                        q,
+                        system=system,
+                        backend=backend,
+                        tables=tables,
                         sf=sf,
                         n_partitions=n,
-                        lazy=lazy,
-                        csv=use_csv,
+                        session_id=session_id,
+                        instance_type=instance_type,
+                        file_type=file_type,
                         decimal_to_float=decimal_to_float,
+                        warmup=warmup,
+                        repeat=repeat,
+                        phases=phases,
+                        sample_interval_ms=sample_interval_ms,
+                        sample_detail=sample_detail,
+                        layout=layout,
+                        schema_mode=schema_mode,
+                        shm_cache=shm_cache,
+                        cache_state=cache_state,
+                        data_root=data_root,
+                        storage_options=storage_options,
                     )
 
-                queries = {
-                    q: query
-                    for q, query in enumerate(all_queries, start=1)
-                    if (q_number is None or q in q_number)
-                    and (exclude_queries is None or q not in exclude_queries)
-                }
+                # NOTE: free the system's tables (and loaded data) before the
+                # next system reads its own
+                tables = None
+                gc.collect()
 
-                for q, query in queries.items():
-                    try:
-                        monitor_it(
-                            query,
-                            sf=sf,
-                            n_partitions=n,
-                            query_number=q,
-                            system=system,
-                            session_id=session_id,
-                            instance_type=instance_type,
-                            use_csv=use_csv,
-                            decimal_to_float=decimal_to_float,
-                            # tpch tables
-                            customer=customer,
-                            lineitem=lineitem,
-                            nation=nation,
-                            orders=orders,
-                            part=part,
-                            partsupp=partsupp,
-                            region=region,
-                            supplier=supplier,
-                            # used for SQL runs
-                            dialect=backend if backend else None,
-                        )
-                    except Exception as e:
-                        log.info(
-                            f"error running query {q} at scale factor {sf} and {n} partitions: {e}"
-                        )
+    flush_monitor_results()
 
 
 # TPC-DS commands
@@ -216,12 +507,134 @@ def tpcds_gen_data(
     csv: bool = typer.Option(
         False, "--csv", "-c", help="generate CSV files in addition to Parquet"
     ),
+    csv_compression: str = typer.Option(
+        None,
+        "--csv-compression",
+        help=f"CSV compression ({', '.join(CSV_COMPRESSIONS)})",
+    ),
+    csv_delimiter: str = typer.Option(",", "--csv-delimiter", help="CSV delimiter"),
+    csv_header: bool = typer.Option(
+        True, "--csv-header/--no-csv-header", help="CSV header row"
+    ),
+    ipc: bool = typer.Option(
+        False, "--ipc", help="generate Arrow IPC (Feather) files in addition to Parquet"
+    ),
+    ipc_compression: str = typer.Option(
+        None,
+        "--ipc-compression",
+        help=f"Arrow IPC compression ({', '.join(IPC_COMPRESSIONS)}), uncompressed files are memory-mapped",
+    ),
+    row_group_size: int = typer.Option(
+        None, "--row-group-size", help="Parquet rows per row group"
+    ),
+    page_size: int = typer.Option(
+        None, "--page-size", help="Parquet data page size in bytes"
+    ),
+    compression: str = typer.Option(
+        None, "--compression", help=f"Parquet compression codec ({', '.join(CODECS)})"
+    ),
+    dictionary: bool = typer.Option(
+        True, "--dictionary/--no-dictionary", help="Parquet dictionary encoding"
+    ),
+    sort_by: list[str] = typer.Option(
+        None,
+        "--sort-by",
+        help="columns to sort tables by, where present (e.g. ss_sold_date_sk)",
+    ),
+    floats: bool = typer.Option(
+        False,
+        "--floats",
+        help="store decimal columns as float64 (a separate layout), instead of casting them per query with --decimal-to-float",
+    ),
 ):
     """
     generate tpc-h benchmarking data
     """
+    layout = get_layout_options(
+        row_group_size, page_size, compression, dictionary, sort_by, floats=floats
+    )
+    csv_options = get_csv_options(csv_compression, csv_delimiter, csv_header)
+    ipc_options = get_ipc_options(ipc_compression)
     for sf in sorted(scale_factors):
-        tpcds_generate_data(sf, csv=csv)
+        tpcds_generate_data(
+            sf,
+            csv=csv,
+            layout=layout,
+            csv_options=csv_options,
+            ipc=ipc,
+            ipc_options=ipc_options,
+        )
+
+
+def get_file_type(use_csv: bool, file_format: str) -> str:
+    # NOTE: --csv is kept as a shorthand for --format csv
+    file_type = "csv" if use_csv else file_format
+    if file_type not in FILE_TYPES:
+        raise typer.BadParameter(
+            f"unknown file format: {file_type} (one of {FILE_TYPES})"
+        )
+    return file_type
+
+
+def check_cache_state(
+    cache_state: str,
+    shm_cache: bool,
+    data_root: str = DEFAULT_DATA_ROOT,
+    load_mode: str = DEFAULT_LOAD_MODE,
+    systems: list[str] = None,
+):
+    if cache_state not in CACHE_STATES:
+        raise typer.BadParameter(
+            f"unknown cache state: {cache_state} (one of {CACHE_STATES})"
+        )
+    # NOTE: tables in the shared memory cache are read from tmpfs, which can't
+    # be evicted from memory
+    if cache_state == "cold" and shm_cache:
+        raise typer.BadParameter("a cold cache state can't be used with --shm-cache")
+    # NOTE: files at a URL aren't in this machine's page cache
+    if cache_state == "cold" and is_url(data_root):
+        raise typer.BadParameter(
+            "a cold cache state can't be used with a URL data root"
+        )
+    # NOTE: natively loaded tables and Polars eager DataFrames are read into
+    # process memory before the files are evicted, so queries never read them
+    if cache_state == "cold" and load_mode == "native":
+        raise typer.BadParameter("a cold cache state can't be used with --load native")
+    if cache_state == "cold" and "polars-eager" in (systems or []):
+        raise typer.BadParameter("a cold cache state can't be used with polars-eager")
+
+
+def get_layout_options(
+    row_group_size,
+    page_size,
+    compression,
+    dictionary,
+    sort_by,
+    partition_by=None,
+    floats=False,
+):
+    # NOTE: no options means the default layout (DuckDB's Parquet writer)
+    if not any(
+        [
+            row_group_size,
+            page_size,
+            compression,
+            not dictionary,
+            sort_by,
+            partition_by,
+            floats,
+        ]
+    ):
+        return None
+    return get_layout(
+        row_group_size=row_group_size,
+        page_size=page_size,
+        compression=compression,
+        dictionary=dictionary,
+        sort_by=sort_by,
+        partition_by=partition_by,
+        floats=floats,
+    )
 
 
 if __name__ == "__main__":
@@ -1,11 +1,41 @@
 import os
 import ibis
+import math
 import uuid
 import typer
 import subprocess
 
+from ibis_bench.utils.csv_export import DEFAULT_SCHEMA_MODE, SCHEMA_MODES
+from ibis_bench.utils.layout import DEFAULT_LAYOUT
+from ibis_bench.utils.load import DEFAULT_LOAD_MODE, LOAD_MODES
+from ibis_bench.utils.shm_cache import DEFAULT_SHM_DIR
+from ibis_bench.utils.page_cache import CACHE_STATES, DEFAULT_CACHE_STATE
+from ibis_bench.utils.storage import DEFAULT_DATA_ROOT, get_storage_options, is_url
 from ibis_bench.utils.logging import log
-from ibis_bench.utils.monitor import get_raw_json_dir, get_cache_dir
+from ibis_bench.tpch.gen_data import FILE_TYPES
+from ibis_bench.tpch.worker import Worker
+from ibis_bench.utils.watchdog import watch
+from ibis_bench.utils.monitor import (
+    get_raw_json_dir,
+    get_cache_dir,
+    get_results_dir,
+    get_run_record,
+    write_failure_record,
+    flush_monitor_results,
+    read_monitor_results,
+)
+from ibis_bench.utils.results_log import (
+    compact as compact_results,
+    ingest_raw_json,
+    recover_wal,
+)
+from ibis_bench.utils.sampler import DEFAULT_SAMPLE_INTERVAL_MS
+from ibis_bench.utils.scheduler import (
+    DEFAULT_GB_PER_SF,
+    get_cpu_sets,
+    get_limit_env,
+    run_scheduled,
+)
 
 DEFAULT_INSTANCE_TYPE = "unknown"
 DEFAULT_SYSTEMS = [
@@ -27,6 +57,19 @@ DEFAULT_SFS = [
 DEFAULT_N_PARTITIONS = [1]
 DEFAULT_QS = range(1, 23)
 
+# run key fields added after the first records, with the value older records had
+RUN_KEY_DEFAULTS = {
+    "layout": DEFAULT_LAYOUT,
+    "schema_mode": DEFAULT_SCHEMA_MODE,
+    "load_mode": DEFAULT_LOAD_MODE,
+    "shm_cache": False,
+    "cache_state": DEFAULT_CACHE_STATE,
+    "data_root": DEFAULT_DATA_ROOT,
+    "latency_ms": 0.0,
+    "bandwidth_mbps": 0.0,
+    "block_cache": False,
+}
+
 TYPER_KWARGS = {
     "no_args_is_help": True,
     "add_completion": False,
@@ -54,47 +97,461 @@ def run(
         DEFAULT_INSTANCE_TYPE, "--instance-type", "-i", help="instance type"
     ),
     use_csv: bool = typer.Option(
-        False, "--csv", "-c", help="use CSV instead of Parquet"
+        False, "--csv", "-c", help="use CSV instead of Parquet (--format csv)"
+    ),
+    file_format: str = typer.Option(
+        "parquet",
+        "--format",
+        "-f",
+        help=f"input file format ({', '.join(FILE_TYPES)})",
     ),
     repeat: int = typer.Option(
         3, "--repeat", "-r", help="number of times to repeat the run"
     ),
+    warmup: int = typer.Option(
+        0, "--warmup", "-w", help="number of untimed runs of each query per run"
+    ),
+    iterations: int = typer.Option(
+        1, "--iterations", help="number of timed runs of each query per run"
+    ),
+    phases: bool = typer.Option(
+        False,
+        "--phases",
+        help="time build, compile, plan, execute and write phases separately",
+    ),
+    sample_interval_ms: int = typer.Option(
+        DEFAULT_SAMPLE_INTERVAL_MS,
+        "--sample-interval-ms",
+        help="resource sampling interval in milliseconds (0 to disable)",
+    ),
+    sample_detail: bool = typer.Option(
+        False,
+        "--sample-detail",
+        help="also sample USS (reads /proc/<pid>/smaps, adds overhead)",
+    ),
+    pool: bool = typer.Option(
+        False,
+        "--pool",
+        "-p",
+        help="run queries in persistent per-system worker processes",
+    ),
+    recycle_every: int = typer.Option(
+        None,
+        "--recycle-every",
+        help="restart a pool worker after this many queries",
+    ),
+    parallel: int = typer.Option(
+        1,
+        "--parallel",
+        "-P",
+        help="number of runs to execute concurrently on disjoint CPU sets",
+    ),
+    gb_per_sf: float = typer.Option(
+        DEFAULT_GB_PER_SF,
+        "--gb-per-sf",
+        help="estimated peak memory (GB) per run per scale factor, used to avoid co-scheduling runs that don't fit in RAM",
+    ),
+    timeout: float = typer.Option(
+        None, "--timeout", "-t", help="wall-clock timeout per run in seconds"
+    ),
+    memory_limit: float = typer.Option(
+        None,
+        "--memory-limit",
+        "-m",
+        help="memory limit per run in GB (backend-native and enforced by a watchdog)",
+    ),
+    layout: str = typer.Option(
+        DEFAULT_LAYOUT,
+        "--layout",
+        "-l",
+        help="data layout, as named by `bench tpch gen`",
+    ),
+    schema_mode: str = typer.Option(
+        DEFAULT_SCHEMA_MODE,
+        "--schema-mode",
+        help=f"whether CSV column types are inferred or declared ({', '.join(SCHEMA_MODES)})",
+    ),
+    load_mode: str = typer.Option(
+        DEFAULT_LOAD_MODE,
+        "--load",
+        help=f"query views over the files, or tables loaded into the engine first ({', '.join(LOAD_MODES)})",
+    ),
+    shm_cache: bool = typer.Option(
+        False,
+        "--shm-cache",
+        help=f"read tables decoded once into a shared memory cache ({DEFAULT_SHM_DIR})",
+    ),
+    shm_cache_gb: float = typer.Option(
+        None,
+        "--shm-cache-gb",
+        help="shared memory cache budget in GB (default: half of the tmpfs)",
+    ),
+    cache_state: str = typer.Option(
+        DEFAULT_CACHE_STATE,
+        "--cache-state",
+        help=f"keep data files in the OS page cache, or evict them before each timed run and record the files and bytes read ({', '.join(CACHE_STATES)})",
+    ),
+    data_root: str = typer.Option(
+        DEFAULT_DATA_ROOT,
+        "--data-root",
+        help="directory or URL (e.g. s3://bucket/prefix) containing tpch_data",
+    ),
+    latency_ms: float = typer.Option(
+        0, "--latency-ms", help="latency added to each request to a URL data root"
+    ),
+    bandwidth_mbps: float = typer.Option(
+        0,
+        "--bandwidth-mbps",
+        help="bandwidth limit of reads from a URL data root, in Mbit/s (0 for none)",
+    ),
+    block_cache: str = typer.Option(
+        None,
+        "--block-cache",
+        help="local directory caching blocks read from a URL data root",
+    ),
+    resume: str = typer.Option(
+        None,
+        "--resume",
+        help="session id to resume, skipping runs that already have records",
+    ),
+    fill_to: int = typer.Option(
+        None,
+        "--fill-to",
+        help="run until each run has this many successful timed runs (in the resumed session, or across sessions of the instance type)",
+    ),
 ):
     """
     run bench
     """
-    for _ in range(repeat):
-        for sf in scale_factors:
-            for n in n_partitions:
-                for system in systems:
-                    for q in queries:
-                        cmd = f"bench tpch run {system} -s {sf} -n {n} -q {q} -i '{instance_type}'"
-                        cmd += " --csv" if use_csv else ""
+    session_id = resume or str(uuid.uuid4())
+    file_type = "csv" if use_csv else file_format
+    if file_type not in FILE_TYPES:
+        raise typer.BadParameter(
+            f"unknown file format: {file_type} (one of {FILE_TYPES})"
+        )
+    if cache_state not in CACHE_STATES:
+        raise typer.BadParameter(
+            f"unknown cache state: {cache_state} (one of {CACHE_STATES})"
+        )
+    if cache_state == "cold" and shm_cache:
+        raise typer.BadParameter("a cold cache state can't be used with --shm-cache")
+    if cache_state == "cold" and is_url(data_root):
+        raise typer.BadParameter(
+            "a cold cache state can't be used with a URL data root"
+        )
+    if cache_state == "cold" and load_mode == "native":
+        raise typer.BadParameter("a cold cache state can't be used with --load native")
+    if cache_state == "cold" and "polars-eager" in systems:
+        raise typer.BadParameter("a cold cache state can't be used with polars-eager")
+    storage_options = get_storage_options(latency_ms, bandwidth_mbps, block_cache)
 
-                        log.info(f"running: {cmd}")
-                        res = subprocess.run(cmd, shell=True)
-                        if res.returncode != 0:
-                            log.info(f"failed to run: {cmd}")
+    cells = [
+        {
+            "system": system,
+            "sf": sf,
+            "n_partitions": n,
+            "queries": [q],
+            "session_id": session_id,
+            "instance_type": instance_type,
+            "file_type": file_type,
+            "decimal_to_float": False,
+            "warmup": warmup,
+            "iterations": iterations,
+            "phases": phases,
+            "sample_interval_ms": sample_interval_ms,
+            "sample_detail": sample_detail,
+            "memory_limit": memory_limit,
+            "layout": layout,
+            "schema_mode": schema_mode,
+            "load_mode": load_mode,
+            "shm_cache": shm_cache,
+            "shm_cache_gb": shm_cache_gb,
+            "cache_state": cache_state,
+            "data_root": data_root,
+            "storage_options": storage_options,
+        }
+        for sf in scale_factors
+        for n in n_partitions
+        for system in systems
+        for q in queries
+    ]
 
-                        log.info(f"finished running: {cmd}")
+    done = {}
+    if resume is not None or fill_to is not None:
+        # NOTE: without a resumed session, filling counts runs of all sessions
+        # on the instance type
+        done = get_done_counts(
+            session_id=resume,
+            instance_type=None if resume is not None else instance_type,
+        )
 
+    n_repeats = []
+    for cell in cells:
+        counts = done.get(get_cell_key(cell), {"ok": 0, "failed": 0})
+        if fill_to is not None:
+            # each successful run records `iterations` timed runs
+            n = math.ceil((fill_to - counts["ok"]) / iterations)
+        elif resume is not None:
+            # a failed run records a single failure, so isn't retried
+            n = repeat - counts["ok"] // iterations - counts["failed"]
+        else:
+            n = repeat
+        n_repeats.append(max(n, 0))
 
-@app.command()
-def combine_json(instance_type: str = typer.Argument(..., help="instance type")):
+    cells = [
+        cell
+        for r in range(max(n_repeats, default=0))
+        for cell, n in zip(cells, n_repeats)
+        if r < n
+    ]
+    if resume is not None or fill_to is not None:
+        log.info(
+            f"scheduling {len(cells)} runs ({sum(n == 0 for n in n_repeats)} already complete) for session {session_id}"
+        )
+
+    # NOTE: with a single slot the runs are not pinned or thread-limited
+    cpu_sets = get_cpu_sets(parallel) if parallel > 1 else [None]
+    workers = {}
+
+    def _run_cell(cell: dict, slot: int, cpus: list[int]):
+        env = get_limit_env(cpus) if cpus else {}
+        if pool:
+            result = run_on_worker(
+                cell,
+                workers,
+                recycle_every=recycle_every,
+                slot=slot,
+                env=env,
+                timeout=timeout,
+            )
+        else:
+            result = run_in_subprocess(cell, env=env, timeout=timeout)
+
+        # failures the run couldn't record itself
+        if result["status"] in ("error", "timeout", "oom", "crash"):
+            write_cell_failure_records(cell, result)
+
+    try:
+        run_scheduled(cells, _run_cell, cpu_sets, gb_per_sf=gb_per_sf)
+    finally:
+        for worker in workers.values():
+            worker.stop()
+        flush_monitor_results()
+
+
+def get_cell_key(cell: dict) -> tuple:
+    return (
+        cell["system"],
+        cell["sf"],
+        cell["n_partitions"],
+        cell["queries"][0],
+        cell["file_type"],
+        cell["decimal_to_float"],
+        cell["layout"],
+        cell["schema_mode"],
+        cell["load_mode"],
+        cell["shm_cache"],
+        cell["cache_state"],
+        cell["data_root"],
+        cell["storage_options"]["latency_ms"],
+        cell["storage_options"]["bandwidth_mbps"],
+        cell["storage_options"]["block_cache"] is not None,
+    )
+
+
+def get_done_counts(session_id: str = None, instance_type: str = None) -> dict:
     """
-    combine JSON files as Parquet
+    count successful and failed records per run key
     """
-    file_id = str(uuid.uuid4())
+    results_dir = get_results_dir()
+    if not os.path.exists(results_dir):
+        return {}
+
+    # records buffered by an interrupted run are only in its write-ahead log
+    recover_wal(results_dir)
+    if not any(
+        file_name.endswith(".parquet")
+        for _, _, file_names in os.walk(results_dir)
+        for file_name in file_names
+    ):
+        return {}
+
+    t = read_monitor_results()
+    if session_id is not None:
+        t = t.filter(t["session_id"] == session_id)
+    if instance_type is not None:
+        t = t.filter(t["instance_type"] == instance_type)
+    # NOTE: records from before a field was added don't have it
+    for column, default in RUN_KEY_DEFAULTS.items():
+        if column in t.columns:
+            t = t.mutate(**{column: t[column].fill_null(default)})
+        else:
+            t = t.mutate(**{column: ibis.literal(default)})
+
+    # records from before failures were logged have no status, they're ok
+    t = t.mutate(
+        status=ibis.coalesce(t["status"], "ok")
+        if "status" in t.columns
+        else ibis.literal("ok")
+    )
+
+    key = [
+        "system",
+        "sf",
+        "n_partitions",
+        "query_number",
+        "file_type",
+        "floats",
+        *RUN_KEY_DEFAULTS,
+    ]
+    t = t.group_by(key).agg(
+        ok=(t["status"] == "ok").sum(),
+        failed=(t["status"] != "ok").sum(),
+    )
+
+    return {
+        tuple(row[k] for k in key): {"ok": row["ok"], "failed": row["failed"]}
+        for row in t.to_pyarrow().to_pylist()
+    }
+
+
+def get_run_cmd(cell: dict) -> str:
+    cmd = f"bench tpch run {cell['system']} -s {cell['sf']} -n {cell['n_partitions']}"
+    cmd += "".join(f" -q {q}" for q in cell["queries"])
+    cmd += f" -i '{cell['instance_type']}' --session-id {cell['session_id']}"
+    cmd += f" --format {cell['file_type']}"
+    cmd += " --decimal-to-float" if cell["decimal_to_float"] else ""
+    cmd += f" --warmup {cell['warmup']} --repeat {cell['iterations']}"
+    cmd += " --phases" if cell["phases"] else ""
+    cmd += f" --sample-interval-ms {cell['sample_interval_ms']}"
+    cmd += " --sample-detail" if cell["sample_detail"] else ""
+    cmd += f" --memory-limit {cell['memory_limit']}" if cell["memory_limit"] else ""
+    cmd += f" --layout {cell['layout']}"
+    cmd += f" --schema-mode {cell['schema_mode']}"
+    cmd += f" --load {cell['load_mode']}"
+    cmd += " --shm-cache" if cell["shm_cache"] else ""
+    cmd += f" --shm-cache-gb {cell['shm_cache_gb']}" if cell["shm_cache_gb"] else ""
+    cmd += f" --cache-state {cell['cache_state']}"
+    cmd += f" --data-root {cell['data_root']}"
+    storage_options = cell["storage_options"]
+    cmd += f" --latency-ms {storage_options['latency_ms']}"
+    cmd += f" --bandwidth-mbps {storage_options['bandwidth_mbps']}"
+    if storage_options["block_cache"]:
+        cmd += f" --block-cache {storage_options['block_cache']}"
+    return cmd
+
+
+def get_memory_limit_bytes(cell: dict) -> int:
+    return int(cell["memory_limit"] * 1024**3) if cell["memory_limit"] else None
+
+
+def run_in_subprocess(cell: dict, env: dict = None, timeout: float = None) -> dict:
+    cmd = get_run_cmd(cell)
+
+    log.info(f"running: {cmd}")
+    proc = subprocess.Popen(cmd, shell=True, env={**os.environ, **(env or {})})
+
+    def _is_done(poll_interval: float) -> bool:
+        try:
+            proc.wait(timeout=poll_interval)
+        except subprocess.TimeoutExpired:
+            return False
+        return True
+
+    result = watch(
+        proc.pid,
+        _is_done,
+        timeout=timeout,
+        memory_limit=get_memory_limit_bytes(cell),
+    )
+    proc.wait()
+
+    if result["status"] == "ok" and proc.returncode != 0:
+        log.info(f"failed to run: {cmd}")
+        # NOTE: SIGKILL from outside the watchdog is most likely the OOM killer
+        if proc.returncode == -9:
+            result["status"] = "oom"
+        elif proc.returncode < 0:
+            result["status"] = "crash"
+        else:
+            result["status"] = "error"
 
-    con = ibis.connect("duckdb://")
-    t = con.read_json(f"{get_raw_json_dir()}/file_id=*.json")
-    t = t.mutate(instance_type=ibis.literal(instance_type))
+    log.info(f"finished running: {cmd}")
+    return result
 
-    file_path = os.path.join(get_cache_dir(), f"file_id={file_id}.parquet")
 
-    log.info(f"\twriting monitor data to {file_path}...")
-    t.to_parquet(file_path)
-    log.info(f"\tdone writing monitor data to {file_path}...")
+def run_on_worker(
+    cell: dict,
+    workers: dict,
+    recycle_every: int = None,
+    slot: int = 0,
+    env: dict = None,
+    timeout: float = None,
+) -> dict:
+    # each scheduler slot has its own workers, pinned to the slot's CPU set
+    system = cell["system"]
+    if (slot, system) not in workers:
+        workers[(slot, system)] = Worker(system, recycle_every=recycle_every, env=env)
+
+    log.info(f"running on {system} worker: {cell}")
+    result = workers[(slot, system)].run(
+        cell, timeout=timeout, memory_limit=get_memory_limit_bytes(cell)
+    )
+    if result["status"] != "ok":
+        log.info(f"failed to run on {system} worker ({result['status']}): {cell}")
+
+    log.info(f"finished running on {system} worker: {cell}")
+    return result
+
+
+def write_cell_failure_records(cell: dict, result: dict):
+    for q in cell["queries"]:
+        record = get_run_record(
+            session_id=cell["session_id"],
+            instance_type=cell["instance_type"],
+            system=cell["system"],
+            sf=cell["sf"],
+            n_partitions=cell["n_partitions"],
+            query_number=q,
+            file_type=cell["file_type"],
+            decimal_to_float=cell["decimal_to_float"],
+            layout=cell["layout"],
+            schema_mode=cell["schema_mode"],
+            load_mode=cell["load_mode"],
+            shm_cache=cell["shm_cache"],
+            cache_state=cell["cache_state"],
+            data_root=cell["data_root"],
+            storage_options=cell["storage_options"],
+        )
+        write_failure_record(
+            record,
+            result["status"],
+            result["elapsed_seconds"],
+            peak_rss_bytes=result["peak_rss_bytes"],
+        )
+
+
+@app.command()
+def combine_json(
+    instance_type: str = typer.Argument(
+        None, help="instance type for records without one"
+    ),
+):
+    """
+    combine new JSON files as Parquet
+    """
+    n_records = ingest_raw_json(get_raw_json_dir(), get_cache_dir(), instance_type)
+    log.info(f"done combining {n_records} new records into {get_cache_dir()}")
+
+
+@app.command()
+def compact():
+    """
+    compact the results log
+    """
+    log.info(f"compacting results log at {get_results_dir()}...")
+    n_compacted = compact_results(get_results_dir())
+    log.info(f"done compacting {n_compacted} files")
 
 
 if __name__ == "__main__":
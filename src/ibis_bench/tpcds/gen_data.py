@@ -2,65 +2,188 @@ import os
 import ibis
 
 from ibis_bench.utils.logging import log
+from ibis_bench.utils.storage import DEFAULT_DATA_ROOT
+from ibis_bench.utils.manifest import build_manifest, read_manifest, write_manifest
+from ibis_bench.utils.csv_export import (
+    export_dataset,
+    get_csv_extension,
+    get_csv_options,
+    set_csv_schemas,
+    write_csv,
+)
+from ibis_bench.utils.ipc import IPC_EXTENSION, get_ipc_options, write_ipc
+from ibis_bench.utils.layout import (
+    DEFAULT_LAYOUT,
+    cast_decimals,
+    get_layout_dir,
+    get_layout_name,
+    write_parquet,
+)
 
 
-def get_data_dir(sf, csv: bool = False):
-    dir_name = "csv" if csv else "parquet"
-    return os.path.join("tpcds_data", dir_name, f"sf={sf}")
+TABLE_NAMES = [
+    "call_center",
+    "catalog_page",
+    "catalog_returns",
+    "catalog_sales",
+    "customer",
+    "customer_address",
+    "customer_demographics",
+    "date_dim",
+    "household_demographics",
+    "income_band",
+    "inventory",
+    "item",
+    "promotion",
+    "reason",
+    "ship_mode",
+    "store",
+    "store_returns",
+    "store_sales",
+    "time_dim",
+    "warehouse",
+    "web_page",
+    "web_returns",
+    "web_sales",
+    "web_site",
+]
 
 
-def generate_data(sf, csv: bool = False):
-    log.info(f"generating data for sf={sf}...")
+def get_data_dir(
+    sf,
+    csv: bool = False,
+    layout: str = DEFAULT_LAYOUT,
+    ipc: bool = False,
+    data_root: str = DEFAULT_DATA_ROOT,
+):
+    dir_name = "ipc" if ipc else "csv" if csv else "parquet"
+    data_dir = get_layout_dir(os.path.join("tpcds_data", dir_name, f"sf={sf}"), layout)
+    if data_root != DEFAULT_DATA_ROOT:
+        data_dir = f"{data_root.rstrip('/')}/{data_dir}"
+    return data_dir
+
+
+def generate_data(
+    sf,
+    csv: bool = False,
+    layout: dict = None,
+    csv_options: dict = None,
+    ipc: bool = False,
+    ipc_options: dict = None,
+):
+    csv_options = csv_options or get_csv_options()
+    ipc_options = ipc_options or get_ipc_options()
+    layout_name = get_layout_name(layout)
+    log.info(f"generating data for sf={sf}, layout={layout_name}...")
 
     con = ibis.connect("duckdb://")
     con.raw_sql("PRAGMA disable_progress_bar;")
 
-    parquet_data_directory = get_data_dir(sf)
-    csv_data_directory = get_data_dir(sf, csv=True)
+    parquet_data_directory = get_data_dir(sf, layout=layout_name)
+    csv_data_directory = get_data_dir(sf, csv=True, layout=layout_name)
+    ipc_data_directory = get_data_dir(sf, layout=layout_name, ipc=True)
 
-    if not os.path.exists(parquet_data_directory):
+    # NOTE: the manifest is written last, so a dataset with one is complete
+    if read_manifest(parquet_data_directory) is None:
         con.raw_sql(f"call dsdgen(sf={sf})")
         for table in con.list_tables():
+            t = con.table(table)
+            # NOTE: float layouts are cast once here, rather than by each query
+            if (layout or {}).get("floats"):
+                t = cast_decimals(t)
             os.makedirs(os.path.join(parquet_data_directory, table), exist_ok=True)
             if csv:
                 os.makedirs(os.path.join(csv_data_directory, table), exist_ok=True)
+            if ipc:
+                os.makedirs(os.path.join(ipc_data_directory, table), exist_ok=True)
             log.info(
                 f"\twriting {os.path.join(parquet_data_directory, table, f'{0:04d}.parquet')}..."
             )
-            con.table(table).to_parquet(
-                os.path.join(parquet_data_directory, table, f"{0:04d}.parquet")
-            )
+            if layout:
+                write_parquet(
+                    t,
+                    os.path.join(parquet_data_directory, table, f"{0:04d}.parquet"),
+                    layout,
+                )
+            else:
+                t.to_parquet(
+                    os.path.join(parquet_data_directory, table, f"{0:04d}.parquet")
+                )
             log.info(
                 f"\tdone writing {os.path.join(parquet_data_directory, table, f'{0:04d}.parquet')}"
             )
             if csv:
-                log.info(
-                    f"\twriting {os.path.join(csv_data_directory, table, f'{0:04d}.csv')}..."
+                csv_file_path = os.path.join(
+                    csv_data_directory,
+                    table,
+                    f"{0:04d}{get_csv_extension(csv_options)}",
                 )
-                con.table(table).to_csv(
-                    os.path.join(csv_data_directory, table, f"{0:04d}.csv")
-                )
-                log.info(
-                    f"\tdone writing {os.path.join(csv_data_directory, table, f'{0:04d}.csv')}"
+                log.info(f"\twriting {csv_file_path}...")
+                write_csv(t, csv_file_path, csv_options)
+                log.info(f"\tdone writing {csv_file_path}")
+            if ipc:
+                ipc_file_path = os.path.join(
+                    ipc_data_directory, table, f"{0:04d}{IPC_EXTENSION}"
                 )
+                log.info(f"\twriting {ipc_file_path}...")
+                write_ipc(t, ipc_file_path, ipc_options)
+                log.info(f"\tdone writing {ipc_file_path}")
 
             con.drop_table(table)
+
+        # the writer options of each file type, recorded in its manifest
+        file_options = {
+            "csv": {"csv_options": csv_options},
+            "ipc": {"ipc_options": ipc_options},
+        }
+        for file_type, data_directory in (
+            [("parquet", parquet_data_directory)]
+            + ([("csv", csv_data_directory)] if csv else [])
+            + ([("ipc", ipc_data_directory)] if ipc else [])
+        ):
+            manifest = build_manifest(
+                data_directory,
+                benchmark="tpcds",
+                sf=sf,
+                file_type=file_type,
+                layout=layout_name,
+                **file_options.get(file_type, {}),
+            )
+            if file_type == "csv":
+                set_csv_schemas(manifest, read_manifest(parquet_data_directory))
+            write_manifest(data_directory, manifest)
     else:
         log.info(f"\tdata already exists at {parquet_data_directory}, skipping...")
 
 
-def _parquets_to_csvs():
-    con = ibis.connect("duckdb://")
-    for root, _, files in os.walk(os.path.join("tpcds_data", "parquet")):
-        for file in files:
-            if file.endswith(".parquet"):
-                parquet_file = os.path.join(root, file)
-                csv_file = parquet_file.replace("parquet", "csv")
-
-                os.makedirs(os.path.dirname(csv_file), exist_ok=True)
+def _parquets_to_csvs(jobs: int = None, csv_options: dict = None):
+    """
+    write every Parquet dataset (with a manifest) as a CSV dataset, in parallel
+    """
+    csv_options = csv_options or get_csv_options()
+    parquet_root = os.path.join("tpcds_data", "parquet")
+    for root, dir_names, _ in os.walk(parquet_root):
+        dir_names.sort()
+        manifest = read_manifest(root)
+        if manifest is None:
+            continue
 
-                log.info(f"reading {parquet_file}...")
-                t = con.read_parquet(parquet_file)
+        csv_directory = os.path.join(
+            "tpcds_data", "csv", os.path.relpath(root, parquet_root)
+        )
+        if read_manifest(csv_directory) is not None:
+            log.info(f"CSV data already exists at {csv_directory}, skipping...")
+            continue
 
-                log.info(f"writing {csv_file}...")
-                t.to_csv(csv_file)
+        log.info(f"writing {root} to {csv_directory}...")
+        file_infos = export_dataset(root, csv_directory, csv_options, jobs=jobs)
+        csv_manifest = build_manifest(
+            csv_directory,
+            file_infos,
+            benchmark="tpcds",
+            sf=manifest["sf"],
+            file_type="csv",
+            layout=manifest.get("layout", DEFAULT_LAYOUT),
+            csv_options=csv_options,
+        )
+        write_manifest(csv_directory, set_csv_schemas(csv_manifest, manifest))
@@ -3,15 +3,134 @@ import polars as pl
 import ibis.selectors as s
 import polars.selectors as ps
 
-from ibis_bench.tpcds.gen_data import get_data_dir
+from ibis_bench.utils.layout import DEFAULT_LAYOUT, get_float_schema, is_float_layout
+from ibis_bench.utils.csv_export import (
+    DEFAULT_SCHEMA_MODE,
+    read_csv,
+    read_csv_options,
+)
+from ibis_bench.utils.ipc import read_ipc, read_ipc_options
+from ibis_bench.utils.storage import DEFAULT_DATA_ROOT, is_url, read_remote
+from ibis_bench.tpcds.gen_data import TABLE_NAMES, get_data_dir
+from ibis_bench.tpcds.schemas import SCHEMAS
 
 
 def get_ibis_tables(
-    sf, con=ibis.connect("duckdb://"), csv=False, decimal_to_float=False
+    sf,
+    con=ibis.connect("duckdb://"),
+    csv=False,
+    decimal_to_float=False,
+    layout=DEFAULT_LAYOUT,
+    schema_mode=DEFAULT_SCHEMA_MODE,
+    ipc=False,
+    data_root=DEFAULT_DATA_ROOT,
+    storage_options=None,
 ):
-    data_directory = get_data_dir(sf, csv=csv)
+    data_directory = get_data_dir(
+        sf, csv=csv, layout=layout, ipc=ipc, data_root=data_root
+    )
 
-    if not csv:
+    if is_url(data_directory):
+        (
+            call_center,
+            catalog_page,
+            catalog_returns,
+            catalog_sales,
+            customer,
+            customer_address,
+            customer_demographics,
+            date_dim,
+            household_demographics,
+            income_band,
+            inventory,
+            item,
+            promotion,
+            reason,
+            ship_mode,
+            store,
+            store_returns,
+            store_sales,
+            time_dim,
+            warehouse,
+            web_page,
+            web_returns,
+            web_sales,
+            web_site,
+        ) = (
+            read_remote(
+                con,
+                f"{data_directory}/{table_name}",
+                table_name,
+                "ipc" if ipc else "csv" if csv else "parquet",
+                storage_options,
+            )
+            for table_name in TABLE_NAMES
+        )
+    elif ipc:
+        ipc_options = read_ipc_options(data_directory)
+        call_center = read_ipc(
+            con, f"{data_directory}/call_center", "call_center", ipc_options
+        )
+        catalog_page = read_ipc(
+            con, f"{data_directory}/catalog_page", "catalog_page", ipc_options
+        )
+        catalog_returns = read_ipc(
+            con, f"{data_directory}/catalog_returns", "catalog_returns", ipc_options
+        )
+        catalog_sales = read_ipc(
+            con, f"{data_directory}/catalog_sales", "catalog_sales", ipc_options
+        )
+        customer = read_ipc(con, f"{data_directory}/customer", "customer", ipc_options)
+        customer_address = read_ipc(
+            con, f"{data_directory}/customer_address", "customer_address", ipc_options
+        )
+        customer_demographics = read_ipc(
+            con,
+            f"{data_directory}/customer_demographics",
+            "customer_demographics",
+            ipc_options,
+        )
+        date_dim = read_ipc(con, f"{data_directory}/date_dim", "date_dim", ipc_options)
+        household_demographics = read_ipc(
+            con,
+            f"{data_directory}/household_demographics",
+            "household_demographics",
+            ipc_options,
+        )
+        income_band = read_ipc(
+            con, f"{data_directory}/income_band", "income_band", ipc_options
+        )
+        inventory = read_ipc(
+            con, f"{data_directory}/inventory", "inventory", ipc_options
+        )
+        item = read_ipc(con, f"{data_directory}/item", "item", ipc_options)
+        promotion = read_ipc(
+            con, f"{data_directory}/promotion", "promotion", ipc_options
+        )
+        reason = read_ipc(con, f"{data_directory}/reason", "reason", ipc_options)
+        ship_mode = read_ipc(
+            con, f"{data_directory}/ship_mode", "ship_mode", ipc_options
+        )
+        store = read_ipc(con, f"{data_directory}/store", "store", ipc_options)
+        store_returns = read_ipc(
+            con, f"{data_directory}/store_returns", "store_returns", ipc_options
+        )
+        store_sales = read_ipc(
+            con, f"{data_directory}/store_sales", "store_sales", ipc_options
+        )
+        time_dim = read_ipc(con, f"{data_directory}/time_dim", "time_dim", ipc_options)
+        warehouse = read_ipc(
+            con, f"{data_directory}/warehouse", "warehouse", ipc_options
+        )
+        web_page = read_ipc(con, f"{data_directory}/web_page", "web_page", ipc_options)
+        web_returns = read_ipc(
+            con, f"{data_directory}/web_returns", "web_returns", ipc_options
+        )
+        web_sales = read_ipc(
+            con, f"{data_directory}/web_sales", "web_sales", ipc_options
+        )
+        web_site = read_ipc(con, f"{data_directory}/web_site", "web_site", ipc_options)
+    elif not csv:
         call_center = con.read_parquet(
             f"{data_directory}/call_center/*.parquet", table_name="call_center"
         )
@@ -86,73 +205,172 @@ def get_ibis_tables(
             f"{data_directory}/web_site/*.parquet", table_name="web_site"
         )
     else:
-        call_center == con.read_csv(
-            f"{data_directory}/call_center/*.csv", table_name="call_center"
-        )
-        catalog_page = con.read_csv(
-            f"{data_directory}/catalog_page/*.csv", table_name="catalog_page"
-        )
-        catalog_returns = con.read_csv(
-            f"{data_directory}/catalog_returns/*.csv", table_name="catalog_returns"
-        )
-        catalog_sales = con.read_csv(
-            f"{data_directory}/catalog_sales/*.csv", table_name="catalog_sales"
-        )
-        customer = con.read_csv(
-            f"{data_directory}/customer/*.csv", table_name="customer"
-        )
-        customer_address = con.read_csv(
-            f"{data_directory}/customer_address/*.csv", table_name="customer_address"
-        )
-        customer_demographics = con.read_csv(
-            f"{data_directory}/customer_demographics/*.csv",
-            table_name="customer_demographics",
-        )
-        date_dim = con.read_csv(
-            f"{data_directory}/date_dim/*.csv", table_name="date_dim"
-        )
-        household_demographics = con.read_csv(
-            f"{data_directory}/household_demographics/*.csv",
-            table_name="household_demographics",
-        )
-        income_band = con.read_csv(
-            f"{data_directory}/income_band/*.csv", table_name="income_band"
-        )
-        inventory = con.read_csv(
-            f"{data_directory}/inventory/*.csv", table_name="inventory"
-        )
-        item = con.read_csv(f"{data_directory}/item/*.csv", table_name="item")
-        promotion = con.read_csv(
-            f"{data_directory}/promotion/*.csv", table_name="promotion"
-        )
-        reason = con.read_csv(f"{data_directory}/reason/*.csv", table_name="reason")
-        ship_mode = con.read_csv(
-            f"{data_directory}/ship_mode/*.csv", table_name="ship_mode"
-        )
-        store = con.read_csv(f"{data_directory}/store/*.csv", table_name="store")
-        store_returns = con.read_csv(
-            f"{data_directory}/store_returns/*.csv", table_name="store_returns"
-        )
-        store_sales = con.read_csv(
-            f"{data_directory}/store_sales/*.csv", table_name="store_sales"
-        )
-        time_dim = con.read_csv(
-            f"{data_directory}/time_dim/*.csv", table_name="time_dim"
-        )
-        warehouse = con.read_csv(
-            f"{data_directory}/warehouse/*.csv", table_name="warehouse"
-        )
-        web_page = con.read_csv(
-            f"{data_directory}/web_page/*.csv", table_name="web_page"
-        )
-        web_returns = con.read_csv(
-            f"{data_directory}/web_returns/*.csv", table_name="web_returns"
-        )
-        web_sales = con.read_csv(
-            f"{data_directory}/web_sales/*.csv", table_name="web_sales"
-        )
-        web_site = con.read_csv(
-            f"{data_directory}/web_site/*.csv", table_name="web_site"
+        csv_options = read_csv_options(data_directory)
+        schemas = SCHEMAS if schema_mode == "declared" else {}
+        # float layouts store decimal columns as float64
+        if is_float_layout(layout):
+            schemas = {
+                name: get_float_schema(schema) for name, schema in schemas.items()
+            }
+        call_center = read_csv(
+            con,
+            f"{data_directory}/call_center",
+            "call_center",
+            csv_options,
+            schemas.get("call_center"),
+        )
+        catalog_page = read_csv(
+            con,
+            f"{data_directory}/catalog_page",
+            "catalog_page",
+            csv_options,
+            schemas.get("catalog_page"),
+        )
+        catalog_returns = read_csv(
+            con,
+            f"{data_directory}/catalog_returns",
+            "catalog_returns",
+            csv_options,
+            schemas.get("catalog_returns"),
+        )
+        catalog_sales = read_csv(
+            con,
+            f"{data_directory}/catalog_sales",
+            "catalog_sales",
+            csv_options,
+            schemas.get("catalog_sales"),
+        )
+        customer = read_csv(
+            con,
+            f"{data_directory}/customer",
+            "customer",
+            csv_options,
+            schemas.get("customer"),
+        )
+        customer_address = read_csv(
+            con,
+            f"{data_directory}/customer_address",
+            "customer_address",
+            csv_options,
+            schemas.get("customer_address"),
+        )
+        customer_demographics = read_csv(
+            con,
+            f"{data_directory}/customer_demographics",
+            "customer_demographics",
+            csv_options,
+            schemas.get("customer_demographics"),
+        )
+        date_dim = read_csv(
+            con,
+            f"{data_directory}/date_dim",
+            "date_dim",
+            csv_options,
+            schemas.get("date_dim"),
+        )
+        household_demographics = read_csv(
+            con,
+            f"{data_directory}/household_demographics",
+            "household_demographics",
+            csv_options,
+            schemas.get("household_demographics"),
+        )
+        income_band = read_csv(
+            con,
+            f"{data_directory}/income_band",
+            "income_band",
+            csv_options,
+            schemas.get("income_band"),
+        )
+        inventory = read_csv(
+            con,
+            f"{data_directory}/inventory",
+            "inventory",
+            csv_options,
+            schemas.get("inventory"),
+        )
+        item = read_csv(
+            con, f"{data_directory}/item", "item", csv_options, schemas.get("item")
+        )
+        promotion = read_csv(
+            con,
+            f"{data_directory}/promotion",
+            "promotion",
+            csv_options,
+            schemas.get("promotion"),
+        )
+        reason = read_csv(
+            con,
+            f"{data_directory}/reason",
+            "reason",
+            csv_options,
+            schemas.get("reason"),
+        )
+        ship_mode = read_csv(
+            con,
+            f"{data_directory}/ship_mode",
+            "ship_mode",
+            csv_options,
+            schemas.get("ship_mode"),
+        )
+        store = read_csv(
+            con, f"{data_directory}/store", "store", csv_options, schemas.get("store")
+        )
+        store_returns = read_csv(
+            con,
+            f"{data_directory}/store_returns",
+            "store_returns",
+            csv_options,
+            schemas.get("store_returns"),
+        )
+        store_sales = read_csv(
+            con,
+            f"{data_directory}/store_sales",
+            "store_sales",
+            csv_options,
+            schemas.get("store_sales"),
+        )
+        time_dim = read_csv(
+            con,
+            f"{data_directory}/time_dim",
+            "time_dim",
+            csv_options,
+            schemas.get("time_dim"),
+        )
+        warehouse = read_csv(
+            con,
+            f"{data_directory}/warehouse",
+            "warehouse",
+            csv_options,
+            schemas.get("warehouse"),
+        )
+        web_page = read_csv(
+            con,
+            f"{data_directory}/web_page",
+            "web_page",
+            csv_options,
+            schemas.get("web_page"),
+        )
+        web_returns = read_csv(
+            con,
+            f"{data_directory}/web_returns",
+            "web_returns",
+            csv_options,
+            schemas.get("web_returns"),
+        )
+        web_sales = read_csv(
+            con,
+            f"{data_directory}/web_sales",
+            "web_sales",
+            csv_options,
+            schemas.get("web_sales"),
+        )
+        web_site = read_csv(
+            con,
+            f"{data_directory}/web_site",
+            "web_site",
+            csv_options,
+            schemas.get("web_site"),
         )
 
     all_tables = (
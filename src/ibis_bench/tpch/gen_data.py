@@ -1,72 +1,664 @@
 import os
+import math
+import time
 import ibis
+import shutil
+import psutil
+import pyarrow as pa
+import multiprocessing as mp
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from ibis_bench.utils.logging import log
+from ibis_bench.utils.storage import DEFAULT_DATA_ROOT
+from ibis_bench.utils.manifest import (
+    MANIFEST_FILE_NAME,
+    build_manifest,
+    get_file_info,
+    read_manifest,
+    write_manifest,
+)
+from ibis_bench.utils.csv_export import (
+    CSVWriter,
+    export_dataset,
+    get_csv_extension,
+    get_csv_options,
+    is_csv_path,
+    set_csv_schemas,
+    write_csv,
+)
+from ibis_bench.utils.ipc import (
+    IPC_EXTENSION,
+    get_ipc_options,
+    is_ipc_path,
+    open_ipc_writer,
+    write_ipc,
+)
+from ibis_bench.utils.layout import (
+    DEFAULT_LAYOUT,
+    cast_decimals,
+    get_batch_size,
+    get_layout_dir,
+    get_layout_name,
+    get_partition_columns,
+    open_parquet_writer,
+    sort_table,
+    write_parquet,
+)
+
+TABLE_NAMES = [
+    "customer",
+    "lineitem",
+    "nation",
+    "orders",
+    "part",
+    "partsupp",
+    "region",
+    "supplier",
+]
+
+# date columns fact tables are hive-partitioned by
+PARTITION_COLUMNS = {
+    "lineitem": "l_shipdate",
+    "orders": "o_orderdate",
+}
+
+# file types a dataset can be written (and read) as
+FILE_TYPES = ["parquet", "csv", "ipc"]
+
+# rough peak memory of generating a whole scale factor in one step
+DEFAULT_GEN_GB_PER_SF = 2.0
+
+
+def get_data_dir(
+    sf,
+    n_partitions,
+    csv: bool = False,
+    layout: str = DEFAULT_LAYOUT,
+    ipc: bool = False,
+    data_root: str = DEFAULT_DATA_ROOT,
+):
+    dir_name = "ipc" if ipc else "csv" if csv else "parquet"
+    data_dir = get_layout_dir(
+        os.path.join("tpch_data", dir_name, f"sf={sf}", f"n={n_partitions}"), layout
+    )
+    # NOTE: data can be read from a URL (e.g. s3://bucket/prefix), with the
+    # same layout as the local tpch_data directory
+    if data_root != DEFAULT_DATA_ROOT:
+        data_dir = f"{data_root.rstrip('/')}/{data_dir}"
+    return data_dir
+
+
+def get_n_jobs(
+    sf,
+    n_partitions,
+    jobs: int = None,
+    gb_per_sf: float = DEFAULT_GEN_GB_PER_SF,
+    memory_limit: float = None,
+    memory_budget: int = None,
+) -> int:
+    """
+    number of steps to generate concurrently, bounded by cores and memory
+    """
+    memory_budget = memory_budget or psutil.virtual_memory().total
+    step_bytes = sf / n_partitions * gb_per_sf * 1024**3
+    if memory_limit:
+        step_bytes = min(step_bytes, memory_limit * 1024**3)
+
+    max_jobs = min(n_partitions, os.cpu_count(), int(memory_budget // step_bytes))
+    return max(min(jobs or max_jobs, max_jobs), 1)
+
+
+def _get_tmp_path(file_path: str) -> str:
+    return os.path.join(
+        os.path.dirname(file_path), f".{os.path.basename(file_path)}.tmp"
+    )
+
+
+def _write_atomic(
+    t,
+    file_path: str,
+    csv: bool = False,
+    layout: dict = None,
+    csv_options: dict = None,
+    ipc_options: dict = None,
+):
+    # write to a temporary file and rename, so partial files are never read
+    tmp_path = _get_tmp_path(file_path)
+    if csv:
+        write_csv(t, tmp_path, csv_options)
+    elif is_ipc_path(file_path):
+        write_ipc(t, tmp_path, ipc_options)
+    elif layout:
+        write_parquet(t, tmp_path, layout)
+    else:
+        t.to_parquet(tmp_path)
+    os.replace(tmp_path, file_path)
+
+
+def _open_writer(
+    file_path: str,
+    schema: pa.Schema,
+    layout: dict = None,
+    csv_options: dict = None,
+    ipc_options: dict = None,
+):
+    if is_csv_path(file_path):
+        return CSVWriter(_get_tmp_path(file_path), schema, csv_options)
+    if is_ipc_path(file_path):
+        return open_ipc_writer(_get_tmp_path(file_path), schema, ipc_options)
+    return open_parquet_writer(_get_tmp_path(file_path), schema, layout)
+
+
+def get_n_chunks(sf, n_partitions, memory_limit: float) -> int:
+    """
+    number of dbgen chunks per partition, so each chunk fits in `memory_limit` GB
+    """
+    return max(math.ceil(sf / n_partitions * DEFAULT_GEN_GB_PER_SF / memory_limit), 1)
+
+
+def _connect(name: str, memory_limit: float = None, temp_dir: str = None):
+    if not memory_limit:
+        return ibis.connect("duckdb://"), None
+
+    # NOTE: an on-disk database with a spill directory, so DuckDB can evict
+    # generated tables from memory instead of failing at the memory limit
+    temp_dir = temp_dir or os.path.join("tpch_data", ".tmp")
+    os.makedirs(temp_dir, exist_ok=True)
+    db_path = os.path.join(temp_dir, f"{name}.duckdb")
+    _remove_database(db_path)
+
+    con = ibis.connect(f"duckdb://{db_path}")
+    con.raw_sql(f"SET memory_limit = '{memory_limit}GB'")
+    con.raw_sql(f"SET temp_directory = '{db_path}.spill'")
+    return con, db_path
+
+
+def _remove_database(db_path: str):
+    for path in [db_path, f"{db_path}.wal"]:
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(f"{db_path}.spill", ignore_errors=True)
+
+
+def _get_done_path(data_directory: str, table: str, step: int) -> str:
+    # NOTE: a step of a hive-partitioned table writes a file per partition, so
+    # a marker file records that all of them were written
+    return os.path.join(data_directory, table, f".{step:04d}.done")
+
+
+def _get_hive_partitions(t, table: str, layout: dict = None) -> list[tuple]:
+    """
+    (partition directory, table) pairs, a single unpartitioned pair by default
+    """
+    partition_by = (layout or {}).get("partition_by")
+    if not partition_by or table not in PARTITION_COLUMNS:
+        return [("", t)]
+
+    date = t[PARTITION_COLUMNS[table]]
+    keys = {"year": date.year()}
+    if partition_by == "month":
+        keys["month"] = date.month()
+
+    values = t.select(**keys).distinct().order_by(list(keys)).to_pyarrow().to_pylist()
+    return [
+        (
+            os.path.join(*[f"{key}={value}" for key, value in row.items()]),
+            t.filter([keys[key] == value for key, value in row.items()]),
+        )
+        for row in values
+    ]
+
+
+def _table_step_exists(
+    sf,
+    n_partitions,
+    table: str,
+    step: int,
+    csv: bool = False,
+    layout: str = DEFAULT_LAYOUT,
+    csv_options: dict = None,
+    ipc: bool = False,
+) -> bool:
+    data_directory = get_data_dir(sf, n_partitions, layout=layout)
+    file_paths = [
+        _get_done_path(data_directory, table, step)
+        if table in PARTITION_COLUMNS and get_partition_columns(layout)
+        else os.path.join(data_directory, table, f"{step:04d}.parquet")
+    ]
+    if csv:
+        file_paths.append(
+            os.path.join(
+                get_data_dir(sf, n_partitions, csv=True, layout=layout),
+                table,
+                f"{step:04d}{get_csv_extension(csv_options)}",
+            )
+        )
+    if ipc:
+        file_paths.append(
+            os.path.join(
+                get_data_dir(sf, n_partitions, layout=layout, ipc=True),
+                table,
+                f"{step:04d}{IPC_EXTENSION}",
+            )
+        )
+    return all(os.path.exists(file_path) for file_path in file_paths)
 
 
-def get_data_dir(sf, n_partitions, csv: bool = False):
-    dir_name = "csv" if csv else "parquet"
-    return os.path.join("tpch_data", dir_name, f"sf={sf}", f"n={n_partitions}")
+def _step_exists(
+    sf,
+    n_partitions,
+    step: int,
+    csv: bool = False,
+    layout: str = DEFAULT_LAYOUT,
+    csv_options: dict = None,
+    ipc: bool = False,
+) -> bool:
+    return all(
+        _table_step_exists(
+            sf,
+            n_partitions,
+            table,
+            step,
+            csv=csv,
+            layout=layout,
+            csv_options=csv_options,
+            ipc=ipc,
+        )
+        for table in TABLE_NAMES
+    )
 
 
-def generate_data(sf, n_partitions, csv: bool = False):
-    log.info(f"generating data for sf={sf}, n={n_partitions}...")
+def generate_step(
+    sf,
+    n_partitions,
+    step: int,
+    csv: bool = False,
+    threads: int = None,
+    memory_limit: float = None,
+    temp_dir: str = None,
+    layout: dict = None,
+    csv_options: dict = None,
+    ipc: bool = False,
+    ipc_options: dict = None,
+):
+    """
+    generate and write a single dbgen step (one file per table)
 
-    con = ibis.connect("duckdb://")
+    with a memory limit (in GB), the step is generated in chunks on an on-disk
+    database and each chunk is streamed to the step's files, so peak memory is
+    bounded independent of the scale factor (and sort keys only sort each chunk)
+
+    tables already written by an interrupted run are skipped
+
+    returns the number of rows and bytes written, the elapsed seconds and the
+    info of each file written (for the manifest)
+    """
+    start_time = time.time()
+
+    # NOTE: each step has its own connection, so steps can run in separate
+    # processes
+    con, db_path = _connect(
+        f"sf={sf}-n={n_partitions}-step={step}",
+        memory_limit=memory_limit,
+        temp_dir=temp_dir,
+    )
     con.raw_sql("PRAGMA disable_progress_bar;")
+    if threads:
+        con.raw_sql(f"SET threads = {threads}")
 
-    parquet_data_directory = get_data_dir(sf, n_partitions)
-    csv_data_directory = get_data_dir(sf, n_partitions, csv=True)
+    layout_name = get_layout_name(layout)
+    parquet_data_directory = get_data_dir(sf, n_partitions, layout=layout_name)
+    csv_data_directory = get_data_dir(sf, n_partitions, csv=True, layout=layout_name)
+    ipc_data_directory = get_data_dir(sf, n_partitions, layout=layout_name, ipc=True)
 
-    if not os.path.exists(parquet_data_directory):
-        for i in range(n_partitions):
-            con.raw_sql(f"call dbgen(sf={sf}, children={n_partitions}, step={i})")
-            for table in con.list_tables():
-                if i == 0:
-                    os.makedirs(
-                        os.path.join(parquet_data_directory, table), exist_ok=True
-                    )
-                    if csv:
-                        os.makedirs(
-                            os.path.join(csv_data_directory, table), exist_ok=True
-                        )
-                log.info(
-                    f"\twriting {os.path.join(parquet_data_directory, table, f'{i:04d}.parquet')}..."
+    n_chunks = get_n_chunks(sf, n_partitions, memory_limit) if memory_limit else 1
+    writers = {}
+    file_paths = []
+    n_rows = 0
+    for chunk in range(n_chunks):
+        con.raw_sql(
+            f"call dbgen(sf={sf}, children={n_partitions * n_chunks}, step={step * n_chunks + chunk})"
+        )
+
+        for table in con.list_tables():
+            if _table_step_exists(
+                sf,
+                n_partitions,
+                table,
+                step,
+                csv=csv,
+                layout=layout_name,
+                csv_options=csv_options,
+                ipc=ipc,
+            ):
+                log.info(f"\tskipping {table} for step {step}, already written")
+                con.drop_table(table)
+                continue
+
+            t = con.table(table)
+            # NOTE: float layouts are cast once here, rather than by each query
+            if (layout or {}).get("floats"):
+                t = cast_decimals(t)
+            # (file path, table) pairs, with a Parquet file per hive partition
+            outputs = [
+                (
+                    os.path.join(
+                        parquet_data_directory, table, partition, f"{step:04d}.parquet"
+                    ),
+                    partition_t,
                 )
-                con.table(table).to_parquet(
-                    os.path.join(parquet_data_directory, table, f"{i:04d}.parquet")
+                for partition, partition_t in _get_hive_partitions(t, table, layout)
+            ]
+            if csv:
+                csv_file_path = os.path.join(
+                    csv_data_directory,
+                    table,
+                    f"{step:04d}{get_csv_extension(csv_options)}",
                 )
-                log.info(
-                    f"\tdone writing {os.path.join(parquet_data_directory, table, f'{i:04d}.parquet')}"
+                outputs.append((csv_file_path, t))
+            if ipc:
+                ipc_file_path = os.path.join(
+                    ipc_data_directory, table, f"{step:04d}{IPC_EXTENSION}"
                 )
-                if csv:
-                    log.info(
-                        f"\twriting {os.path.join(csv_data_directory, table, f'{i:04d}.csv')}..."
-                    )
-                    con.table(table).to_csv(
-                        os.path.join(csv_data_directory, table, f"{i:04d}.csv")
+                outputs.append((ipc_file_path, t))
+
+            for file_path, output_t in outputs:
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                if n_chunks == 1:
+                    log.info(f"\twriting {file_path}...")
+                    _write_atomic(
+                        output_t,
+                        file_path,
+                        csv=is_csv_path(file_path),
+                        layout=layout,
+                        csv_options=csv_options,
+                        ipc_options=ipc_options,
                     )
-                    log.info(
-                        f"\tdone writing {os.path.join(csv_data_directory, table, f'{i:04d}.csv')}"
+                    file_paths.append(file_path)
+                    log.info(f"\tdone writing {file_path}")
+                else:
+                    log.info(f"\twriting chunk {chunk} of {n_chunks} to {file_path}...")
+                    if layout:
+                        output_t = sort_table(output_t, layout)
+                    reader = output_t.to_pyarrow_batches(
+                        chunk_size=get_batch_size(layout)
                     )
+                    if file_path not in writers:
+                        writers[file_path] = _open_writer(
+                            file_path, reader.schema, layout, csv_options, ipc_options
+                        )
+                    for batch in reader:
+                        # NOTE: DuckDB's batches are non-nullable, unlike the schema
+                        writers[file_path].write_table(
+                            pa.Table.from_batches([batch]).cast(reader.schema)
+                        )
 
-                con.drop_table(table)
+            n_rows += t.count().to_pyarrow().as_py()
+            con.drop_table(table)
+
+    for file_path, writer in writers.items():
+        writer.close()
+        os.replace(_get_tmp_path(file_path), file_path)
+        file_paths.append(file_path)
+        log.info(f"\tdone writing {file_path}")
+
+    if (layout or {}).get("partition_by"):
+        for table in PARTITION_COLUMNS:
+            open(_get_done_path(parquet_data_directory, table, step), "w").close()
+
+    if db_path is not None:
+        con.disconnect()
+        _remove_database(db_path)
+
+    # NOTE: computed here, so checksums are computed by the parallel jobs
+    file_infos = {
+        file_path: get_file_info(
+            file_path,
+            header=(csv_options or {}).get("header", True),
+        )
+        for file_path in file_paths
+    }
+
+    return {
+        "step": step,
+        "rows": n_rows,
+        "bytes": sum(info["bytes"] for info in file_infos.values()),
+        "seconds": time.time() - start_time,
+        "files": file_infos,
+    }
+
+
+def _log_throughput(name: str, stats: dict):
+    seconds = max(stats["seconds"], 1e-9)
+    log.info(
+        f"\tdone generating {name} in {stats['seconds']:.1f}s "
+        f"({stats['rows'] / seconds:,.0f} rows/s, {stats['bytes'] / 1024**2 / seconds:.1f} MB/s)"
+    )
+
+
+def generate_data(
+    sf,
+    n_partitions,
+    csv: bool = False,
+    jobs: int = None,
+    memory_limit: float = None,
+    temp_dir: str = None,
+    layout: dict = None,
+    csv_options: dict = None,
+    ipc: bool = False,
+    ipc_options: dict = None,
+):
+    layout_name = get_layout_name(layout)
+    log.info(f"generating data for sf={sf}, n={n_partitions}, layout={layout_name}...")
+
+    # file type to data directory, each with its own manifest
+    data_directories = {"parquet": get_data_dir(sf, n_partitions, layout=layout_name)}
+    if csv:
+        data_directories["csv"] = get_data_dir(
+            sf, n_partitions, csv=True, layout=layout_name
+        )
+    if ipc:
+        data_directories["ipc"] = get_data_dir(
+            sf, n_partitions, layout=layout_name, ipc=True
+        )
+
+    # NOTE: a CSV dataset has a single set of options, recorded in its manifest
+    csv_options = csv_options or get_csv_options()
+    csv_manifest = read_manifest(data_directories.get("csv", ""))
+    if (
+        csv_manifest
+        and (csv_manifest.get("csv_options") or get_csv_options()) != csv_options
+    ):
+        raise ValueError(
+            f"CSV data at {data_directories['csv']} was written with options "
+            f"{csv_manifest.get('csv_options')}, not {csv_options}"
+        )
+    ipc_options = ipc_options or get_ipc_options()
+    ipc_manifest = read_manifest(data_directories.get("ipc", ""))
+    if (
+        ipc_manifest
+        and (ipc_manifest.get("ipc_options") or get_ipc_options()) != ipc_options
+    ):
+        raise ValueError(
+            f"IPC data at {data_directories['ipc']} was written with options "
+            f"{ipc_manifest.get('ipc_options')}, not {ipc_options}"
+        )
+
+    # NOTE: the manifest is written last, so a dataset with one is complete
+    if all(
+        read_manifest(data_directory) for data_directory in data_directories.values()
+    ):
+        log.info(f"\tdata already exists at {data_directories['parquet']}, skipping...")
+        return
+
+    # steps are written atomically, so only missing steps are (re)generated
+    steps = [
+        step
+        for step in range(n_partitions)
+        if not _step_exists(
+            sf,
+            n_partitions,
+            step,
+            csv=csv,
+            layout=layout_name,
+            csv_options=csv_options,
+            ipc=ipc,
+        )
+    ]
+    if not steps:
+        log.info(
+            f"\tall steps exist at {data_directories['parquet']}, writing manifest..."
+        )
+        _write_manifests(
+            data_directories,
+            sf,
+            n_partitions,
+            layout,
+            csv_options=csv_options,
+            ipc_options=ipc_options,
+        )
+        return
+
+    jobs = min(
+        get_n_jobs(sf, n_partitions, jobs=jobs, memory_limit=memory_limit), len(steps)
+    )
+    threads = max(os.cpu_count() // jobs, 1)
+    log.info(f"\tgenerating {len(steps)} steps with {jobs} jobs...")
+
+    start_time = time.time()
+    all_stats = []
+    if jobs == 1:
+        for step in steps:
+            stats = generate_step(
+                sf,
+                n_partitions,
+                step,
+                csv=csv,
+                memory_limit=memory_limit,
+                temp_dir=temp_dir,
+                layout=layout,
+                csv_options=csv_options,
+                ipc=ipc,
+                ipc_options=ipc_options,
+            )
+            _log_throughput(f"step {step}", stats)
+            all_stats.append(stats)
     else:
-        log.info(f"\tdata already exists at {parquet_data_directory}, skipping...")
+        # NOTE: spawn, since forking a process with DuckDB's threads is unsafe
+        with ProcessPoolExecutor(
+            max_workers=jobs, mp_context=mp.get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(
+                    generate_step,
+                    sf,
+                    n_partitions,
+                    step,
+                    csv=csv,
+                    threads=threads,
+                    memory_limit=memory_limit,
+                    temp_dir=temp_dir,
+                    layout=layout,
+                    csv_options=csv_options,
+                    ipc=ipc,
+                    ipc_options=ipc_options,
+                )
+                for step in steps
+            ]
+            for future in as_completed(futures):
+                stats = future.result()
+                _log_throughput(f"step {stats['step']}", stats)
+                all_stats.append(stats)
+
+    _log_throughput(
+        f"sf={sf}, n={n_partitions}",
+        {
+            "rows": sum(stats["rows"] for stats in all_stats),
+            "bytes": sum(stats["bytes"] for stats in all_stats),
+            "seconds": time.time() - start_time,
+        },
+    )
+
+    file_infos = {}
+    for stats in all_stats:
+        file_infos.update(stats["files"])
+    _write_manifests(
+        data_directories,
+        sf,
+        n_partitions,
+        layout,
+        file_infos,
+        csv_options=csv_options,
+        ipc_options=ipc_options,
+    )
+
 
+def _write_manifests(
+    data_directories: dict,
+    sf,
+    n_partitions,
+    layout: dict = None,
+    file_infos: dict = None,
+    csv_options: dict = None,
+    ipc_options: dict = None,
+):
+    # the writer options of each file type, recorded in its manifest
+    file_options = {
+        "csv": {"csv_options": csv_options},
+        "ipc": {"ipc_options": ipc_options},
+    }
+    for file_type, data_directory in data_directories.items():
+        manifest = build_manifest(
+            data_directory,
+            file_infos,
+            benchmark="tpch",
+            sf=sf,
+            n_partitions=n_partitions,
+            file_type=file_type,
+            layout=get_layout_name(layout),
+            layout_options=layout,
+            **file_options.get(file_type, {}),
+        )
+        if file_type == "csv":
+            parquet_data_directory = get_data_dir(
+                sf, n_partitions, layout=get_layout_name(layout)
+            )
+            set_csv_schemas(manifest, read_manifest(parquet_data_directory))
+        write_manifest(data_directory, manifest)
 
-def _parquets_to_csvs():
-    con = ibis.connect("duckdb://")
-    for root, _, files in os.walk(os.path.join("tpch_data", "parquet")):
-        for file in files:
-            if file.endswith(".parquet"):
-                parquet_file = os.path.join(root, file)
-                csv_file = parquet_file.replace("parquet", "csv")
 
-                os.makedirs(os.path.dirname(csv_file), exist_ok=True)
+def _parquets_to_csvs(jobs: int = None, csv_options: dict = None):
+    """
+    write every Parquet dataset (with a manifest) as a CSV dataset, in parallel
+    """
+    csv_options = csv_options or get_csv_options()
+    parquet_root = os.path.join("tpch_data", "parquet")
+    for root, dir_names, file_names in os.walk(parquet_root):
+        dir_names.sort()
+        manifest = read_manifest(root) if MANIFEST_FILE_NAME in file_names else None
+        if manifest is None:
+            continue
+        # NOTE: CSV data isn't hive-partitioned, see generate_step
+        if get_partition_columns(manifest.get("layout", DEFAULT_LAYOUT)):
+            log.info(f"skipping hive-partitioned {root}...")
+            continue
 
-                log.info(f"reading {parquet_file}...")
-                t = con.read_parquet(parquet_file)
+        csv_directory = os.path.join(
+            "tpch_data", "csv", os.path.relpath(root, parquet_root)
+        )
+        csv_manifest = read_manifest(csv_directory)
+        if csv_manifest is not None:
+            log.info(f"CSV data already exists at {csv_directory}, skipping...")
+            continue
 
-                log.info(f"writing {csv_file}...")
-                t.to_csv(csv_file)
+        log.info(f"writing {root} to {csv_directory}...")
+        file_infos = export_dataset(root, csv_directory, csv_options, jobs=jobs)
+        _write_manifests(
+            {"csv": csv_directory},
+            manifest["sf"],
+            manifest["n_partitions"],
+            manifest.get("layout_options"),
+            file_infos,
+            csv_options=csv_options,
+        )
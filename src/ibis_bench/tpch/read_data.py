@@ -3,167 +3,298 @@ import polars as pl
 import ibis.selectors as s
 import polars.selectors as ps
 
-from ibis_bench.tpch.gen_data import get_data_dir
+from ibis_bench.utils.layout import (
+    DEFAULT_LAYOUT,
+    get_float_schema,
+    get_partition_columns,
+    is_float_layout,
+)
+from ibis_bench.utils.csv_export import (
+    DEFAULT_SCHEMA_MODE,
+    get_csv_extension,
+    read_csv,
+    read_csv_options,
+)
+from ibis_bench.utils.ipc import read_ipc, read_ipc_options, scan_ipc
+from ibis_bench.utils.shm_cache import get_cached_table
+from ibis_bench.utils.storage import (
+    DEFAULT_DATA_ROOT,
+    is_url,
+    read_remote,
+    scan_remote,
+)
+from ibis_bench.tpch.gen_data import PARTITION_COLUMNS, TABLE_NAMES, get_data_dir
+from ibis_bench.tpch.schemas import SCHEMAS
 
 DECIMAL_TO_FLOAT = True
 
 
-def get_ibis_tables(
-    sf, n_partitions=1, con=ibis.connect("duckdb://"), csv=False, decimal_to_float=True
+def _read_hive_parquet(con, table_directory: str, table_name: str, columns: list):
+    # NOTE: DataFusion registers a directory with explicit partition columns,
+    # DuckDB and Polars read a glob with hive partitioning enabled
+    if con.name == "datafusion":
+        return con.read_parquet(
+            f"{table_directory}/",
+            table_name=table_name,
+            table_partition_cols=[(column, "int") for column in columns],
+            file_extension=".parquet",
+        )
+    return con.read_parquet(
+        f"{table_directory}/**/*.parquet", table_name=table_name, hive_partitioning=True
+    )
+
+
+def _get_schema(table_name: str, layout: str, schema_mode: str):
+    # declared CSV schema, with float columns for float layouts
+    if schema_mode != "declared":
+        return None
+    if is_float_layout(layout):
+        return get_float_schema(SCHEMAS[table_name])
+    return SCHEMAS[table_name]
+
+
+def get_ibis_table(
+    table_name,
+    sf,
+    n_partitions=1,
+    con=ibis.connect("duckdb://"),
+    csv=False,
+    decimal_to_float=True,
+    layout=DEFAULT_LAYOUT,
+    schema_mode=DEFAULT_SCHEMA_MODE,
+    ipc=False,
+    shm_cache=False,
+    shm_cache_gb=None,
+    data_root=DEFAULT_DATA_ROOT,
+    storage_options=None,
 ):
-    data_directory = get_data_dir(sf, n_partitions, csv=csv)
+    """
+    register a single tpc-h table with the Ibis backend
 
-    if not csv:
-        customer = con.read_parquet(
-            f"{data_directory}/customer/*.parquet", table_name="customer"
-        )
-        lineitem = con.read_parquet(
-            f"{data_directory}/lineitem/*.parquet", table_name="lineitem"
-        )
-        nation = con.read_parquet(
-            f"{data_directory}/nation/*.parquet", table_name="nation"
-        )
-        orders = con.read_parquet(
-            f"{data_directory}/orders/*.parquet", table_name="orders"
-        )
-        part = con.read_parquet(f"{data_directory}/part/*.parquet", table_name="part")
-        partsupp = con.read_parquet(
-            f"{data_directory}/partsupp/*.parquet", table_name="partsupp"
+    with `shm_cache`, the table is decoded once (across processes) into shared
+    memory and read from there, see get_cached_table
+
+    `data_root` can be a URL (e.g. s3://bucket/prefix), read with the
+    `storage_options`
+    """
+    data_directory = get_data_dir(
+        sf, n_partitions, csv=csv, layout=layout, ipc=ipc, data_root=data_root
+    )
+    table_directory = f"{data_directory}/{table_name}"
+    # lineitem and orders may be hive-partitioned by date (Parquet only, the
+    # partition columns aren't cached)
+    partition_columns = [] if csv or ipc or shm_cache else get_partition_columns(layout)
+
+    if shm_cache:
+        t = read_ipc(
+            con,
+            get_cached_table(
+                data_directory,
+                table_name,
+                budget_gb=shm_cache_gb,
+                storage_options=storage_options,
+            ),
+            table_name,
         )
-        region = con.read_parquet(
-            f"{data_directory}/region/*.parquet", table_name="region"
+    elif is_url(data_directory):
+        t = read_remote(
+            con,
+            table_directory,
+            table_name,
+            "ipc" if ipc else "csv" if csv else "parquet",
+            storage_options,
+            partition_columns if table_name in PARTITION_COLUMNS else None,
         )
-        supplier = con.read_parquet(
-            f"{data_directory}/supplier/*.parquet", table_name="supplier"
+    elif ipc:
+        t = read_ipc(con, table_directory, table_name, read_ipc_options(data_directory))
+    elif csv:
+        schema = _get_schema(table_name, layout, schema_mode)
+        t = read_csv(
+            con, table_directory, table_name, read_csv_options(data_directory), schema
         )
+    elif partition_columns and table_name in PARTITION_COLUMNS:
+        t = _read_hive_parquet(con, table_directory, table_name, partition_columns)
     else:
-        customer = con.read_csv(
-            f"{data_directory}/customer/*.csv", table_name="customer"
-        )
-        lineitem = con.read_csv(
-            f"{data_directory}/lineitem/*.csv", table_name="lineitem"
-        )
-        nation = con.read_csv(f"{data_directory}/nation/*.csv", table_name="nation")
-        orders = con.read_csv(f"{data_directory}/orders/*.csv", table_name="orders")
-        part = con.read_csv(f"{data_directory}/part/*.csv", table_name="part")
-        partsupp = con.read_csv(
-            f"{data_directory}/partsupp/*.csv", table_name="partsupp"
-        )
-        region = con.read_csv(f"{data_directory}/region/*.csv", table_name="region")
-        supplier = con.read_csv(
-            f"{data_directory}/supplier/*.csv", table_name="supplier"
-        )
+        t = con.read_parquet(f"{table_directory}/*.parquet", table_name=table_name)
 
     # TODO: report issue(s) (DataFusion backend issue)
-    def _decimal_to_float(t):
-        return t.mutate(
+    if decimal_to_float:
+        t = t.mutate(
             s.across(
                 s.of_type("decimal"),
                 ibis._.cast("float"),
             )
         )
 
-    if decimal_to_float:
-        customer = _decimal_to_float(customer)
-        lineitem = _decimal_to_float(lineitem)
-        nation = _decimal_to_float(nation)
-        orders = _decimal_to_float(orders)
-        part = _decimal_to_float(part)
-        partsupp = _decimal_to_float(partsupp)
-        region = _decimal_to_float(region)
-        supplier = _decimal_to_float(supplier)
-
     # TODO: keep this or figure something out and remove
-    def _drop_hive_cols(t):
-        # NOTE: some backends don't create the hive-partitioned columns (at least by default)
-        # DuckDB and Polars do, DataFusion doesn't, so first check if the column(s) exist
-        if "sf" in t.columns:
-            t = t.drop("sf")
-        if "n" in t.columns:
-            t = t.drop("n")
-        return t
-
-    customer = _drop_hive_cols(customer)
-    lineitem = _drop_hive_cols(lineitem)
-    nation = _drop_hive_cols(nation)
-    orders = _drop_hive_cols(orders)
-    part = _drop_hive_cols(part)
-    partsupp = _drop_hive_cols(partsupp)
-    region = _drop_hive_cols(region)
-    supplier = _drop_hive_cols(supplier)
+    # NOTE: some backends don't create the hive-partitioned columns (at least by default)
+    # DuckDB and Polars do, DataFusion doesn't, so first check if the column(s) exist
+    if "sf" in t.columns:
+        t = t.drop("sf")
+    if "n" in t.columns:
+        t = t.drop("n")
+    # NOTE: the partition columns are kept, engines prune partitions from the
+    # queries' own date predicates (with file statistics), the harness doesn't
+
+    return t
+
+
+def get_ibis_tables(
+    sf,
+    n_partitions=1,
+    con=ibis.connect("duckdb://"),
+    csv=False,
+    decimal_to_float=True,
+    layout=DEFAULT_LAYOUT,
+    schema_mode=DEFAULT_SCHEMA_MODE,
+    ipc=False,
+    data_root=DEFAULT_DATA_ROOT,
+    storage_options=None,
+):
+    customer, lineitem, nation, orders, part, partsupp, region, supplier = (
+        get_ibis_table(
+            table_name,
+            sf,
+            n_partitions=n_partitions,
+            con=con,
+            csv=csv,
+            decimal_to_float=decimal_to_float,
+            layout=layout,
+            schema_mode=schema_mode,
+            ipc=ipc,
+            data_root=data_root,
+            storage_options=storage_options,
+        )
+        for table_name in TABLE_NAMES
+    )
 
     return customer, lineitem, nation, orders, part, partsupp, region, supplier
 
 
-def get_polars_tables(
-    sf, n_partitions=1, lazy=True, csv=False, decimal_to_float=DECIMAL_TO_FLOAT
+def get_polars_table(
+    table_name,
+    sf,
+    n_partitions=1,
+    lazy=True,
+    csv=False,
+    decimal_to_float=DECIMAL_TO_FLOAT,
+    layout=DEFAULT_LAYOUT,
+    schema_mode=DEFAULT_SCHEMA_MODE,
+    ipc=False,
+    shm_cache=False,
+    shm_cache_gb=None,
+    data_root=DEFAULT_DATA_ROOT,
+    storage_options=None,
 ):
-    data_directory = get_data_dir(sf, n_partitions, csv=csv)
-
-    if not csv:
-        if lazy:
-            customer = pl.scan_parquet(f"{data_directory}/customer/*.parquet")
-            lineitem = pl.scan_parquet(f"{data_directory}/lineitem/*.parquet")
-            nation = pl.scan_parquet(f"{data_directory}/nation/*.parquet")
-            orders = pl.scan_parquet(f"{data_directory}/orders/*.parquet")
-            part = pl.scan_parquet(f"{data_directory}/part/*.parquet")
-            partsupp = pl.scan_parquet(f"{data_directory}/partsupp/*.parquet")
-            region = pl.scan_parquet(f"{data_directory}/region/*.parquet")
-            supplier = pl.scan_parquet(f"{data_directory}/supplier/*.parquet")
-        else:
-            customer = pl.read_parquet(f"{data_directory}/customer/*.parquet")
-            lineitem = pl.read_parquet(f"{data_directory}/lineitem/*.parquet")
-            nation = pl.read_parquet(f"{data_directory}/nation/*.parquet")
-            orders = pl.read_parquet(f"{data_directory}/orders/*.parquet")
-            part = pl.read_parquet(f"{data_directory}/part/*.parquet")
-            partsupp = pl.read_parquet(f"{data_directory}/partsupp/*.parquet")
-            region = pl.read_parquet(f"{data_directory}/region/*.parquet")
-            supplier = pl.read_parquet(f"{data_directory}/supplier/*.parquet")
+    """
+    read a single tpc-h table with Polars, as a LazyFrame or (eager) DataFrame
+
+    with `shm_cache`, the table is decoded once (across processes) into shared
+    memory and read from there, see get_cached_table
+
+    `data_root` can be a URL (e.g. s3://bucket/prefix), read with the
+    `storage_options`
+    """
+    data_directory = get_data_dir(
+        sf, n_partitions, csv=csv, layout=layout, ipc=ipc, data_root=data_root
+    )
+    table_directory = f"{data_directory}/{table_name}"
+    # lineitem and orders may be hive-partitioned by date (Parquet only, the
+    # partition columns aren't cached)
+    partition_columns = [] if csv or ipc or shm_cache else get_partition_columns(layout)
+    fact_glob = "**/*.parquet" if partition_columns else "*.parquet"
+
+    if shm_cache:
+        df = scan_ipc(
+            get_cached_table(
+                data_directory,
+                table_name,
+                budget_gb=shm_cache_gb,
+                storage_options=storage_options,
+            ),
+            lazy=lazy,
+        )
+    elif is_url(data_directory):
+        df = scan_remote(
+            table_directory,
+            "ipc" if ipc else "csv" if csv else "parquet",
+            storage_options,
+            partition_columns if table_name in PARTITION_COLUMNS else None,
+            lazy=lazy,
+        )
+    elif ipc:
+        df = scan_ipc(table_directory, read_ipc_options(data_directory), lazy)
+    elif csv:
+        csv_options = read_csv_options(data_directory)
+        # declared schemas name the columns and skip type inference
+        schema = _get_schema(table_name, layout, schema_mode)
+        # NOTE: Polars infers dates as strings unless asked to parse them, like
+        # DuckDB and DataFusion do, and `read_csv` ignores that for a glob, so
+        # eager reads collect a scan
+        df = pl.scan_csv(
+            f"{table_directory}/*{get_csv_extension(csv_options)}",
+            separator=csv_options["delimiter"],
+            has_header=csv_options["header"],
+            schema=schema.to_polars() if schema is not None else None,
+            try_parse_dates=schema is None,
+        )
+        if not lazy:
+            df = df.collect()
+        # NOTE: files without a header are named from the manifest, renamed
+        # since `new_columns` fails for compressed files
+        if schema is None and not csv_options["header"]:
+            columns = csv_options["columns"][table_name]
+            df = df.rename(dict(zip(df.collect_schema().names(), columns)))
     else:
-        if lazy:
-            customer = pl.scan_csv(f"{data_directory}/customer/*.csv")
-            lineitem = pl.scan_csv(f"{data_directory}/lineitem/*.csv")
-            nation = pl.scan_csv(f"{data_directory}/nation/*.csv")
-            orders = pl.scan_csv(f"{data_directory}/orders/*.csv")
-            part = pl.scan_csv(f"{data_directory}/part/*.csv")
-            partsupp = pl.scan_csv(f"{data_directory}/partsupp/*.csv")
-            region = pl.scan_csv(f"{data_directory}/region/*.csv")
-            supplier = pl.scan_csv(f"{data_directory}/supplier/*.csv")
+        read_parquet = pl.scan_parquet if lazy else pl.read_parquet
+        if table_name in PARTITION_COLUMNS:
+            df = read_parquet(
+                f"{table_directory}/{fact_glob}",
+                hive_partitioning=bool(partition_columns),
+            )
         else:
-            customer = pl.read_csv(f"{data_directory}/customer/*.csv")
-            lineitem = pl.read_csv(f"{data_directory}/lineitem/*.csv")
-            nation = pl.read_csv(f"{data_directory}/nation/*.csv")
-            orders = pl.read_csv(f"{data_directory}/orders/*.csv")
-            part = pl.read_csv(f"{data_directory}/part/*.csv")
-            partsupp = pl.read_csv(f"{data_directory}/partsupp/*.csv")
-            region = pl.read_csv(f"{data_directory}/region/*.csv")
-            supplier = pl.read_csv(f"{data_directory}/supplier/*.csv")
+            df = read_parquet(f"{table_directory}/*.parquet")
 
     # TODO: report issue(s) (issue(s) at higher SFs)
-    def _decimal_to_float(df):
-        return df.with_columns((ps.decimal().cast(pl.Float64)))
-
     if decimal_to_float:
-        customer = _decimal_to_float(customer)
-        lineitem = _decimal_to_float(lineitem)
-        nation = _decimal_to_float(nation)
-        orders = _decimal_to_float(orders)
-        part = _decimal_to_float(part)
-        partsupp = _decimal_to_float(partsupp)
-        region = _decimal_to_float(region)
-        supplier = _decimal_to_float(supplier)
+        df = df.with_columns((ps.decimal().cast(pl.Float64)))
+
+    # NOTE: the partition columns are kept, engines prune partitions from the
+    # queries' own date predicates (with file statistics), the harness doesn't
 
     # TODO: keep this or figure something out and remove
-    # def _drop_hive_cols(df):
-    #     return df.drop(["sf", "n"])
-
-    # customer = _drop_hive_cols(customer)
-    # lineitem = _drop_hive_cols(lineitem)
-    # nation = _drop_hive_cols(nation)
-    # orders = _drop_hive_cols(orders)
-    # part = _drop_hive_cols(part)
-    # partsupp = _drop_hive_cols(partsupp)
-    # region = _drop_hive_cols(region)
-    # supplier = _drop_hive_cols(supplier)
+    # df = df.drop(["sf", "n"])
+
+    return df
+
+
+def get_polars_tables(
+    sf,
+    n_partitions=1,
+    lazy=True,
+    csv=False,
+    decimal_to_float=DECIMAL_TO_FLOAT,
+    layout=DEFAULT_LAYOUT,
+    schema_mode=DEFAULT_SCHEMA_MODE,
+    ipc=False,
+    data_root=DEFAULT_DATA_ROOT,
+    storage_options=None,
+):
+    customer, lineitem, nation, orders, part, partsupp, region, supplier = (
+        get_polars_table(
+            table_name,
+            sf,
+            n_partitions=n_partitions,
+            lazy=lazy,
+            csv=csv,
+            decimal_to_float=decimal_to_float,
+            layout=layout,
+            schema_mode=schema_mode,
+            ipc=ipc,
+            data_root=data_root,
+            storage_options=storage_options,
+        )
+        for table_name in TABLE_NAMES
+    )
 
     return customer, lineitem, nation, orders, part, partsupp, region, supplier
@@ -0,0 +1,239 @@
+import os
+import math
+import time
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+import multiprocessing as mp
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ibis_bench.utils.logging import log
+from ibis_bench.utils.layout import (
+    DEFAULT_LAYOUT,
+    get_batch_size,
+    get_partition_columns,
+    has_writer_options,
+    open_parquet_writer,
+)
+from ibis_bench.utils.manifest import (
+    build_manifest,
+    get_file_info,
+    read_manifest,
+    write_manifest,
+)
+from ibis_bench.tpch.gen_data import (
+    TABLE_NAMES,
+    get_data_dir,
+    _get_tmp_path,
+    _log_throughput,
+)
+
+
+def _get_source_files(data_directory: str, table: str) -> list[tuple]:
+    """
+    (file path, rows per row group) of a table's files, in order
+    """
+    table_directory = os.path.join(data_directory, table)
+    source_files = []
+    for file_name in sorted(os.listdir(table_directory)):
+        if not file_name.endswith(".parquet") or file_name.startswith("."):
+            continue
+        file_path = os.path.join(table_directory, file_name)
+        metadata = pq.read_metadata(file_path)
+        source_files.append(
+            (
+                file_path,
+                [
+                    metadata.row_group(i).num_rows
+                    for i in range(metadata.num_row_groups)
+                ],
+            )
+        )
+    return source_files
+
+
+def _iter_range(source_files: list[tuple], start: int, end: int, batch_size: int):
+    """
+    stream rows [start, end) of the source files, reading only the row groups
+    that overlap the range
+    """
+    offset = 0
+    for file_path, row_group_rows in source_files:
+        row_groups = []
+        first_offset = None
+        for i, n_rows in enumerate(row_group_rows):
+            if offset + n_rows > start and offset < end:
+                row_groups.append(i)
+                first_offset = offset if first_offset is None else first_offset
+            offset += n_rows
+
+        if not row_groups:
+            continue
+
+        position = first_offset
+        batches = pq.ParquetFile(file_path).iter_batches(
+            batch_size=batch_size, row_groups=row_groups
+        )
+        for batch in batches:
+            batch_start = max(start - position, 0)
+            batch_end = min(end - position, batch.num_rows)
+            if batch_end > batch_start:
+                yield batch.slice(batch_start, batch_end - batch_start)
+            position += batch.num_rows
+
+
+def write_range(
+    source_files: list[tuple],
+    start: int,
+    end: int,
+    file_path: str,
+    layout: dict = None,
+    threads: int = None,
+) -> dict:
+    """
+    write rows [start, end) of the source files to a Parquet file
+
+    returns the file's info (for the manifest) and the elapsed seconds
+    """
+    start_time = time.time()
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    schema = pq.read_schema(source_files[0][0])
+    # NOTE: with a configured writer, each batch is a row group
+    reader = pa.RecordBatchReader.from_batches(
+        schema, _iter_range(source_files, start, end, get_batch_size(layout))
+    )
+
+    tmp_path = _get_tmp_path(file_path)
+    if has_writer_options(layout):
+        with open_parquet_writer(tmp_path, schema, layout) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+    else:
+        # NOTE: DuckDB's writer, so files match the generated (default) files
+        con = duckdb.connect()
+        if threads:
+            con.execute(f"SET threads = {threads}")
+        con.from_arrow(reader).write_parquet(tmp_path)
+        con.close()
+    os.replace(tmp_path, file_path)
+
+    return {
+        "file_path": file_path,
+        "rows": end - start,
+        "seconds": time.time() - start_time,
+        "info": get_file_info(file_path),
+    }
+
+
+def get_n_files(
+    n_rows: int, n_bytes: int, n_partitions: int, target_file_size: int = None
+) -> int:
+    """
+    number of files for a table, capped so files are at least the target size
+    """
+    n_files = min(n_partitions, max(n_rows, 1))
+    if target_file_size:
+        n_files = min(n_files, max(math.ceil(n_bytes / target_file_size), 1))
+    return n_files
+
+
+def repartition_data(
+    sf,
+    from_n_partitions: int,
+    n_partitions: int,
+    target_file_size: int = None,
+    jobs: int = None,
+    layout: str = DEFAULT_LAYOUT,
+):
+    """
+    rewrite an existing dataset with a different number of files per table
+
+    rows are split into contiguous ranges, so row order (and any sort order) is
+    kept; `target_file_size` (in bytes) caps the number of files of small tables
+    """
+    source_directory = get_data_dir(sf, from_n_partitions, layout=layout)
+    data_directory = get_data_dir(sf, n_partitions, layout=layout)
+    log.info(f"repartitioning {source_directory} to {data_directory}...")
+
+    if get_partition_columns(layout):
+        raise ValueError(f"can't repartition hive-partitioned layout {layout}")
+    if read_manifest(data_directory):
+        log.info(f"\tdata already exists at {data_directory}, skipping...")
+        return
+
+    # the writer options of the layout are in the source dataset's manifest
+    layout_options = (read_manifest(source_directory) or {}).get("layout_options")
+    if layout != DEFAULT_LAYOUT and layout_options is None:
+        raise ValueError(f"no layout options in the manifest of {source_directory}")
+
+    tasks = []
+    for table in TABLE_NAMES:
+        source_files = _get_source_files(source_directory, table)
+        n_rows = sum(sum(row_group_rows) for _, row_group_rows in source_files)
+        n_bytes = sum(os.path.getsize(file_path) for file_path, _ in source_files)
+
+        n_files = get_n_files(n_rows, n_bytes, n_partitions, target_file_size)
+        for i in range(n_files):
+            file_path = os.path.join(data_directory, table, f"{i:04d}.parquet")
+            # NOTE: files are written atomically, so existing files are complete
+            if os.path.exists(file_path):
+                continue
+            tasks.append(
+                (
+                    source_files,
+                    n_rows * i // n_files,
+                    n_rows * (i + 1) // n_files,
+                    file_path,
+                )
+            )
+
+    jobs = max(min(jobs or os.cpu_count(), len(tasks), os.cpu_count()), 1)
+    threads = max(os.cpu_count() // jobs, 1)
+    log.info(f"\twriting {len(tasks)} files with {jobs} jobs...")
+
+    start_time = time.time()
+    results = []
+    if jobs == 1:
+        for task in tasks:
+            results.append(write_range(*task, layout=layout_options))
+    else:
+        # NOTE: spawn, since forking a process with DuckDB's threads is unsafe
+        with ProcessPoolExecutor(
+            max_workers=jobs, mp_context=mp.get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(
+                    write_range, *task, layout=layout_options, threads=threads
+                )
+                for task in tasks
+            ]
+            for future in as_completed(futures):
+                results.append(future.result())
+
+    for result in results:
+        log.info(f"\tdone writing {result['file_path']} in {result['seconds']:.1f}s")
+    _log_throughput(
+        f"sf={sf}, n={n_partitions}",
+        {
+            "rows": sum(result["rows"] for result in results),
+            "bytes": sum(result["info"]["bytes"] for result in results),
+            "seconds": time.time() - start_time,
+        },
+    )
+
+    manifest = build_manifest(
+        data_directory,
+        {result["file_path"]: result["info"] for result in results},
+        benchmark="tpch",
+        sf=sf,
+        n_partitions=n_partitions,
+        file_type="parquet",
+        layout=layout,
+        # NOTE: kept, so the dataset can be repartitioned again
+        layout_options=layout_options,
+        repartitioned_from=from_n_partitions,
+        target_file_size=target_file_size,
+    )
+    write_manifest(data_directory, manifest)
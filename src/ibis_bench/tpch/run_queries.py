@@ -0,0 +1,282 @@
+import ibis
+import functools
+
+from ibis_bench.utils.csv_export import DEFAULT_SCHEMA_MODE, SCHEMA_MODES
+from ibis_bench.utils.layout import DEFAULT_LAYOUT
+from ibis_bench.utils.load import DEFAULT_LOAD_MODE, TableRegistry
+from ibis_bench.utils.logging import log
+from ibis_bench.utils.monitor import monitor_it
+from ibis_bench.utils.page_cache import DEFAULT_CACHE_STATE, get_data_files
+from ibis_bench.utils.sampler import DEFAULT_SAMPLE_INTERVAL_MS
+from ibis_bench.utils.shm_cache import CACHE_FILE_TYPES
+from ibis_bench.utils.storage import (
+    DEFAULT_DATA_ROOT,
+    check_remote,
+    get_storage_options,
+    is_url,
+)
+from ibis_bench.utils.scheduler import apply_cpu_limits, get_thread_limit
+from ibis_bench.utils.manifest import (
+    get_query_input,
+    get_query_tables,
+    read_manifest,
+    validate_manifest,
+)
+from ibis_bench.tpch.gen_data import FILE_TYPES, TABLE_NAMES, get_data_dir
+from ibis_bench.tpch.read_data import get_ibis_table, get_polars_table
+
+
+def connect(backend: str, memory_limit: float = None):
+    """
+    connect to the backend, applying CPU limits and the memory limit (in GB)
+    """
+    apply_cpu_limits()
+
+    if memory_limit and backend == "datafusion":
+        # NOTE: DataFusion's memory pool can only be set on a new SessionContext,
+        # so this mirrors the config Ibis uses by default
+        from datafusion import RuntimeConfig, SessionConfig, SessionContext
+
+        config = SessionConfig(
+            {"datafusion.sql_parser.dialect": "PostgreSQL"}
+        ).with_information_schema(True)
+        runtime = RuntimeConfig().with_fair_spill_pool(int(memory_limit * 1024**3))
+        con = ibis.datafusion.connect(SessionContext(config, runtime))
+    else:
+        con = ibis.connect(f"{backend}://")
+
+    if memory_limit and backend == "duckdb":
+        con.raw_sql(f"SET memory_limit = '{memory_limit}GB'")
+
+    threads = get_thread_limit()
+    if threads and backend == "duckdb":
+        con.raw_sql(f"SET threads = {threads}")
+    elif threads and backend == "datafusion":
+        con.raw_sql(f"SET datafusion.execution.target_partitions = {threads}")
+
+    return con
+
+
+def get_system_tables(
+    system: str,
+    sf: int,
+    n_partitions: int,
+    file_type: str = "parquet",
+    decimal_to_float: bool = False,
+    memory_limit: float = None,
+    layout: str = DEFAULT_LAYOUT,
+    schema_mode: str = DEFAULT_SCHEMA_MODE,
+    load_mode: str = DEFAULT_LOAD_MODE,
+    shm_cache: bool = False,
+    shm_cache_gb: float = None,
+    data_root: str = DEFAULT_DATA_ROOT,
+    storage_options: dict = None,
+):
+    """
+    connect to the system and set up the tpc-h tables, each read (and loaded)
+    when a query first uses it
+
+    `file_type` is the format of the files read (parquet, csv or ipc) and
+    `schema_mode` is whether CSV column types are inferred or declared, with
+    `shm_cache` tables are read from a shared memory cache of decoded tables
+    (of at most `shm_cache_gb`), and `data_root` can be a URL read with the
+    `storage_options` (see get_storage_options)
+
+    returns the system's queries, the backend name (used as the SQL dialect),
+    and a registry of table name to table
+    """
+    if file_type not in FILE_TYPES:
+        raise ValueError(f"unknown file type: {file_type} (one of {FILE_TYPES})")
+    if schema_mode not in SCHEMA_MODES:
+        raise ValueError(f"unknown schema mode: {schema_mode} (one of {SCHEMA_MODES})")
+    if shm_cache and file_type not in CACHE_FILE_TYPES:
+        raise ValueError(
+            f"can't cache {file_type} tables in shared memory (one of {CACHE_FILE_TYPES})"
+        )
+    if is_url(data_root):
+        check_remote(data_root, file_type)
+    # NOTE: local files are read by the engines directly, not through object storage
+    elif storage_options not in (None, get_storage_options()):
+        raise ValueError("storage options need a URL data root (e.g. s3://...)")
+    check_data(
+        sf, n_partitions, file_type=file_type, layout=layout, data_root=data_root
+    )
+    system_parts = system.split("-")
+    read_kwargs = {
+        "sf": sf,
+        "n_partitions": n_partitions,
+        "csv": file_type == "csv",
+        "ipc": file_type == "ipc",
+        "decimal_to_float": decimal_to_float,
+        "layout": layout,
+        "schema_mode": schema_mode,
+        "shm_cache": shm_cache,
+        "shm_cache_gb": shm_cache_gb,
+        "data_root": data_root,
+        "storage_options": storage_options,
+    }
+
+    if system_parts[0] == "ibis" and system_parts[-1] != "sql":
+        backend = system_parts[1]
+        con = connect(backend, memory_limit=memory_limit)
+        log.info(f"connected to {backend} backend")
+
+        from ibis_bench.tpch.queries.ibis import all_queries
+
+        read_table = functools.partial(get_ibis_table, con=con, **read_kwargs)
+    elif system_parts[0] == "ibis" and system_parts[-1] == "sql":
+        backend = system_parts[1]
+        con = connect(backend, memory_limit=memory_limit)
+        log.info(f"connected to {backend} backend (for SQL)")
+
+        from ibis_bench.tpch.queries.sql import all_queries
+
+        read_table = functools.partial(get_ibis_table, con=con, **read_kwargs)
+    elif system_parts[0] == "polars":
+        backend = system_parts[0]
+        lazy = system_parts[1] == "lazy"
+        log.info(f"using Polars with lazy={lazy}")
+        if memory_limit:
+            log.info("Polars has no memory limit setting, ignoring memory limit")
+        apply_cpu_limits()
+
+        from ibis_bench.tpch.queries.polars import all_queries
+
+        def read_table(table_name):
+            df = get_polars_table(table_name, lazy=lazy, **read_kwargs)
+            # NOTE: resolve lazy schemas now, so inference is timed as reading
+            # the table rather than as part of the first query
+            if lazy:
+                df.collect_schema()
+            return df
+    else:
+        raise ValueError(f"unknown system: {system}")
+
+    return all_queries, backend, TableRegistry(read_table, TABLE_NAMES, load_mode)
+
+
+def check_data(
+    sf,
+    n_partitions,
+    file_type: str = "parquet",
+    layout: str = DEFAULT_LAYOUT,
+    data_root: str = DEFAULT_DATA_ROOT,
+):
+    """
+    check the dataset's files against its manifest (by size), if it has one
+    """
+    data_directory = get_data_dir(
+        sf,
+        n_partitions,
+        csv=file_type == "csv",
+        layout=layout,
+        ipc=file_type == "ipc",
+        data_root=data_root,
+    )
+    manifest = read_manifest(data_directory)
+    if manifest is None:
+        log.info(f"no manifest for {data_directory}, skipping validation")
+        return
+
+    problems = validate_manifest(data_directory, manifest)
+    if problems:
+        raise ValueError(
+            f"data at {data_directory} doesn't match its manifest: {problems[:10]}"
+        )
+
+
+def get_queries(all_queries, q_number=None, exclude_queries=None):
+    return {
+        q: query
+        for q, query in enumerate(all_queries, start=1)
+        if (q_number is None or q in q_number)
+        and (exclude_queries is None or q not in exclude_queries)
+    }
+
+
+def run_query(
+    query,
+    q: int,
+    system: str,
+    backend: str,
+    tables: TableRegistry,
+    sf: int,
+    n_partitions: int,
+    session_id: str,
+    instance_type: str,
+    file_type: str,
+    decimal_to_float: bool,
+    warmup: int = 0,
+    repeat: int = 1,
+    phases: bool = False,
+    sample_interval_ms: int = DEFAULT_SAMPLE_INTERVAL_MS,
+    sample_detail: bool = False,
+    layout: str = DEFAULT_LAYOUT,
+    schema_mode: str = DEFAULT_SCHEMA_MODE,
+    shm_cache: bool = False,
+    cache_state: str = DEFAULT_CACHE_STATE,
+    data_root: str = DEFAULT_DATA_ROOT,
+    storage_options: dict = None,
+):
+    """
+    run and monitor a single query, returning whether it succeeded
+
+    only the tables the query uses are read (and loaded), and the time (and
+    memory) it took to read them is recorded with the first query using them,
+    on its first timed iteration's record (null on the other iterations')
+
+    with a cold `cache_state`, the files of the query's tables are evicted from
+    the OS page cache before each timed run
+    """
+    table_names = get_query_tables(query, tables)
+    table_stats = tables.get_stats(table_names)
+    data_directory = get_data_dir(
+        sf,
+        n_partitions,
+        csv=file_type == "csv",
+        layout=layout,
+        ipc=file_type == "ipc",
+        data_root=data_root,
+    )
+    manifest = read_manifest(data_directory)
+    try:
+        monitor_it(
+            query,
+            sf=sf,
+            n_partitions=n_partitions,
+            query_number=q,
+            system=system,
+            session_id=session_id,
+            instance_type=instance_type,
+            file_type=file_type,
+            decimal_to_float=decimal_to_float,
+            warmup=warmup,
+            repeat=repeat,
+            phases=phases,
+            sample_interval_ms=sample_interval_ms,
+            sample_detail=sample_detail,
+            layout=layout,
+            schema_mode=schema_mode,
+            shm_cache=shm_cache,
+            cache_state=cache_state,
+            cache_files=get_data_files(data_directory, table_names),
+            data_root=data_root,
+            storage_options=storage_options,
+            read_seconds=table_stats.pop("read_seconds"),
+            load_mode=tables.load_mode,
+            load_stats=table_stats,
+            input_stats=get_query_input(query, manifest) if manifest else None,
+            # some of the query's tables were used by an earlier query
+            tables_warm=table_stats["tables_read"] < len(table_names),
+            # tpch tables
+            **{table_name: tables[table_name] for table_name in table_names},
+            # used for SQL runs
+            dialect=backend if backend else None,
+        )
+    except Exception as e:
+        log.info(
+            f"error running query {q} at scale factor {sf} and {n_partitions} partitions: {e}"
+        )
+        return False
+
+    return True
@@ -0,0 +1,100 @@
+import ibis
+
+# NOTE: the types of DuckDB's dbgen, so CSV reads with declared schemas match
+# the Parquet data
+
+SCHEMAS = {
+    "customer": ibis.schema(
+        {
+            "c_custkey": "int64",
+            "c_name": "string",
+            "c_address": "string",
+            "c_nationkey": "int32",
+            "c_phone": "string",
+            "c_acctbal": "decimal(15, 2)",
+            "c_mktsegment": "string",
+            "c_comment": "string",
+        }
+    ),
+    "lineitem": ibis.schema(
+        {
+            "l_orderkey": "int64",
+            "l_partkey": "int64",
+            "l_suppkey": "int64",
+            "l_linenumber": "int64",
+            "l_quantity": "decimal(15, 2)",
+            "l_extendedprice": "decimal(15, 2)",
+            "l_discount": "decimal(15, 2)",
+            "l_tax": "decimal(15, 2)",
+            "l_returnflag": "string",
+            "l_linestatus": "string",
+            "l_shipdate": "date",
+            "l_commitdate": "date",
+            "l_receiptdate": "date",
+            "l_shipinstruct": "string",
+            "l_shipmode": "string",
+            "l_comment": "string",
+        }
+    ),
+    "nation": ibis.schema(
+        {
+            "n_nationkey": "int32",
+            "n_name": "string",
+            "n_regionkey": "int32",
+            "n_comment": "string",
+        }
+    ),
+    "orders": ibis.schema(
+        {
+            "o_orderkey": "int64",
+            "o_custkey": "int64",
+            "o_orderstatus": "string",
+            "o_totalprice": "decimal(15, 2)",
+            "o_orderdate": "date",
+            "o_orderpriority": "string",
+            "o_clerk": "string",
+            "o_shippriority": "int32",
+            "o_comment": "string",
+        }
+    ),
+    "part": ibis.schema(
+        {
+            "p_partkey": "int64",
+            "p_name": "string",
+            "p_mfgr": "string",
+            "p_brand": "string",
+            "p_type": "string",
+            "p_size": "int32",
+            "p_container": "string",
+            "p_retailprice": "decimal(15, 2)",
+            "p_comment": "string",
+        }
+    ),
+    "partsupp": ibis.schema(
+        {
+            "ps_partkey": "int64",
+            "ps_suppkey": "int64",
+            "ps_availqty": "int64",
+            "ps_supplycost": "decimal(15, 2)",
+            "ps_comment": "string",
+        }
+    ),
+    "region": ibis.schema(
+        {
+            "r_regionkey": "int32",
+            "r_name": "string",
+            "r_comment": "string",
+        }
+    ),
+    "supplier": ibis.schema(
+        {
+            "s_suppkey": "int64",
+            "s_name": "string",
+            "s_address": "string",
+            "s_nationkey": "int32",
+            "s_phone": "string",
+            "s_acctbal": "decimal(15, 2)",
+            "s_comment": "string",
+        }
+    ),
+}
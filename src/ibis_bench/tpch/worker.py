@@ -0,0 +1,215 @@
+import os
+import threading
+import multiprocessing as mp
+
+from ibis_bench.utils.logging import log
+from ibis_bench.utils.watchdog import watch
+
+# guards os.environ while starting workers with their own environment
+_ENV_LOCK = threading.Lock()
+
+
+def _worker_main(conn, system: str):
+    # NOTE: imported here so the parent process doesn't pay for backend imports
+    from ibis_bench.utils.monitor import flush_monitor_results
+    from ibis_bench.utils.manifest import get_query_tables
+    from ibis_bench.utils.shm_cache import unpin_tables
+    from ibis_bench.tpch.run_queries import get_system_tables, get_queries, run_query
+
+    # only the most recently used dataset is kept warm, so memory use matches a
+    # single `bench tpch run` process (Polars eager holds the tables it has read
+    # in memory)
+    tables_key = None
+    all_queries, backend, tables = None, None, None
+
+    while True:
+        cell = conn.recv()
+        if cell is None:
+            break
+
+        key = (
+            cell["sf"],
+            cell["n_partitions"],
+            cell["file_type"],
+            cell["decimal_to_float"],
+            cell["memory_limit"],
+            cell["layout"],
+            cell["schema_mode"],
+            cell["load_mode"],
+            cell["shm_cache"],
+            cell["shm_cache_gb"],
+            cell["data_root"],
+            cell["storage_options"],
+        )
+        if key != tables_key:
+            # drop the previous dataset's tables before registering the next one,
+            # so their shared memory cache files can be evicted
+            tables_key, all_queries, backend, tables = None, None, None, None
+            unpin_tables()
+            try:
+                all_queries, backend, tables = get_system_tables(
+                    system,
+                    sf=cell["sf"],
+                    n_partitions=cell["n_partitions"],
+                    file_type=cell["file_type"],
+                    decimal_to_float=cell["decimal_to_float"],
+                    memory_limit=cell["memory_limit"],
+                    layout=cell["layout"],
+                    schema_mode=cell["schema_mode"],
+                    load_mode=cell["load_mode"],
+                    shm_cache=cell["shm_cache"],
+                    shm_cache_gb=cell["shm_cache_gb"],
+                    data_root=cell["data_root"],
+                    storage_options=cell["storage_options"],
+                )
+            except Exception as e:
+                log.info(f"error setting up {system}: {e}")
+                conn.send("error")
+                continue
+            tables_key = key
+
+        queries = get_queries(all_queries, cell["queries"])
+        # NOTE: tables are read on first use, so the cell's tables are read here
+        # for read errors to be reported as "error", like setup errors (their
+        # stats are reported with the first query using them)
+        try:
+            for query in queries.values():
+                tables.read(get_query_tables(query, tables))
+        except Exception as e:
+            log.info(f"error reading tables for {system}: {e}")
+            conn.send("error")
+            continue
+
+        # NOTE: failed queries are recorded by the worker, so they are reported
+        # as "failed" rather than "error" (which the caller has to record)
+        ok = True
+        for q, query in queries.items():
+            ok &= run_query(
+                query,
+                q,
+                system=system,
+                backend=backend,
+                tables=tables,
+                sf=cell["sf"],
+                n_partitions=cell["n_partitions"],
+                session_id=cell["session_id"],
+                instance_type=cell["instance_type"],
+                file_type=cell["file_type"],
+                decimal_to_float=cell["decimal_to_float"],
+                warmup=cell["warmup"],
+                repeat=cell["iterations"],
+                phases=cell["phases"],
+                sample_interval_ms=cell["sample_interval_ms"],
+                sample_detail=cell["sample_detail"],
+                layout=cell["layout"],
+                schema_mode=cell["schema_mode"],
+                shm_cache=cell["shm_cache"],
+                cache_state=cell["cache_state"],
+                data_root=cell["data_root"],
+                storage_options=cell["storage_options"],
+            )
+        conn.send("ok" if ok else "failed")
+
+    # NOTE: atexit handlers don't run in multiprocessing children
+    flush_monitor_results()
+    conn.close()
+
+
+class Worker:
+    """
+    long-lived process that runs tpc-h queries for a single system
+
+    the worker keeps its backend connection and registered tables warm across
+    run cells, so only the first cell for a dataset pays for imports, connecting
+    and registering tables
+    """
+
+    def __init__(self, system: str, recycle_every: int = None, env: dict = None):
+        self.system = system
+        self.recycle_every = recycle_every
+        self.env = env or {}
+        self.process = None
+        self.conn = None
+        self.n_queries = 0
+
+    def start(self):
+        ctx = mp.get_context("spawn")
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main, args=(child_conn, self.system), daemon=True
+        )
+
+        # NOTE: environment variables like POLARS_MAX_THREADS must be set before
+        # the worker starts, so they are set on the parent while spawning
+        with _ENV_LOCK:
+            environ = dict(os.environ)
+            os.environ.update(self.env)
+            try:
+                self.process.start()
+            finally:
+                os.environ.clear()
+                os.environ.update(environ)
+        child_conn.close()
+        self.n_queries = 0
+        log.info(f"started worker for {self.system} (pid {self.process.pid})")
+
+    def stop(self):
+        if self.process is None:
+            return
+
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=30)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+        log.info(f"stopped worker for {self.system} (pid {self.process.pid})")
+        self.process = None
+        self.conn = None
+
+    def run(self, cell: dict, timeout: float = None, memory_limit: int = None) -> dict:
+        """
+        run a cell (a dict of run parameters and query numbers) on the worker
+
+        the worker is killed if the cell runs longer than `timeout` seconds or
+        uses more than `memory_limit` bytes. returns the status ("ok", "failed",
+        "error", "timeout", "oom" or "crash"), elapsed seconds and peak RSS
+        """
+        if self.process is None:
+            self.start()
+
+        result = {"status": None, "elapsed_seconds": None, "peak_rss_bytes": None}
+        try:
+            self.conn.send(cell)
+            result = watch(
+                self.process.pid,
+                self.conn.poll,
+                timeout=timeout,
+                memory_limit=memory_limit,
+            )
+            if result["status"] == "ok":
+                result["status"] = self.conn.recv()
+        except (EOFError, BrokenPipeError, OSError):
+            self.process.join(timeout=30)
+            log.info(
+                f"worker for {self.system} died (exit code {self.process.exitcode}), restarting..."
+            )
+            # NOTE: SIGKILL from outside the watchdog is most likely the OOM killer
+            result["status"] = "oom" if self.process.exitcode == -9 else "crash"
+
+        if result["status"] in ("timeout", "oom", "crash"):
+            self.stop()
+            return result
+
+        self.n_queries += len(cell["queries"])
+        if self.recycle_every and self.n_queries >= self.recycle_every:
+            log.info(
+                f"recycling worker for {self.system} after {self.n_queries} queries"
+            )
+            self.stop()
+
+        return result
@@ -0,0 +1,89 @@
+import psutil
+import resource
+
+from ibis_bench.utils.storage import get_proxy_pids
+
+
+def get_process_tree(process: psutil.Process = None) -> list:
+    """
+    the process and its children, except the proxies serving its reads from
+    object storage, which stand in for the network rather than being part of
+    a run
+    """
+    process = process or psutil.Process()
+    proxy_pids = get_proxy_pids()
+    return [
+        process,
+        *(
+            child
+            for child in process.children(recursive=True)
+            if child.pid not in proxy_pids
+        ),
+    ]
+
+
+def get_os_counters() -> dict:
+    """
+    cumulative OS counters for the current process and its children
+
+    rusage of children only includes children that have been waited for, so
+    I/O counters of still running children are added from psutil (except
+    proxies, see get_process_tree)
+    """
+    counters = {
+        "cpu_user_seconds": 0.0,
+        "cpu_system_seconds": 0.0,
+        "minor_page_faults": 0,
+        "major_page_faults": 0,
+        "voluntary_ctx_switches": 0,
+        "involuntary_ctx_switches": 0,
+    }
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        counters["cpu_user_seconds"] += usage.ru_utime
+        counters["cpu_system_seconds"] += usage.ru_stime
+        counters["minor_page_faults"] += usage.ru_minflt
+        counters["major_page_faults"] += usage.ru_majflt
+        counters["voluntary_ctx_switches"] += usage.ru_nvcsw
+        counters["involuntary_ctx_switches"] += usage.ru_nivcsw
+
+    # NOTE: I/O counters (/proc/<pid>/io) aren't available on macOS
+    process = psutil.Process()
+    if hasattr(process, "io_counters"):
+        counters.update(
+            {
+                "io_read_bytes": 0,
+                "io_write_bytes": 0,
+                "io_read_chars": 0,
+                "io_write_chars": 0,
+            }
+        )
+        for p in get_process_tree(process):
+            try:
+                io = p.io_counters()
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            # read/write bytes hit the storage layer, chars include the page cache
+            # NOTE: memory-mapped reads (e.g. Polars) count as page faults instead
+            counters["io_read_bytes"] += io.read_bytes
+            counters["io_write_bytes"] += io.write_bytes
+            counters["io_read_chars"] += getattr(io, "read_chars", 0)
+            counters["io_write_chars"] += getattr(io, "write_chars", 0)
+
+    return counters
+
+
+def get_counter_deltas(before: dict, after: dict, elapsed_seconds: float) -> dict:
+    deltas = {key: after[key] - before[key] for key in before}
+
+    cpu_seconds = deltas["cpu_user_seconds"] + deltas["cpu_system_seconds"]
+    # CPU-seconds per wall-second, i.e. the average number of busy cores
+    deltas["cpu_efficiency"] = (
+        cpu_seconds / elapsed_seconds if elapsed_seconds else None
+    )
+    if "io_read_chars" in deltas:
+        deltas["scan_bytes_per_second"] = (
+            deltas["io_read_chars"] / elapsed_seconds if elapsed_seconds else None
+        )
+
+    return deltas
@@ -0,0 +1,315 @@
+import os
+import time
+import ibis
+import pyarrow as pa
+import pyarrow.csv as pcsv
+import multiprocessing as mp
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ibis.backends.sql.datatypes import DuckDBType
+
+from ibis_bench.utils.logging import log
+from ibis_bench.utils.manifest import get_file_info, read_manifest
+
+CSV_COMPRESSIONS = ["gzip", "zstd"]
+CSV_EXTENSIONS = {None: ".csv", "gzip": ".csv.gz", "zstd": ".csv.zst"}
+
+# how CSV column types are determined, inferred by the engine or declared
+SCHEMA_MODES = ["infer", "declared"]
+DEFAULT_SCHEMA_MODE = "infer"
+
+
+def get_csv_options(
+    compression: str = None, delimiter: str = ",", header: bool = True
+) -> dict:
+    """
+    CSV writer options, the defaults match DuckDB's (uncompressed) defaults
+    """
+    if compression is not None and compression not in CSV_COMPRESSIONS:
+        raise ValueError(
+            f"unknown CSV compression: {compression} (one of {CSV_COMPRESSIONS})"
+        )
+    if len(delimiter) != 1:
+        raise ValueError(f"CSV delimiter must be a single character: {delimiter!r}")
+
+    return {
+        "compression": compression,
+        "delimiter": delimiter,
+        "header": header,
+    }
+
+
+def get_csv_extension(options: dict = None) -> str:
+    return CSV_EXTENSIONS[(options or get_csv_options())["compression"]]
+
+
+def is_csv_path(file_path: str) -> bool:
+    return file_path.endswith(tuple(CSV_EXTENSIONS.values()))
+
+
+def read_csv_options(data_directory: str) -> dict:
+    """
+    CSV options of a dataset, from its manifest (the defaults without one)
+
+    the options include each table's column names, to read files without a header
+    """
+    manifest = read_manifest(data_directory) or {}
+    options = dict(manifest.get("csv_options") or get_csv_options())
+    options["columns"] = {
+        table: [name for name, _ in table_info["schema"]]
+        for table, table_info in manifest.get("tables", {}).items()
+        if table_info["schema"]
+    }
+    return options
+
+
+def read_csv(
+    con,
+    table_directory: str,
+    table_name: str,
+    options: dict = None,
+    schema: ibis.Schema = None,
+):
+    """
+    read a table's CSV files with an Ibis backend
+
+    with a `schema`, the engine doesn't infer column names or types
+    """
+    options = options or get_csv_options()
+    if schema is not None:
+        return _read_csv_declared(con, table_directory, table_name, options, schema)
+
+    t = _read_csv(con, table_directory, table_name, options)
+    if not options["header"]:
+        columns = options.get("columns", {}).get(table_name)
+        if columns is None:
+            raise ValueError(f"no column names for {table_directory} (no header)")
+        t = t.rename(dict(zip(columns, t.columns)))
+    return t
+
+
+def _read_csv(con, table_directory: str, table_name: str, options: dict):
+    # NOTE: DuckDB and Polars detect compression from the file extension,
+    # DataFusion needs it explicitly
+    extension = get_csv_extension(options)
+    path = f"{table_directory}/*{extension}"
+    if con.name == "datafusion":
+        return con.read_csv(
+            path,
+            table_name=table_name,
+            delimiter=options["delimiter"],
+            has_header=options["header"],
+            file_extension=extension,
+            file_compression_type=options["compression"],
+        )
+    if con.name == "polars":
+        return con.read_csv(
+            path,
+            table_name=table_name,
+            separator=options["delimiter"],
+            has_header=options["header"],
+            # NOTE: Polars infers dates as strings unless asked to parse them
+            try_parse_dates=True,
+        )
+    return con.read_csv(
+        path,
+        table_name=table_name,
+        delim=options["delimiter"],
+        header=options["header"],
+    )
+
+
+def set_csv_schemas(manifest: dict, parquet_manifest: dict = None) -> dict:
+    """
+    fill in a CSV dataset manifest's table schemas from the Parquet dataset it
+    was written from, since CSV files don't store them
+    """
+    for table, table_info in manifest["tables"].items():
+        parquet_table_info = (parquet_manifest or {}).get("tables", {}).get(table)
+        if table_info["schema"] is None and parquet_table_info:
+            table_info["schema"] = parquet_table_info["schema"]
+    return manifest
+
+
+def _read_csv_declared(
+    con, table_directory: str, table_name: str, options: dict, schema: ibis.Schema
+):
+    extension = get_csv_extension(options)
+    path = f"{table_directory}/*{extension}"
+    if con.name == "datafusion":
+        return con.read_csv(
+            path,
+            table_name=table_name,
+            delimiter=options["delimiter"],
+            has_header=options["header"],
+            file_extension=extension,
+            file_compression_type=options["compression"],
+            schema=schema.to_pyarrow(),
+        )
+    if con.name == "polars":
+        return con.read_csv(
+            path,
+            table_name=table_name,
+            separator=options["delimiter"],
+            has_header=options["header"],
+            schema=schema.to_polars(),
+        )
+
+    # NOTE: Ibis can't pass decimal types to DuckDB's `columns` (and without
+    # them, DuckDB samples the files even with `types`), so the view is created
+    # with SQL
+    columns = ", ".join(
+        f"'{name}': '{DuckDBType.to_string(dtype)}'" for name, dtype in schema.items()
+    )
+    con.raw_sql(
+        f"CREATE OR REPLACE VIEW {table_name} AS SELECT * FROM read_csv("
+        f"'{path}', columns={{{columns}}}, delim='{options['delimiter']}', "
+        f"header={str(options['header']).lower()}, auto_detect=false)"
+    )
+    return con.table(table_name)
+
+
+def write_csv(t, file_path: str, options: dict = None):
+    """
+    write an Ibis (DuckDB) table to a CSV file with the options
+    """
+    options = options or get_csv_options()
+    kwargs = {"delim": options["delimiter"]}
+    if options["compression"]:
+        kwargs["compression"] = options["compression"]
+    t.to_csv(file_path, header=options["header"], **kwargs)
+
+
+class CSVWriter:
+    """
+    incremental CSV writer with the options, closing the (compressed) output
+    stream with the writer
+    """
+
+    def __init__(self, file_path: str, schema: pa.Schema, options: dict = None):
+        options = options or get_csv_options()
+        if options["compression"]:
+            self.sink = pa.CompressedOutputStream(file_path, options["compression"])
+        else:
+            self.sink = pa.OSFile(file_path, "wb")
+
+        # NOTE: only quote strings when needed, like DuckDB's writer
+        self.writer = pcsv.CSVWriter(
+            self.sink,
+            schema,
+            write_options=pcsv.WriteOptions(
+                include_header=options["header"],
+                delimiter=options["delimiter"],
+                quoting_style="needed",
+            ),
+        )
+
+    def write_table(self, table: pa.Table):
+        self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+
+def export_csv(
+    parquet_path: str, csv_path: str, options: dict = None, threads: int = None
+) -> dict:
+    """
+    write a Parquet file as a CSV file with the options
+
+    returns the file's info (for the manifest) and the elapsed seconds
+    """
+    start_time = time.time()
+    options = options or get_csv_options()
+    os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+
+    con = ibis.connect("duckdb://")
+    con.raw_sql("PRAGMA disable_progress_bar;")
+    if threads:
+        con.raw_sql(f"SET threads = {threads}")
+
+    # write to a temporary file and rename, so partial files are never read
+    tmp_path = os.path.join(
+        os.path.dirname(csv_path), f".{os.path.basename(csv_path)}.tmp"
+    )
+    write_csv(
+        con.read_parquet(parquet_path, hive_partitioning=False), tmp_path, options
+    )
+    os.replace(tmp_path, csv_path)
+    con.disconnect()
+
+    return {
+        "file_path": csv_path,
+        "seconds": time.time() - start_time,
+        "info": get_file_info(csv_path, header=options["header"]),
+    }
+
+
+def export_csvs(file_paths: list[tuple], options: dict = None, jobs: int = None):
+    """
+    write (Parquet path, CSV path) pairs as CSV files in parallel processes
+
+    returns the info of each file written (for the manifest)
+    """
+    jobs = max(min(jobs or os.cpu_count(), len(file_paths), os.cpu_count()), 1)
+    threads = max(os.cpu_count() // jobs, 1)
+    log.info(f"\twriting {len(file_paths)} CSV files with {jobs} jobs...")
+
+    results = []
+    if jobs == 1:
+        for parquet_path, csv_path in file_paths:
+            results.append(export_csv(parquet_path, csv_path, options))
+            log.info(f"\tdone writing {csv_path}")
+    else:
+        # NOTE: spawn, since forking a process with DuckDB's threads is unsafe
+        with ProcessPoolExecutor(
+            max_workers=jobs, mp_context=mp.get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(
+                    export_csv, parquet_path, csv_path, options, threads=threads
+                )
+                for parquet_path, csv_path in file_paths
+            ]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                log.info(
+                    f"\tdone writing {result['file_path']} in {result['seconds']:.1f}s"
+                )
+
+    return {result["file_path"]: result["info"] for result in results}
+
+
+def export_dataset(
+    parquet_directory: str,
+    csv_directory: str,
+    options: dict = None,
+    jobs: int = None,
+) -> dict:
+    """
+    write a Parquet dataset's files as CSV files, keeping the directory structure
+
+    CSV files that already exist are kept, so an interrupted export resumes
+    """
+    file_paths = []
+    for dir_name, dir_names, file_names in os.walk(parquet_directory):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            if not file_name.endswith(".parquet") or file_name.startswith("."):
+                continue
+            parquet_path = os.path.join(dir_name, file_name)
+            csv_path = os.path.join(
+                csv_directory,
+                os.path.relpath(parquet_path, parquet_directory).removesuffix(
+                    ".parquet"
+                )
+                + get_csv_extension(options),
+            )
+            if not os.path.exists(csv_path):
+                file_paths.append((parquet_path, csv_path))
+
+    if not file_paths:
+        return {}
+    return export_csvs(file_paths, options=options, jobs=jobs)
@@ -0,0 +1,108 @@
+import polars as pl
+import pyarrow as pa
+import pyarrow.fs as fs
+import pyarrow.dataset as ds
+
+from ibis_bench.utils.manifest import read_manifest
+
+IPC_COMPRESSIONS = ["lz4", "zstd"]
+# Arrow IPC file format (Feather v2)
+IPC_EXTENSION = ".arrow"
+
+# rows per record batch, matching DuckDB's row groups
+IPC_BATCH_SIZE = 122_880
+
+
+def get_ipc_options(compression: str = None) -> dict:
+    """
+    Arrow IPC writer options, uncompressed by default so files can be read
+    memory-mapped without copying
+    """
+    if compression is not None and compression not in IPC_COMPRESSIONS:
+        raise ValueError(
+            f"unknown IPC compression: {compression} (one of {IPC_COMPRESSIONS})"
+        )
+
+    return {"compression": compression}
+
+
+def read_ipc_options(data_directory: str) -> dict:
+    """
+    IPC options of a dataset, from its manifest (the defaults without one)
+    """
+    manifest = read_manifest(data_directory) or {}
+    return manifest.get("ipc_options") or get_ipc_options()
+
+
+def is_ipc_path(file_path: str) -> bool:
+    return file_path.endswith(IPC_EXTENSION)
+
+
+def open_ipc_writer(
+    file_path: str, schema: pa.Schema, options: dict = None
+) -> pa.ipc.RecordBatchFileWriter:
+    options = options or get_ipc_options()
+    return pa.ipc.new_file(
+        file_path,
+        schema,
+        options=pa.ipc.IpcWriteOptions(compression=options["compression"]),
+    )
+
+
+def write_ipc(t, file_path: str, options: dict = None):
+    """
+    write an Ibis table to an Arrow IPC file with the options
+    """
+    reader = t.to_pyarrow_batches(chunk_size=IPC_BATCH_SIZE)
+    with open_ipc_writer(file_path, reader.schema, options) as writer:
+        for batch in reader:
+            # NOTE: DuckDB's batches are non-nullable, unlike the schema
+            writer.write_table(pa.Table.from_batches([batch]).cast(reader.schema))
+
+
+def scan_ipc(table_directory: str, options: dict = None, lazy: bool = True):
+    """
+    read a table's IPC files with Polars, memory-mapped if uncompressed
+    """
+    options = options or get_ipc_options()
+    read_ipc = pl.scan_ipc if lazy else pl.read_ipc
+    # NOTE: compressed files have to be decompressed, so can't be memory-mapped
+    return read_ipc(
+        f"{table_directory}/*{IPC_EXTENSION}",
+        memory_map=options["compression"] is None,
+    )
+
+
+def read_ipc(con, table_directory: str, table_name: str, options: dict = None):
+    """
+    read a table's IPC files with an Ibis backend, memory-mapped
+    """
+    if con.name == "polars":
+        return con.create_table(table_name, scan_ipc(table_directory, options))
+
+    options = options or get_ipc_options()
+    if con.name == "datafusion" and options["compression"] is None:
+        # NOTE: DataFusion reads uncompressed IPC files itself, since it requires
+        # buffers aligned beyond what memory-mapped files guarantee (for
+        # decimals), and external tables can't be replaced, so it's dropped first
+        con.con.deregister_table(table_name)
+        con.raw_sql(
+            f"CREATE EXTERNAL TABLE {table_name} STORED AS ARROW "
+            f"LOCATION '{table_directory}/'"
+        )
+        return con.table(table_name)
+
+    # NOTE: otherwise the backend scans an Arrow dataset, memory-mapped for
+    # DuckDB, and decompressed by Arrow for DataFusion (which is built without
+    # IPC compression)
+    dataset = ds.dataset(
+        table_directory,
+        format="ipc",
+        filesystem=fs.LocalFileSystem(use_mmap=con.name != "datafusion"),
+    )
+    if con.name == "datafusion":
+        con.con.deregister_table(table_name)
+        con.con.register_dataset(table_name, dataset)
+    else:
+        con.con.register(table_name, dataset)
+    return con.table(table_name)
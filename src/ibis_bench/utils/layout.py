@@ -0,0 +1,182 @@
+import os
+import ibis
+import pyarrow as pa
+import ibis.selectors as s
+import pyarrow.parquet as pq
+
+DEFAULT_LAYOUT = "default"
+CODECS = ["zstd", "snappy", "lz4", "none"]
+PARTITION_BY = ["year", "month"]
+
+# rows per batch read from DuckDB when no row group size is set
+DEFAULT_BATCH_SIZE = 1_000_000
+
+
+def get_layout(
+    row_group_size: int = None,
+    page_size: int = None,
+    compression: str = None,
+    dictionary: bool = True,
+    sort_by: list[str] = None,
+    partition_by: str = None,
+    floats: bool = False,
+) -> dict:
+    """
+    Parquet layout options, None for the writer's defaults
+
+    `partition_by` ("year" or "month") hive-partitions fact tables by date and
+    `floats` stores decimal columns as float64 (in every file type)
+    """
+    if compression is not None and compression not in CODECS:
+        raise ValueError(f"unknown compression: {compression} (one of {CODECS})")
+    if partition_by is not None and partition_by not in PARTITION_BY:
+        raise ValueError(
+            f"unknown partitioning: {partition_by} (one of {PARTITION_BY})"
+        )
+
+    return {
+        "row_group_size": row_group_size,
+        "page_size": page_size,
+        "compression": compression,
+        "dictionary": dictionary,
+        "sort_by": list(sort_by) if sort_by else None,
+        "partition_by": partition_by,
+        "floats": floats,
+    }
+
+
+def get_layout_name(layout: dict = None) -> str:
+    """
+    directory name of a layout, e.g. "rg122880_zstd_nodict_sort-l_shipdate"
+    """
+    if not layout:
+        return DEFAULT_LAYOUT
+
+    # NOTE: no "=" in the name, so engines don't read it as a hive partition
+    parts = []
+    if layout["row_group_size"]:
+        parts.append(f"rg{layout['row_group_size']}")
+    if layout["page_size"]:
+        parts.append(f"page{layout['page_size']}")
+    if layout["compression"]:
+        parts.append(layout["compression"])
+    if not layout["dictionary"]:
+        parts.append("nodict")
+    if layout["sort_by"]:
+        parts.append("sort-" + "-".join(layout["sort_by"]))
+    if layout["partition_by"]:
+        parts.append(f"hive-{layout['partition_by']}")
+    if layout["floats"]:
+        parts.append("float")
+
+    return "_".join(parts) or DEFAULT_LAYOUT
+
+
+def get_partition_columns(layout: str = DEFAULT_LAYOUT) -> list[str]:
+    """
+    hive partition columns of a layout, from its name
+    """
+    for part in layout.split("_"):
+        if part == "hive-year":
+            return ["year"]
+        if part == "hive-month":
+            return ["year", "month"]
+    return []
+
+
+def is_float_layout(layout: str = DEFAULT_LAYOUT) -> bool:
+    """
+    whether a layout stores decimal columns as float64, from its name
+    """
+    return "float" in layout.split("_")
+
+
+def cast_decimals(t):
+    """
+    cast an Ibis table's decimal columns to float64
+    """
+    return t.mutate(s.across(s.of_type("decimal"), ibis._.cast("float64")))
+
+
+def get_float_schema(schema: ibis.Schema) -> ibis.Schema:
+    """
+    a schema with its decimal columns as float64, as stored by float layouts
+    """
+    return ibis.schema(
+        {
+            name: "float64" if dtype.is_decimal() else dtype
+            for name, dtype in schema.items()
+        }
+    )
+
+
+def get_layout_dir(data_dir: str, layout: str = DEFAULT_LAYOUT) -> str:
+    """
+    insert the layout into a data directory, e.g. tpch_data/parquet/sf=1/n=1
+    becomes tpch_data/parquet/layouts/<layout>/sf=1/n=1
+    """
+    if layout == DEFAULT_LAYOUT:
+        return data_dir
+
+    root, dir_name, *rest = data_dir.split(os.sep)
+    return os.path.join(root, dir_name, "layouts", layout, *rest)
+
+
+def has_writer_options(layout: dict = None) -> bool:
+    """
+    whether a layout needs a configured writer (rather than DuckDB's defaults)
+    """
+    return bool(layout) and any(
+        [
+            layout["row_group_size"],
+            layout["page_size"],
+            layout["compression"],
+            not layout["dictionary"],
+        ]
+    )
+
+
+def sort_table(t, layout: dict):
+    """
+    sort an Ibis table by the layout's sort keys it has
+    """
+    sort_by = [col for col in (layout["sort_by"] or []) if col in t.columns]
+    return t.order_by(sort_by) if sort_by else t
+
+
+def open_parquet_writer(
+    file_path: str, schema: pa.Schema, layout: dict = None
+) -> pq.ParquetWriter:
+    layout = layout or get_layout()
+    kwargs = {}
+    if layout["compression"]:
+        kwargs["compression"] = layout["compression"]
+    if layout["page_size"]:
+        kwargs["data_page_size"] = layout["page_size"]
+
+    return pq.ParquetWriter(
+        file_path, schema, use_dictionary=layout["dictionary"], **kwargs
+    )
+
+
+def get_batch_size(layout: dict = None) -> int:
+    # one batch per row group, since the writer starts a row group per batch
+    return (layout or {}).get("row_group_size") or DEFAULT_BATCH_SIZE
+
+
+def write_parquet(t, file_path: str, layout: dict):
+    """
+    write an Ibis table to a Parquet file with the layout
+    """
+    t = sort_table(t, layout)
+    # NOTE: sorting and partitioning alone keep DuckDB's writer, so the layout
+    # only differs from the default in what it's meant to
+    if not has_writer_options(layout):
+        t.to_parquet(file_path)
+        return
+
+    reader = t.to_pyarrow_batches(chunk_size=get_batch_size(layout))
+    with open_parquet_writer(file_path, reader.schema, layout) as writer:
+        for batch in reader:
+            # NOTE: DuckDB's batches are non-nullable, unlike the schema
+            writer.write_table(pa.Table.from_batches([batch]).cast(reader.schema))
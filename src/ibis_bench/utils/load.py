@@ -0,0 +1,124 @@
+import time
+import psutil
+import polars as pl
+
+from collections.abc import Mapping
+
+from ibis_bench.utils.logging import log
+
+# how queries read tables, as views over the files (decoded by every query) or
+# loaded into the engine's native storage once, before the queries
+LOAD_MODES = ["view", "native"]
+DEFAULT_LOAD_MODE = "view"
+
+
+def _load_table(name: str, t):
+    if isinstance(t, pl.LazyFrame):
+        return t.collect().lazy()
+    if isinstance(t, pl.DataFrame):
+        return t
+
+    con = t._find_backend()
+    if con.name == "duckdb":
+        # NOTE: DuckDB's file views are temporary and would shadow a table of
+        # the same name, so the table is created and renamed after the view is
+        # dropped
+        con.create_table(f"{name}_native", t)
+        con.drop_view(name)
+        con.raw_sql(f"ALTER TABLE {name}_native RENAME TO {name}")
+        return con.table(name)
+    if con.name == "polars":
+        # NOTE: Polars tables are lazy, so they're collected into DataFrames
+        return con.create_table(name, con.to_polars(t), overwrite=True)
+    return con.create_table(name, t, overwrite=True)
+
+
+class TableRegistry(Mapping):
+    """
+    tables by name, read (and loaded into the engine's native storage, see
+    LOAD_MODES) on first access, so only the tables queries use are read
+
+    `read_table` reads a table by name
+    """
+
+    def __init__(
+        self, read_table, table_names: list[str], load_mode: str = DEFAULT_LOAD_MODE
+    ):
+        if load_mode not in LOAD_MODES:
+            raise ValueError(f"unknown load mode: {load_mode} (one of {LOAD_MODES})")
+
+        self.read_table = read_table
+        self.table_names = list(table_names)
+        self.load_mode = load_mode
+        # tables and their read (and load) stats, by name
+        self.tables = {}
+        self.stats = {}
+        # tables whose stats were reported with a query, see get_stats
+        self.reported = set()
+
+    def __getitem__(self, name: str):
+        if name not in self.table_names:
+            raise KeyError(name)
+        if name not in self.tables:
+            self.tables[name], self.stats[name] = self._read(name)
+        return self.tables[name]
+
+    def __iter__(self):
+        return iter(self.table_names)
+
+    def __len__(self) -> int:
+        return len(self.table_names)
+
+    def _read(self, name: str) -> tuple:
+        start_time = time.time()
+        t = self.read_table(name)
+        stats = {
+            "read_seconds": time.time() - start_time,
+            "load_seconds": None,
+            "load_rss_bytes": None,
+        }
+        log.info(f"\tread {name} in {stats['read_seconds']:.3f}s")
+
+        if self.load_mode == "native":
+            process = psutil.Process()
+            rss_before = process.memory_info().rss
+            start_time = time.time()
+            t = _load_table(name, t)
+            stats["load_seconds"] = time.time() - start_time
+            stats["load_rss_bytes"] = process.memory_info().rss - rss_before
+            log.info(
+                f"\tloaded {name} in {stats['load_seconds']:.3f}s "
+                f"({stats['load_rss_bytes'] / 1024**2:,.0f} MB)"
+            )
+
+        return t, stats
+
+    def read(self, table_names: list[str]):
+        """
+        read (and load) the tables that haven't been read yet
+        """
+        for name in table_names:
+            self[name]
+
+    def get_stats(self, table_names: list[str]) -> dict:
+        """
+        total read (and load) seconds and memory of the tables not reported with
+        an earlier query, reading them if they haven't been read yet
+
+        each table's stats are reported once, with the first query using it,
+        so summing the stats of a run's records counts every read once
+        """
+        self.read(table_names)
+        stats = [self.stats[name] for name in table_names if name not in self.reported]
+        self.reported.update(table_names)
+
+        native = self.load_mode == "native"
+        return {
+            "read_seconds": sum(s["read_seconds"] for s in stats),
+            "load_seconds": sum(s["load_seconds"] for s in stats) if native else None,
+            "load_rss_bytes": sum(s["load_rss_bytes"] for s in stats)
+            if native
+            else None,
+            # tables first used by the query, the others were used before
+            "tables_read": len(stats),
+        }
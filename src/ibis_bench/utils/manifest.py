@@ -0,0 +1,248 @@
+import os
+import json
+import hashlib
+import inspect
+import posixpath
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from datetime import datetime
+
+from ibis_bench.utils.logging import log
+from ibis_bench.utils.storage import get_filesystem, is_url
+
+MANIFEST_FILE_NAME = "_manifest.json"
+
+# bytes read at a time when checksumming files
+CHECKSUM_BLOCK_SIZE = 8 * 1024**2
+
+
+def _is_data_file(file_name: str) -> bool:
+    # temporary files, markers and the manifest itself start with "." or "_"
+    return not file_name.startswith((".", "_"))
+
+
+def _count_lines(file_path: str) -> tuple:
+    # lines and bytes of a compressed file, decompressed
+    n_lines = 0
+    n_bytes = 0
+    with pa.input_stream(file_path, compression="detect") as f:
+        while block := f.read(CHECKSUM_BLOCK_SIZE):
+            n_lines += block.count(b"\n")
+            n_bytes += len(block)
+    return n_lines, n_bytes
+
+
+def get_file_info(file_path: str, header: bool = True) -> dict:
+    """
+    rows, bytes, row groups and checksum of a Parquet, Arrow IPC or (compressed)
+    CSV file
+
+    `header` is whether a CSV file has a header row
+    """
+    checksum = hashlib.sha256()
+    n_lines = 0
+    with open(file_path, "rb") as f:
+        while block := f.read(CHECKSUM_BLOCK_SIZE):
+            checksum.update(block)
+            n_lines += block.count(b"\n")
+
+    info = {
+        "bytes": os.path.getsize(file_path),
+        "checksum": checksum.hexdigest(),
+    }
+    if file_path.endswith(".parquet"):
+        metadata = pq.read_metadata(file_path)
+        info["rows"] = metadata.num_rows
+        info["row_groups"] = metadata.num_row_groups
+        info["uncompressed_bytes"] = sum(
+            metadata.row_group(i).total_byte_size
+            for i in range(metadata.num_row_groups)
+        )
+        info["schema"] = [
+            [field.name, str(field.type)] for field in metadata.schema.to_arrow_schema()
+        ]
+    elif file_path.endswith(".arrow"):
+        # NOTE: Arrow IPC files, their record batches are the row groups
+        with pa.memory_map(file_path) as source:
+            reader = pa.ipc.open_file(source)
+            info["rows"] = 0
+            info["uncompressed_bytes"] = 0
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                info["rows"] += batch.num_rows
+                info["uncompressed_bytes"] += batch.nbytes
+            info["row_groups"] = reader.num_record_batches
+            info["schema"] = [[field.name, str(field.type)] for field in reader.schema]
+    else:
+        uncompressed_bytes = info["bytes"]
+        if not file_path.endswith(".csv"):
+            n_lines, uncompressed_bytes = _count_lines(file_path)
+        # NOTE: TPC data has no quoted newlines, so rows are lines after the header
+        info["rows"] = max(n_lines - int(header), 0)
+        info["row_groups"] = None
+        info["uncompressed_bytes"] = uncompressed_bytes
+        info["schema"] = None
+
+    return info
+
+
+def build_manifest(data_dir: str, file_infos: dict = None, **metadata) -> dict:
+    """
+    describe the tables and files of a dataset
+
+    `file_infos` are already computed file infos by path, other files are read
+    """
+    file_infos = file_infos or {}
+    header = (metadata.get("csv_options") or {}).get("header", True)
+
+    tables = {}
+    for table in sorted(os.listdir(data_dir)):
+        table_dir = os.path.join(data_dir, table)
+        if not os.path.isdir(table_dir) or not _is_data_file(table):
+            continue
+
+        files = {}
+        for dir_name, dir_names, file_names in os.walk(table_dir):
+            dir_names.sort()
+            for file_name in sorted(filter(_is_data_file, file_names)):
+                file_path = os.path.join(dir_name, file_name)
+                info = dict(
+                    file_infos.get(file_path) or get_file_info(file_path, header=header)
+                )
+                files[os.path.relpath(file_path, table_dir)] = info
+
+        schemas = [info.pop("schema") for info in files.values()]
+        tables[table] = {
+            "rows": sum(info["rows"] for info in files.values()),
+            "bytes": sum(info["bytes"] for info in files.values()),
+            "uncompressed_bytes": sum(
+                info["uncompressed_bytes"] for info in files.values()
+            ),
+            "row_groups": sum(info["row_groups"] or 0 for info in files.values()),
+            "schema": schemas[0] if schemas else None,
+            "files": files,
+        }
+
+    checksum = hashlib.sha256()
+    for table, table_info in tables.items():
+        for file_path, info in table_info["files"].items():
+            checksum.update(f"{table}/{file_path}:{info['checksum']}\n".encode())
+
+    return {
+        **metadata,
+        "created_at": datetime.utcnow().isoformat(),
+        "rows": sum(table_info["rows"] for table_info in tables.values()),
+        "bytes": sum(table_info["bytes"] for table_info in tables.values()),
+        "checksum": checksum.hexdigest(),
+        "tables": tables,
+    }
+
+
+def write_manifest(data_dir: str, manifest: dict) -> str:
+    # written to a temporary file and renamed, so a manifest is always complete
+    manifest_path = os.path.join(data_dir, MANIFEST_FILE_NAME)
+    tmp_path = os.path.join(data_dir, f".{MANIFEST_FILE_NAME}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+    log.info(
+        f"\twrote manifest for {manifest['rows']:,} rows ({manifest['bytes'] / 1024**3:.2f} GB) to {manifest_path}"
+    )
+    return manifest_path
+
+
+def read_manifest(data_dir: str) -> dict:
+    manifest_path = os.path.join(data_dir, MANIFEST_FILE_NAME)
+    if is_url(manifest_path):
+        fs, path = get_filesystem(manifest_path)
+        if not fs.exists(path):
+            return None
+        with fs.open(path) as f:
+            return json.load(f)
+
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def _list_files(table_dir: str) -> dict:
+    """
+    bytes of a table's data files, by path relative to the table directory
+    """
+    if is_url(table_dir):
+        fs, path = get_filesystem(table_dir)
+        if not fs.exists(path):
+            return {}
+        return {
+            posixpath.relpath(file_path, path): info["size"]
+            for file_path, info in fs.find(path, detail=True).items()
+            if _is_data_file(posixpath.basename(file_path))
+        }
+
+    files = {}
+    for dir_name, _, file_names in os.walk(table_dir):
+        for file_name in filter(_is_data_file, file_names):
+            file_path = os.path.join(dir_name, file_name)
+            files[os.path.relpath(file_path, table_dir)] = os.path.getsize(file_path)
+    return files
+
+
+def validate_manifest(data_dir: str, manifest: dict, checksums: bool = False) -> list:
+    """
+    compare a dataset's files to its manifest, returning a list of problems
+
+    files are compared by size, and by content with `checksums` (local files
+    only), `data_dir` can be a URL
+    """
+    problems = []
+    for table, table_info in manifest["tables"].items():
+        table_dir = os.path.join(data_dir, table)
+        files = _list_files(table_dir)
+        for file_path, info in table_info["files"].items():
+            if file_path not in files:
+                problems.append(f"missing {os.path.join(table_dir, file_path)}")
+            elif files[file_path] != info["bytes"]:
+                problems.append(
+                    f"size mismatch for {os.path.join(table_dir, file_path)}"
+                )
+            elif (
+                checksums
+                and not is_url(table_dir)
+                and get_file_info(os.path.join(table_dir, file_path))["checksum"]
+                != info["checksum"]
+            ):
+                problems.append(
+                    f"checksum mismatch for {os.path.join(table_dir, file_path)}"
+                )
+
+        for file_path in files:
+            if file_path not in table_info["files"]:
+                problems.append(f"unexpected {os.path.join(table_dir, file_path)}")
+
+    return problems
+
+
+def get_query_tables(query, table_names) -> list:
+    """
+    the tables a query reads, from its parameters
+    """
+    params = inspect.signature(query).parameters
+    return [table for table in table_names if table in params]
+
+
+def get_query_input(query, manifest: dict) -> dict:
+    """
+    rows and bytes of the tables a query reads, from its parameters
+    """
+    tables = get_query_tables(query, manifest["tables"])
+    return {
+        "input_rows": sum(manifest["tables"][table]["rows"] for table in tables),
+        "input_bytes": sum(manifest["tables"][table]["bytes"] for table in tables),
+        "input_uncompressed_bytes": sum(
+            manifest["tables"][table]["uncompressed_bytes"] for table in tables
+        ),
+    }
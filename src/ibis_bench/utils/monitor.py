@@ -1,13 +1,34 @@
 import os
+import glob
 import ibis
-import json
+import math
 import time
 import uuid
+import statistics
+import polars as pl
+import pyarrow.parquet as pq
 
 from datetime import datetime
 
+from ibis_bench.utils.layout import DEFAULT_LAYOUT, is_float_layout
+from ibis_bench.utils.csv_export import DEFAULT_SCHEMA_MODE
+from ibis_bench.utils.load import DEFAULT_LOAD_MODE
 from ibis_bench.utils.logging import log
-from ibis_bench.utils.write_data import write_results
+from ibis_bench.utils.page_cache import (
+    DEFAULT_CACHE_STATE,
+    get_read_stats,
+    set_cache_state,
+)
+from ibis_bench.utils.storage import DEFAULT_DATA_ROOT, get_storage_options
+from ibis_bench.utils.results_log import NATURAL_KEY, get_results_log
+from ibis_bench.utils.counters import get_os_counters, get_counter_deltas
+from ibis_bench.utils.sampler import DEFAULT_SAMPLE_INTERVAL_MS, ResourceSampler
+from ibis_bench.utils.scheduler import get_cpus, get_thread_limit
+from ibis_bench.utils.write_data import materialize_results, write_results
+
+# queries executed by this process (a `bench tpch run` or a pool worker), by
+# system, dataset and query number
+_EXECUTED_QUERIES = set()
 
 
 def get_timings_dir():
@@ -28,6 +49,15 @@ def get_raw_json_dir():
     return dir_name
 
 
+def get_results_dir():
+    dir_name = os.path.join(get_timings_dir(), "results")
+
+    if not os.path.exists(dir_name):
+        os.makedirs(dir_name)
+
+    return dir_name
+
+
 def get_cache_dir():
     dir_name = os.path.join(get_timings_dir(), "cache")
 
@@ -37,6 +67,15 @@ def get_cache_dir():
     return dir_name
 
 
+def get_timelines_dir():
+    dir_name = os.path.join(get_timings_dir(), "timelines")
+
+    if not os.path.exists(dir_name):
+        os.makedirs(dir_name)
+
+    return dir_name
+
+
 def monitor_it(
     func,
     sf: int,
@@ -45,22 +84,230 @@ def monitor_it(
     system: str,
     session_id: str,
     instance_type: str,
-    use_csv: bool,
+    file_type: str,
     decimal_to_float: bool,
     *args,
+    warmup: int = 0,
+    repeat: int = 1,
+    phases: bool = False,
+    sample_interval_ms: int = DEFAULT_SAMPLE_INTERVAL_MS,
+    sample_detail: bool = False,
+    layout: str = DEFAULT_LAYOUT,
+    schema_mode: str = DEFAULT_SCHEMA_MODE,
+    read_seconds: float = None,
+    load_mode: str = DEFAULT_LOAD_MODE,
+    load_stats: dict = None,
+    shm_cache: bool = False,
+    cache_state: str = DEFAULT_CACHE_STATE,
+    cache_files: list = None,
+    data_root: str = DEFAULT_DATA_ROOT,
+    storage_options: dict = None,
+    input_stats: dict = None,
+    tables_warm: bool = False,
     **kwargs,
 ):
     log.info(
         f"running and monitoring for system {system} query {query_number} at scale factor {sf} and {n_partitions} partitions (session id {session_id})..."
     )
-    start_time = time.time()
-    write_results(func(*args, **kwargs), sf, n_partitions, system, query_number)
-    elapsed_time = time.time() - start_time
+
+    record = get_run_record(
+        session_id=session_id,
+        instance_type=instance_type,
+        system=system,
+        sf=sf,
+        n_partitions=n_partitions,
+        query_number=query_number,
+        file_type=file_type,
+        decimal_to_float=decimal_to_float,
+        layout=layout,
+        schema_mode=schema_mode,
+        load_mode=load_mode,
+        shm_cache=shm_cache,
+        cache_state=cache_state,
+        data_root=data_root,
+        storage_options=storage_options,
+    )
+    record["warmup"] = warmup
+    # seconds of reading the tables first used by this query, and of loading
+    # them into native storage (and the memory it took) if loaded, only on the
+    # first record written for the query (the first timed iteration, unless a
+    # warmup fails), so summing records counts each read once
+    table_stats = {
+        "read_seconds": read_seconds,
+        "load_seconds": None,
+        "load_rss_bytes": None,
+        **(load_stats or {}),
+    }
+    record.update(dict.fromkeys(table_stats))
+    # rows and bytes of the query's tables, from the dataset manifest
+    record.update(input_stats or {})
+
+    # NOTE: the first timed iteration is cold if the process hasn't executed
+    # the query before and none of its tables were used by an earlier query
+    query_key = (
+        system,
+        sf,
+        n_partitions,
+        file_type,
+        decimal_to_float,
+        layout,
+        data_root,
+        query_number,
+    )
+    is_cold = warmup == 0 and not tables_warm and query_key not in _EXECUTED_QUERIES
+    _EXECUTED_QUERIES.add(query_key)
+
+    # untimed warmup iterations, so the timed iterations run with warm caches
+    for i in range(warmup):
+        log.info(f"\twarmup iteration {i + 1} of {warmup}...")
+        start_time = time.time()
+        try:
+            write_results(func(*args, **kwargs), sf, n_partitions, system, query_number)
+        except Exception as e:
+            write_failure_record({**record, **table_stats}, e, time.time() - start_time)
+            raise
+
+    elapsed_times = []
+    for iteration in range(repeat):
+        first_stats = table_stats if iteration == 0 else {}
+        # NOTE: files are evicted (for a cold run) and checked before sampling
+        # and timing start
+        cache_stats = set_cache_state(cache_files or [], cache_state)
+        sampler = (
+            ResourceSampler(sample_interval_ms, detailed=sample_detail)
+            if sample_interval_ms
+            else None
+        )
+        if sampler:
+            sampler.start()
+
+        error = None
+        counters_before = get_os_counters()
+        start_time = time.time()
+        try:
+            if phases:
+                phase_times = time_phases(
+                    func, args, kwargs, sf, n_partitions, system, query_number
+                )
+                elapsed_time = (
+                    phase_times["build_seconds"]
+                    + phase_times["execute_seconds"]
+                    + phase_times["write_seconds"]
+                )
+            else:
+                phase_times = {}
+                write_results(
+                    func(*args, **kwargs), sf, n_partitions, system, query_number
+                )
+                elapsed_time = time.time() - start_time
+            # NOTE: rates are per second of the interval the counters cover,
+            # which with phases also includes the separate compile and plan
+            counter_deltas = get_counter_deltas(
+                counters_before, get_os_counters(), time.time() - start_time
+            )
+            elapsed_times.append(elapsed_time)
+        except Exception as e:
+            error = e
+            elapsed_time = time.time() - start_time
+        finally:
+            if sampler:
+                sampler.stop()
+
+        # NOTE: the data files are evicted before a cold run, so the ones in the
+        # page cache after it are the ones it read (results aren't data files)
+        read_stats = {"n_data_files": None, "data_file_bytes": None}
+        if cache_state == "cold" and error is None:
+            read_stats = get_read_stats(cache_files or [])
+
+        resource_summary = {}
+        if sampler:
+            resource_summary = sampler.get_summary()
+            resource_summary["timeline_path"] = write_timeline(sampler.to_pyarrow())
+
+        if error is not None:
+            write_failure_record(
+                {
+                    **record,
+                    **first_stats,
+                    "iteration": iteration,
+                    **cache_stats,
+                    **resource_summary,
+                },
+                error,
+                elapsed_time,
+            )
+            raise error
+
+        data = {
+            **record,
+            **first_stats,
+            "timestamp": datetime.utcnow().isoformat(),
+            "status": "ok",
+            "execution_seconds": elapsed_time,
+            "iteration": iteration,
+            # the first execution of the query in this process, with tables
+            # not used by earlier queries
+            "is_cold": is_cold and iteration == 0,
+            **cache_stats,
+            **read_stats,
+            **get_input_throughput(input_stats, elapsed_time),
+            **phase_times,
+            **resource_summary,
+            **counter_deltas,
+        }
+
+        write_monitor_results(data)
+
     log.info(
         f"done running and monitoring for system {system} query {query_number} at scale factor {sf} and {n_partitions} partitions (session id {session_id})..."
     )
+    if repeat > 1:
+        summary = get_summary(elapsed_times)
+        log.info(
+            f"\t{repeat} iterations: min {summary['min']:.3f}s, median {summary['median']:.3f}s, p95 {summary['p95']:.3f}s"
+        )
 
-    data = {
+
+def get_input_throughput(input_stats: dict, elapsed_seconds: float) -> dict:
+    if not input_stats or not elapsed_seconds:
+        return {}
+
+    return {
+        "rows_per_second": input_stats["input_rows"] / elapsed_seconds,
+        "gb_per_second": input_stats["input_bytes"] / 1024**3 / elapsed_seconds,
+    }
+
+
+def get_run_record(
+    session_id: str,
+    instance_type: str,
+    system: str,
+    sf: int,
+    n_partitions: int,
+    query_number: int,
+    file_type: str,
+    decimal_to_float: bool,
+    layout: str = DEFAULT_LAYOUT,
+    schema_mode: str = DEFAULT_SCHEMA_MODE,
+    load_mode: str = DEFAULT_LOAD_MODE,
+    shm_cache: bool = False,
+    cache_state: str = DEFAULT_CACHE_STATE,
+    data_root: str = DEFAULT_DATA_ROOT,
+    storage_options: dict = None,
+) -> dict:
+    """
+    fields shared by all records of a run
+    """
+    storage_options = storage_options or get_storage_options()
+    # NOTE: decimals are queried as decimals, cast to floats by each query, or
+    # read as floats stored by a float layout
+    if is_float_layout(layout):
+        float_mode = "stored"
+    elif decimal_to_float:
+        float_mode = "cast"
+    else:
+        float_mode = "decimal"
+    return {
         "session_id": session_id,
         "instance_type": instance_type,
         "system": system,
@@ -68,19 +315,167 @@ def monitor_it(
         "sf": sf,
         "n_partitions": n_partitions,
         "query_number": query_number,
-        "execution_seconds": elapsed_time,
-        "file_type": "csv" if use_csv else "parquet",
+        "file_type": file_type,
         "floats": decimal_to_float,
+        "float_mode": float_mode,
+        "layout": layout,
+        "schema_mode": schema_mode,
+        "load_mode": load_mode,
+        "shm_cache": shm_cache,
+        "cache_state": cache_state,
+        "data_root": data_root,
+        "latency_ms": storage_options["latency_ms"],
+        "bandwidth_mbps": storage_options["bandwidth_mbps"],
+        "block_cache": storage_options["block_cache"] is not None,
+        "cpu_set": get_cpus(),
+        "threads": get_thread_limit(),
     }
 
+
+def get_failure_status(error: Exception) -> str:
+    # NOTE: DuckDB raises "Out of Memory Error", DataFusion "Resources exhausted"
+    message = str(error).lower()
+    if isinstance(error, MemoryError) or any(
+        s in message for s in ["out of memory", "resources exhausted"]
+    ):
+        return "oom"
+    return "error"
+
+
+def write_failure_record(
+    record: dict,
+    error,
+    elapsed_seconds: float,
+    peak_rss_bytes: int = None,
+):
+    """
+    write a record for a failed run; `error` is an exception or a status string
+    """
+    status = error if isinstance(error, str) else get_failure_status(error)
+    data = {
+        "peak_rss_bytes": peak_rss_bytes,
+        **record,
+        "timestamp": datetime.utcnow().isoformat(),
+        "status": status,
+        "error": None if isinstance(error, str) else str(error),
+        "execution_seconds": None,
+        "elapsed_seconds": elapsed_seconds,
+    }
+
+    log.info(f"\twriting {status} record after {elapsed_seconds:.1f}s")
     write_monitor_results(data)
 
 
-def write_monitor_results(results):
+def time_phases(func, args, kwargs, sf, n_partitions, system, query_number) -> dict:
+    """
+    run a query, timing each phase separately
+
+    - build: constructing the query expression (or, for Polars eager, running it)
+    - compile: compiling the Ibis expression to the backend's SQL or LazyFrame
+    - plan: planning by the engine (EXPLAIN or LazyFrame.explain)
+    - execute: executing the query into memory (Arrow or Polars)
+    - write: writing the in-memory result to Parquet
+
+    compile and plan are measured on separate calls, so they are also paid again
+    inside execute; the end-to-end time is build + execute + write
+    """
+    phase_times = {
+        "build_seconds": None,
+        "compile_seconds": None,
+        "plan_seconds": None,
+        "execute_seconds": None,
+        "write_seconds": None,
+    }
+
+    start_time = time.time()
+    res = func(*args, **kwargs)
+    phase_times["build_seconds"] = time.time() - start_time
+
+    if isinstance(res, ibis.Table):
+        backend = res._find_backend()
+
+        start_time = time.time()
+        compiled = backend.compile(res)
+        phase_times["compile_seconds"] = time.time() - start_time
+
+        start_time = time.time()
+        if isinstance(compiled, str):
+            plan = backend.raw_sql(f"EXPLAIN {compiled}")
+            # NOTE: DuckDB returns a cursor, DataFusion a lazy DataFrame
+            plan.collect() if hasattr(plan, "collect") else plan.fetchall()
+        else:
+            compiled.explain()
+        phase_times["plan_seconds"] = time.time() - start_time
+    elif isinstance(res, pl.LazyFrame):
+        start_time = time.time()
+        res.explain()
+        phase_times["plan_seconds"] = time.time() - start_time
+
+    start_time = time.time()
+    res = materialize_results(res)
+    phase_times["execute_seconds"] = time.time() - start_time
+
+    start_time = time.time()
+    write_results(res, sf, n_partitions, system, query_number)
+    phase_times["write_seconds"] = time.time() - start_time
+
+    return phase_times
+
+
+def get_summary(elapsed_times: list[float]) -> dict:
+    elapsed_times = sorted(elapsed_times)
+    # nearest-rank percentile
+    p95_index = max(math.ceil(0.95 * len(elapsed_times)) - 1, 0)
+
+    return {
+        "min": elapsed_times[0],
+        "median": statistics.median(elapsed_times),
+        "p95": elapsed_times[p95_index],
+    }
+
+
+def write_timeline(timeline) -> str:
     file_id = str(uuid.uuid4())
-    file_path = os.path.join(get_raw_json_dir(), f"file_id={file_id}.json")
+    file_path = os.path.join(get_timelines_dir(), f"file_id={file_id}.parquet")
+
+    log.info(f"\twriting resource timeline to {file_path}...")
+    pq.write_table(timeline, file_path)
+    log.info(f"\tdone writing resource timeline to {file_path}...")
+
+    return file_path
 
-    log.info(f"\twriting monitor data to {file_path}...")
-    with open(file_path, "w") as f:
-        json.dump(results, f)
-    log.info(f"\tdone writing monitor data to {file_path}...")
+
+def write_monitor_results(results):
+    get_results_log(get_results_dir()).append(results)
+
+
+def flush_monitor_results():
+    get_results_log(get_results_dir()).flush()
+
+
+def read_monitor_results(con=None):
+    con = con or ibis.connect("duckdb://")
+    # NOTE: session_id is already a column, so hive partitioning is disabled
+    return con.read_parquet(
+        f"{get_results_dir()}/**/*.parquet",
+        union_by_name=True,
+        hive_partitioning=False,
+    )
+
+
+def read_legacy_results(con=None):
+    """
+    records from before the results log, combined from raw JSON files into the
+    cache directory (see `bench2 combine-json`), None if there are none
+    """
+    con = con or ibis.connect("duckdb://")
+    if not glob.glob(f"{get_cache_dir()}/**/*.parquet", recursive=True):
+        return None
+    t = con.read_parquet(
+        f"{get_cache_dir()}/**/*.parquet",
+        union_by_name=True,
+        hive_partitioning=False,
+    )
+    # NOTE: each file combined before combining was incremental has every record
+    # up to when it was written
+    return t.distinct(on=NATURAL_KEY, keep="first")
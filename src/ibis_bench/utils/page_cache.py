@@ -0,0 +1,142 @@
+import os
+import mmap
+import ctypes
+import ctypes.util
+
+from ibis_bench.utils.logging import log
+
+# whether data files are left in the OS page cache between timed runs (warm) or
+# evicted before each of them (cold)
+CACHE_STATES = ["warm", "cold"]
+DEFAULT_CACHE_STATE = "warm"
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+_libc.mmap.restype = ctypes.c_void_p
+_libc.mmap.argtypes = [
+    ctypes.c_void_p,
+    ctypes.c_size_t,
+    ctypes.c_int,
+    ctypes.c_int,
+    ctypes.c_int,
+    ctypes.c_long,
+]
+_libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+_libc.mincore.argtypes = [
+    ctypes.c_void_p,
+    ctypes.c_size_t,
+    ctypes.POINTER(ctypes.c_ubyte),
+]
+_MAP_FAILED = ctypes.c_void_p(-1).value
+
+
+def get_data_files(data_directory: str, table_names: list[str]) -> list[str]:
+    """
+    paths of the data files of a dataset's tables
+    """
+    file_paths = []
+    for table_name in table_names:
+        for dir_name, _, file_names in os.walk(
+            os.path.join(data_directory, table_name)
+        ):
+            for file_name in sorted(file_names):
+                # temporary files and markers start with "." or "_"
+                if not file_name.startswith((".", "_")):
+                    file_paths.append(os.path.join(dir_name, file_name))
+    return file_paths
+
+
+def evict_files(file_paths: list[str]):
+    """
+    drop files from the OS page cache (doesn't need root, unlike drop_caches)
+    """
+    if not hasattr(os, "posix_fadvise"):
+        raise ValueError("evicting files from the page cache requires posix_fadvise")
+
+    for file_path in file_paths:
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            # NOTE: dirty pages (of recently written files) aren't dropped, so
+            # they're written back first
+            os.fdatasync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def _get_resident_bytes(file_path: str) -> int:
+    size = os.path.getsize(file_path)
+    if size == 0:
+        return 0
+
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        # NOTE: mapping a file doesn't read it, mincore reports which of its
+        # pages are already in the page cache
+        addr = _libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+        if addr == _MAP_FAILED:
+            raise OSError(ctypes.get_errno(), f"mmap failed for {file_path}")
+        try:
+            n_pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+            pages = (ctypes.c_ubyte * n_pages)()
+            if _libc.mincore(addr, size, pages) != 0:
+                raise OSError(ctypes.get_errno(), f"mincore failed for {file_path}")
+            resident_pages = sum(page & 1 for page in pages)
+        finally:
+            _libc.munmap(addr, size)
+    finally:
+        os.close(fd)
+
+    return min(resident_pages * mmap.PAGESIZE, size)
+
+
+def get_resident_bytes(file_paths: list[str]) -> int:
+    """
+    bytes of the files in the OS page cache
+    """
+    return sum(_get_resident_bytes(file_path) for file_path in file_paths)
+
+
+def get_read_stats(file_paths: list[str]) -> dict:
+    """
+    number and bytes of the files in the page cache
+
+    after a cold run (the files were evicted before it), these are the files
+    the run read and the bytes it read of them, in pages (including the OS's
+    readahead), whether read with read() or memory-mapped
+    """
+    resident_bytes = [_get_resident_bytes(file_path) for file_path in file_paths]
+    return {
+        "n_data_files": sum(1 for n_bytes in resident_bytes if n_bytes),
+        "data_file_bytes": sum(resident_bytes),
+    }
+
+
+def set_cache_state(file_paths: list[str], cache_state: str) -> dict:
+    """
+    evict the files from the page cache for a cold run, then check how much of
+    them is in it
+
+    returns the resident bytes and fraction of the files
+    """
+    if cache_state not in CACHE_STATES:
+        raise ValueError(f"unknown cache state: {cache_state} (one of {CACHE_STATES})")
+    # NOTE: otherwise nothing is evicted, but the run is recorded as cold
+    if cache_state == "cold" and not file_paths:
+        raise ValueError("no data files to evict for a cold run")
+
+    if cache_state == "cold":
+        evict_files(file_paths)
+
+    total_bytes = sum(os.path.getsize(file_path) for file_path in file_paths)
+    resident_bytes = get_resident_bytes(file_paths)
+    if cache_state == "cold" and resident_bytes:
+        # NOTE: pages memory-mapped by a process (e.g. Arrow IPC files) can't
+        # be evicted while they're mapped
+        log.info(
+            f"\t{resident_bytes / 1024**2:,.0f} MB of the data files are still in the page cache"
+        )
+
+    return {
+        "page_cache_bytes": resident_bytes,
+        "page_cache_fraction": resident_bytes / total_bytes if total_bytes else None,
+    }
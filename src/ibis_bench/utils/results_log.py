@@ -0,0 +1,315 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import psutil
+import threading
+import ibis
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from collections import defaultdict
+
+from ibis_bench.utils.logging import log
+
+DEFAULT_FLUSH_EVERY = 100
+DEFAULT_FLUSH_SECONDS = 60
+
+# identifies a record, used to drop duplicates from recovered write-ahead logs
+NATURAL_KEY = [
+    "session_id",
+    "system",
+    "sf",
+    "n_partitions",
+    "query_number",
+    "timestamp",
+]
+
+
+def write_parquet_atomic(table: pa.Table, dir_name: str) -> str:
+    os.makedirs(dir_name, exist_ok=True)
+
+    file_path = os.path.join(dir_name, f"part-{uuid.uuid4()}.parquet")
+    tmp_path = os.path.join(dir_name, f".{os.path.basename(file_path)}.tmp")
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, file_path)
+
+    return file_path
+
+
+def _get_partition_dir(root: str, record: dict) -> str:
+    return os.path.join(
+        root,
+        f"date={record['timestamp'][:10]}",
+        f"session_id={record['session_id']}",
+    )
+
+
+def _records_to_pyarrow(records: list[dict]) -> pa.Table:
+    # NOTE: records can have different keys (e.g. phase timings are optional)
+    columns = list(dict.fromkeys(key for record in records for key in record))
+    return pa.table({key: [record.get(key) for record in records] for key in columns})
+
+
+def _dedupe(records: list[dict]) -> list[dict]:
+    deduped = {}
+    for record in records:
+        deduped.setdefault(tuple(record.get(key) for key in NATURAL_KEY), record)
+    return list(deduped.values())
+
+
+def _write_records(root: str, records: list[dict]) -> list[str]:
+    partitions = defaultdict(list)
+    for record in records:
+        partitions[_get_partition_dir(root, record)].append(record)
+
+    return [
+        write_parquet_atomic(_records_to_pyarrow(partition_records), dir_name)
+        for dir_name, partition_records in partitions.items()
+    ]
+
+
+class ResultsLog:
+    """
+    append-only results log, partitioned by date and session id
+
+    records are buffered in memory and appended as Parquet files in batches;
+    each record is also appended to a write-ahead log (a JSON lines file) so
+    records buffered by a process that crashes can be recovered by `compact`
+
+    appending and flushing are thread-safe, e.g. for failure records written by
+    `bench2 run --parallel`'s scheduler threads
+    """
+
+    def __init__(
+        self,
+        root: str,
+        flush_every: int = DEFAULT_FLUSH_EVERY,
+        flush_seconds: float = DEFAULT_FLUSH_SECONDS,
+    ):
+        self.root = root
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.records = []
+        self.last_flush = time.time()
+
+        self.wal_dir = os.path.join(root, "_wal")
+        os.makedirs(self.wal_dir, exist_ok=True)
+        self.wal_path = None
+        # NOTE: guards the buffer and the WAL, so a flush can't drop a record
+        # another thread appended between writing the files and clearing them
+        self.lock = threading.Lock()
+
+    def append(self, record: dict):
+        with self.lock:
+            self._append(record)
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _append(self, record: dict):
+        if self.wal_path is None:
+            self.wal_path = os.path.join(
+                self.wal_dir, f"pid={os.getpid()}-{uuid.uuid4()}.jsonl"
+            )
+        with open(self.wal_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.records.append(record)
+        if (
+            len(self.records) >= self.flush_every
+            or time.time() - self.last_flush >= self.flush_seconds
+        ):
+            self._flush()
+
+    def _flush(self):
+        self.last_flush = time.time()
+        if not self.records:
+            return
+
+        log.info(f"\twriting {len(self.records)} records to {self.root}...")
+        file_paths = _write_records(self.root, self.records)
+        log.info(f"\tdone writing records to {file_paths}")
+
+        # NOTE: a crash between writing the Parquet files and removing the WAL
+        # duplicates records on recovery, which `compact` removes
+        os.remove(self.wal_path)
+        self.records = []
+        self.wal_path = None
+
+
+def recover_wal(root: str) -> int:
+    """
+    write records from write-ahead logs of dead processes to the results log
+    """
+    wal_dir = os.path.join(root, "_wal")
+    if not os.path.exists(wal_dir):
+        return 0
+
+    n_records = 0
+    for file_name in sorted(os.listdir(wal_dir)):
+        pid = int(file_name.split("-")[0].removeprefix("pid="))
+        if psutil.pid_exists(pid):
+            continue
+
+        wal_path = os.path.join(wal_dir, file_name)
+        with open(wal_path) as f:
+            # a crash can leave a partially written last line
+            records = []
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    log.info(f"\tskipping partial record in {wal_path}")
+
+        if records:
+            log.info(f"\trecovering {len(records)} records from {wal_path}...")
+            _write_records(root, records)
+            n_records += len(records)
+        os.remove(wal_path)
+
+    return n_records
+
+
+def compact(root: str) -> int:
+    """
+    recover write-ahead logs and merge each partition's files into one file,
+    dropping duplicate records
+    """
+    recover_wal(root)
+
+    n_compacted = 0
+    for dir_name, _, file_names in os.walk(root):
+        file_paths = sorted(
+            os.path.join(dir_name, file_name)
+            for file_name in file_names
+            if file_name.startswith("part-") and file_name.endswith(".parquet")
+        )
+        if len(file_paths) < 2:
+            continue
+
+        log.info(f"\tcompacting {len(file_paths)} files in {dir_name}...")
+        table = pa.concat_tables(
+            [pq.read_table(file_path, partitioning=None) for file_path in file_paths],
+            promote_options="permissive",
+        )
+        table = _records_to_pyarrow(_dedupe(table.to_pylist()))
+        write_parquet_atomic(table, dir_name)
+        for file_path in file_paths:
+            os.remove(file_path)
+        n_compacted += len(file_paths)
+
+    return n_compacted
+
+
+def ingest_raw_json(raw_json_dir: str, root: str, instance_type: str = None) -> int:
+    """
+    incrementally compact raw JSON records into Parquet partitioned by date
+
+    the names of ingested files are tracked in a watermark file, so each run only
+    reads new files; records already in `root` (by natural key, in the partitions
+    of the new records' dates) are skipped.
+    `instance_type` only fills in records without one
+
+    on the first run, records already combined into `root` by non-incremental
+    combining (file_id=*.parquet files, each with every record up to then) are
+    skipped too
+    """
+    watermark_path = os.path.join(root, "_ingested.json")
+    ingested = set()
+    first_run = not os.path.exists(watermark_path)
+    if not first_run:
+        with open(watermark_path) as f:
+            ingested = set(json.load(f))
+
+    file_names = sorted(
+        file_name
+        for file_name in os.listdir(raw_json_dir)
+        if file_name.endswith(".json") and file_name not in ingested
+    )
+    if not file_names:
+        log.info(f"\tno new JSON files in {raw_json_dir}")
+        return 0
+
+    log.info(f"\tingesting {len(file_names)} new JSON files from {raw_json_dir}...")
+    con = ibis.connect("duckdb://")
+    t = con.read_json(
+        [os.path.join(raw_json_dir, file_name) for file_name in file_names],
+        union_by_name=True,
+    )
+    t = t.mutate(instance_type=t["instance_type"].cast("string"))
+    if instance_type is not None:
+        t = t.mutate(
+            instance_type=t["instance_type"]
+            .nullif("unknown")
+            .fill_null(ibis.literal(instance_type))
+        )
+    t = t.distinct(on=NATURAL_KEY, keep="first")
+    t = t.mutate(date=t["timestamp"].cast("string").substr(0, 10))
+
+    # NOTE: records are partitioned by date, so only the partitions of the new
+    # records' dates can have duplicates of them
+    dates = t.select("date").distinct().to_pyarrow()["date"].to_pylist()
+    existing_paths = [
+        os.path.join(dir_name, file_name)
+        for date in dates
+        for dir_name, _, dir_file_names in os.walk(os.path.join(root, f"date={date}"))
+        for file_name in dir_file_names
+        if file_name.endswith(".parquet")
+    ]
+    # NOTE: files combined before the watermark existed aren't partitioned, and
+    # every later run's files are newer than them
+    if first_run and os.path.exists(root):
+        existing_paths += sorted(
+            os.path.join(root, file_name)
+            for file_name in os.listdir(root)
+            if file_name.startswith("file_id=") and file_name.endswith(".parquet")
+        )
+    if existing_paths:
+        existing = con.read_parquet(
+            existing_paths, union_by_name=True, hive_partitioning=False
+        )
+        existing = existing.select(
+            *[existing[key].cast(t[key].type()) for key in NATURAL_KEY]
+        )
+        t = t.anti_join(existing, NATURAL_KEY)
+
+    table = t.to_pyarrow()
+
+    n_records = 0
+    for date in sorted(set(table["date"].to_pylist())):
+        partition = table.filter(pc.equal(table["date"], date)).drop_columns(["date"])
+        file_path = write_parquet_atomic(partition, os.path.join(root, f"date={date}"))
+        log.info(f"\twrote {partition.num_rows} records to {file_path}")
+        n_records += partition.num_rows
+
+    # NOTE: written last, so a crash before this re-reads the files next time and
+    # the records already written are skipped
+    tmp_path = os.path.join(root, "._ingested.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(sorted(ingested | set(file_names)), f)
+    os.replace(tmp_path, watermark_path)
+
+    return n_records
+
+
+_results_log = None
+_results_log_lock = threading.Lock()
+
+
+def get_results_log(root: str) -> ResultsLog:
+    global _results_log
+
+    with _results_log_lock:
+        if _results_log is None:
+            _results_log = ResultsLog(root)
+            # NOTE: a fallback, commands should flush explicitly since pyarrow
+            # can fail to lazily import modules during interpreter shutdown
+            atexit.register(_results_log.flush)
+
+    return _results_log
@@ -0,0 +1,375 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import itertools
+import threading
+import http.client
+
+from urllib.parse import urlsplit
+from botocore.auth import S3SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import Credentials
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# bytes read from the server and written to a client at a time, so the
+# bandwidth limit is smooth
+CHUNK_SIZE = 256 * 1024
+
+# cached objects are read in aligned blocks of this size
+BLOCK_SIZE = 4 * 1024**2
+
+# headers of an object sent with responses served from cached blocks
+OBJECT_HEADERS = {"content-type", "etag", "last-modified"}
+
+# headers of a single connection, not forwarded
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+}
+
+
+class Throttle:
+    """
+    bandwidth limit shared by all of a proxy's connections, in Mbit/s (0 for none)
+    """
+
+    def __init__(self, bandwidth_mbps: float = 0):
+        self.bytes_per_second = bandwidth_mbps * 1000**2 / 8
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self, n_bytes: int):
+        if not self.bytes_per_second:
+            return
+        with self.lock:
+            start = max(time.time(), self.next_time)
+            self.next_time = start + n_bytes / self.bytes_per_second
+            end = self.next_time
+        time.sleep(max(end - time.time(), 0))
+
+
+def parse_range(header: str, size: int) -> tuple:
+    """
+    first and last byte (inclusive) of an object of `size` bytes requested by a
+    Range header (the whole object without one), or None for ranges that aren't
+    served from cached blocks (several ranges, unsatisfiable ones)
+    """
+    if header is None:
+        first, last = 0, size - 1
+    else:
+        unit, _, spec = header.partition("=")
+        start, _, end = spec.strip().partition("-")
+        if unit.strip() != "bytes" or "," in spec:
+            return None
+        try:
+            if start == "":
+                first, last = max(size - int(end), 0), size - 1
+            else:
+                first = int(start)
+                last = min(int(end), size - 1) if end else size - 1
+        except ValueError:
+            return None
+    if first > last:
+        return None
+    return first, last
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    """
+    forwards requests to an S3-compatible server, adding latency to each
+    request, limiting bandwidth and caching object reads in a local directory
+
+    the Host header is forwarded unchanged, so signed requests stay valid;
+    cached objects are read in aligned blocks, keyed by the object and the
+    block's index, so reads of overlapping ranges share blocks, and blocks are
+    fetched with requests signed by the proxy (with the credentials from the
+    environment), since a client's signature covers its own Range header
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    # set by `serve`
+    upstream = None
+    latency_ms = 0
+    throttle = None
+    block_cache = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        upstream = urlsplit(self.upstream)
+        connection = (
+            http.client.HTTPSConnection
+            if upstream.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self.connection_upstream = connection(upstream.netloc)
+
+    def do_GET(self):
+        self._forward()
+
+    def do_HEAD(self):
+        self._forward()
+
+    def do_PUT(self):
+        self._forward()
+
+    def do_POST(self):
+        self._forward()
+
+    def do_DELETE(self):
+        self._forward()
+
+    def _get_object_dir(self) -> str:
+        # NOTE: only object reads are cached, objects are assumed to be
+        # immutable (data is uploaded once), listings have a query string
+        if self.block_cache is None or self.command != "GET" or "?" in self.path:
+            return None
+        key = f"{self.upstream}{self.path}"
+        return os.path.join(self.block_cache, hashlib.sha256(key.encode()).hexdigest())
+
+    def _sign(self, method: str, headers: dict) -> dict:
+        # NOTE: unsigned without credentials, like the engines' requests
+        if not os.environ.get("AWS_ACCESS_KEY_ID"):
+            return headers
+        request = AWSRequest(
+            method=method, url=f"{self.upstream}{self.path}", headers=headers
+        )
+        S3SigV4Auth(
+            Credentials(
+                os.environ["AWS_ACCESS_KEY_ID"],
+                os.environ.get("AWS_SECRET_ACCESS_KEY"),
+                os.environ.get("AWS_SESSION_TOKEN"),
+            ),
+            "s3",
+            os.environ.get("AWS_REGION")
+            or os.environ.get("AWS_DEFAULT_REGION")
+            or "us-east-1",
+        ).add_auth(request)
+        return dict(request.headers.items())
+
+    def _request_upstream(self, method: str, body: bytes, headers: dict):
+        # each request to the server pays the latency once, retried or not
+        time.sleep(self.latency_ms / 1000)
+        try:
+            self.connection_upstream.request(method, self.path, body, headers)
+            return self.connection_upstream.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionError):
+            # NOTE: the server can close an idle kept-alive connection
+            self.connection_upstream.close()
+            self.connection_upstream.request(method, self.path, body, headers)
+            return self.connection_upstream.getresponse()
+
+    def _forward(self):
+        try:
+            object_dir = self._get_object_dir()
+            if object_dir is None or not self._forward_blocks(object_dir):
+                self._forward_request()
+        except (BrokenPipeError, ConnectionResetError):
+            # NOTE: clients can stop reading a response early (e.g. a cancelled
+            # read), the connections are closed then
+            self.connection_upstream.close()
+            self.close_connection = True
+
+    def _forward_request(self):
+        body = None
+        if "Content-Length" in self.headers:
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+        headers = {
+            key: value
+            for key, value in self.headers.items()
+            if key.lower() not in HOP_BY_HOP_HEADERS
+        }
+
+        response = self._request_upstream(self.command, body, headers)
+        headers = [
+            (key, value)
+            for key, value in response.getheaders()
+            if key.lower() not in HOP_BY_HOP_HEADERS
+        ]
+        self.send_response(response.status)
+        for key, value in headers:
+            self.send_header(key, value)
+        # NOTE: a body without a length (chunked) ends with the connection
+        if response.getheader("Content-Length") is None and self.command != "HEAD":
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+
+        if self.command == "HEAD":
+            return
+        while chunk := response.read(CHUNK_SIZE):
+            self.throttle.wait(len(chunk))
+            self.wfile.write(chunk)
+
+    def _get_object_info(self, object_dir: str) -> dict:
+        """
+        size and headers of the object, fetched once (None if it can't be read)
+        """
+        info_path = os.path.join(object_dir, "info.json")
+        if os.path.exists(info_path):
+            with open(info_path) as f:
+                return json.load(f)
+
+        response = self._request_upstream("HEAD", None, self._sign("HEAD", {}))
+        response.read()
+        if response.status != 200:
+            return None
+        info = {
+            "size": int(response.getheader("Content-Length")),
+            "headers": [
+                (key, value)
+                for key, value in response.getheaders()
+                if key.lower() in OBJECT_HEADERS
+            ],
+        }
+        _write_file(info_path, json.dumps(info).encode())
+        return info
+
+    def _forward_blocks(self, object_dir: str) -> bool:
+        """
+        serve a GET of an object from its cached blocks, fetching missing ones
+
+        returns False if the request should be forwarded as is instead (e.g.
+        the object doesn't exist, or several ranges are requested)
+        """
+        info = self._get_object_info(object_dir)
+        if info is None:
+            return False
+        size = info["size"]
+        byte_range = parse_range(self.headers.get("Range"), size)
+        if byte_range is None:
+            return False
+        first, last = byte_range
+
+        if "Range" in self.headers:
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {first}-{last}/{size}")
+        else:
+            self.send_response(200)
+        for key, value in info["headers"]:
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(last - first + 1))
+        self.end_headers()
+
+        # consecutive missing blocks are fetched with a single request
+        blocks = range(first // BLOCK_SIZE, last // BLOCK_SIZE + 1)
+        for cached, run in itertools.groupby(
+            blocks, lambda block: os.path.exists(_get_block_path(object_dir, block))
+        ):
+            run = list(run)
+            if not cached:
+                self._fetch_blocks(object_dir, run, size, first, last)
+                continue
+            # cached blocks are read from local disk, without latency or throttling
+            for block in run:
+                with open(_get_block_path(object_dir, block), "rb") as f:
+                    self._write_range(f.read(), block * BLOCK_SIZE, first, last)
+        return True
+
+    def _fetch_blocks(
+        self, object_dir: str, blocks: list, size: int, first: int, last: int
+    ):
+        """
+        fetch consecutive blocks into the cache, streaming the requested range
+        of them to the client as they're read
+        """
+        start = blocks[0] * BLOCK_SIZE
+        end = min((blocks[-1] + 1) * BLOCK_SIZE, size) - 1
+        response = self._request_upstream(
+            "GET", None, self._sign("GET", {"Range": f"bytes={start}-{end}"})
+        )
+        if response.status != 206:
+            # NOTE: the response's headers are sent, the client sees a short body
+            raise ConnectionResetError(
+                f"fetching blocks of {self.path} failed: {response.status}"
+            )
+
+        offset = start
+        for block in blocks:
+            block_end = min((block + 1) * BLOCK_SIZE, size)
+            block_path = _get_block_path(object_dir, block)
+            # written to a temporary file and renamed, so a block is complete
+            tmp_path = f"{block_path}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    while offset < block_end:
+                        chunk = response.read(min(CHUNK_SIZE, block_end - offset))
+                        if not chunk:
+                            raise ConnectionResetError(
+                                f"fetching blocks of {self.path} ended early"
+                            )
+                        self.throttle.wait(len(chunk))
+                        f.write(chunk)
+                        self._write_range(chunk, offset, first, last)
+                        offset += len(chunk)
+                os.replace(tmp_path, block_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def _write_range(self, data: bytes, offset: int, first: int, last: int):
+        # the part of the data at `offset` in the object within [first, last]
+        start = max(first - offset, 0)
+        end = min(last + 1 - offset, len(data))
+        if start < end:
+            self.wfile.write(data[start:end])
+
+
+def _get_block_path(object_dir: str, block: int) -> str:
+    return os.path.join(object_dir, f"{block:08d}")
+
+
+def _write_file(file_path: str, data: bytes):
+    # written to a temporary file and renamed, so a file is complete
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, file_path)
+
+
+def _exit_with_parent(parent_pid: int):
+    # the proxy belongs to the process that started it
+    while os.getppid() == parent_pid:
+        time.sleep(1)
+    os._exit(0)
+
+
+def serve(upstream: str, storage_options: dict):
+    """
+    run a proxy in front of an S3-compatible server on a free local port,
+    printing the port
+    """
+    handler = type(
+        "Handler",
+        (ProxyHandler,),
+        {
+            "upstream": upstream,
+            "latency_ms": storage_options["latency_ms"],
+            "throttle": Throttle(storage_options["bandwidth_mbps"]),
+            "block_cache": storage_options["block_cache"],
+        },
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+
+    threading.Thread(
+        target=_exit_with_parent, args=(os.getppid(),), daemon=True
+    ).start()
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1], json.loads(sys.argv[2]))
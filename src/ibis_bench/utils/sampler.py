@@ -0,0 +1,136 @@
+import time
+import array
+import psutil
+import threading
+import pyarrow as pa
+
+from ibis_bench.utils.counters import get_process_tree
+from ibis_bench.utils.scheduler import get_cpus
+
+DEFAULT_SAMPLE_INTERVAL_MS = 100
+
+
+def _get_cpu_seconds(process: psutil.Process) -> float:
+    times = process.cpu_times()
+    # NOTE: children's times only include children that have been waited for
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class ResourceSampler:
+    """
+    background thread sampling resource usage of the current process tree,
+    except the proxies serving its reads from object storage
+
+    each sample records process tree RSS, CPU utilization (from the CPU time of
+    the process tree, so concurrent runs aren't counted) and Arrow's allocated
+    bytes into a columnar buffer
+
+    with `detailed`, USS is sampled too, which reads /proc/<pid>/smaps and is
+    much more expensive
+    """
+
+    def __init__(
+        self, interval_ms: int = DEFAULT_SAMPLE_INTERVAL_MS, detailed: bool = False
+    ):
+        self.interval = interval_ms / 1000
+        self.detailed = detailed
+        self.process = psutil.Process()
+        self.n_cpus = len(get_cpus())
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.elapsed_seconds = array.array("d")
+        self.rss_bytes = array.array("q")
+        self.uss_bytes = array.array("q")
+        self.arrow_bytes = array.array("q")
+        self.cpu_seconds = array.array("d")
+
+    def _sample(self):
+        rss, uss, cpu_seconds = 0, 0, 0.0
+        for process in get_process_tree(self.process):
+            try:
+                if self.detailed:
+                    memory = process.memory_full_info()
+                else:
+                    memory = process.memory_info()
+                cpu_seconds += _get_cpu_seconds(process)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            rss += memory.rss
+            if self.detailed:
+                uss += memory.uss
+
+        self.elapsed_seconds.append(time.time() - self._start_time)
+        self.rss_bytes.append(rss)
+        self.uss_bytes.append(uss)
+        self.arrow_bytes.append(pa.total_allocated_bytes())
+        self.cpu_seconds.append(cpu_seconds)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._start_time = time.time()
+        self._sample()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+        self._sample()
+
+    def _get_cpu_percent(self) -> list[float]:
+        # CPU utilization of the process tree between samples, as a percentage
+        # of the available CPUs (so 100 means all of them were busy)
+        return [
+            100
+            * (self.cpu_seconds[i] - self.cpu_seconds[i - 1])
+            / (self.elapsed_seconds[i] - self.elapsed_seconds[i - 1])
+            / self.n_cpus
+            if self.elapsed_seconds[i] > self.elapsed_seconds[i - 1]
+            else 0.0
+            for i in range(1, len(self.cpu_seconds))
+        ]
+
+    def to_pyarrow(self) -> pa.Table:
+        return pa.table(
+            {
+                "elapsed_seconds": pa.array(self.elapsed_seconds, type=pa.float64()),
+                "rss_bytes": pa.array(self.rss_bytes, type=pa.int64()),
+                "uss_bytes": pa.array(
+                    self.uss_bytes if self.detailed else [None] * len(self.uss_bytes),
+                    type=pa.int64(),
+                ),
+                "arrow_bytes": pa.array(self.arrow_bytes, type=pa.int64()),
+                # the first sample has no previous sample to compare to
+                "cpu_percent": pa.array(
+                    [None, *self._get_cpu_percent()], type=pa.float64()
+                ),
+            }
+        )
+
+    def get_summary(self) -> dict:
+        n_samples = len(self.elapsed_seconds)
+        elapsed_seconds = self.elapsed_seconds[-1] - self.elapsed_seconds[0]
+        summary = {
+            "n_samples": n_samples,
+            "peak_rss_bytes": max(self.rss_bytes),
+            "mean_rss_bytes": sum(self.rss_bytes) / n_samples,
+            "peak_uss_bytes": None,
+            "mean_uss_bytes": None,
+            "peak_arrow_bytes": max(self.arrow_bytes),
+            "mean_cpu_percent": 100
+            * (self.cpu_seconds[-1] - self.cpu_seconds[0])
+            / elapsed_seconds
+            / self.n_cpus
+            if elapsed_seconds
+            else None,
+            "peak_cpu_percent": max(self._get_cpu_percent(), default=None),
+        }
+        if self.detailed:
+            summary["peak_uss_bytes"] = max(self.uss_bytes)
+            summary["mean_uss_bytes"] = sum(self.uss_bytes) / n_samples
+        return summary
@@ -0,0 +1,141 @@
+import os
+import psutil
+import threading
+
+from ibis_bench.utils.logging import log
+
+CPUS_ENV_VAR = "IBIS_BENCH_CPUS"
+THREADS_ENV_VAR = "IBIS_BENCH_THREADS"
+
+# rough peak memory estimate for a single run at scale factor 1
+DEFAULT_GB_PER_SF = 1.0
+
+
+def get_cpus() -> list[int]:
+    # NOTE: CPU affinity isn't available on macOS
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def get_cpu_sets(n_slots: int, cpus: list[int] = None) -> list[list[int]]:
+    """
+    split the available CPUs into `n_slots` disjoint, contiguous CPU sets
+    """
+    cpus = cpus or get_cpus()
+    n_slots = min(n_slots, len(cpus))
+
+    size, remainder = divmod(len(cpus), n_slots)
+    cpu_sets = []
+    start = 0
+    for i in range(n_slots):
+        end = start + size + (1 if i < remainder else 0)
+        cpu_sets.append(cpus[start:end])
+        start = end
+
+    return cpu_sets
+
+
+def get_limit_env(cpus: list[int]) -> dict:
+    """
+    environment variables limiting a child process to `cpus`
+    """
+    return {
+        CPUS_ENV_VAR: ",".join(map(str, cpus)),
+        THREADS_ENV_VAR: str(len(cpus)),
+        "POLARS_MAX_THREADS": str(len(cpus)),
+    }
+
+
+def get_thread_limit() -> int:
+    threads = os.environ.get(THREADS_ENV_VAR)
+    return int(threads) if threads else None
+
+
+def apply_cpu_limits():
+    """
+    pin the current process to the CPU set from the environment, if any
+    """
+    cpus = os.environ.get(CPUS_ENV_VAR)
+    if not cpus:
+        return
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {int(cpu) for cpu in cpus.split(",")})
+        log.info(f"pinned process {os.getpid()} to CPUs {cpus}")
+    else:
+        log.info(f"CPU affinity not supported, only limiting threads to {cpus}")
+
+
+def estimate_memory_bytes(cell: dict, gb_per_sf: float = DEFAULT_GB_PER_SF) -> int:
+    estimate = cell["sf"] * gb_per_sf * 1024**3
+
+    # Polars eager reads all tables into memory up front
+    if cell["system"] == "polars-eager":
+        estimate *= 2
+
+    return int(estimate)
+
+
+def run_scheduled(
+    cells: list[dict],
+    run_cell,
+    cpu_sets: list[list[int]],
+    gb_per_sf: float = DEFAULT_GB_PER_SF,
+    memory_budget: int = None,
+):
+    """
+    run cells concurrently, one per CPU set, via `run_cell(cell, slot, cpus)`
+
+    cells are started in order, skipping ahead to the first cell that fits if
+    the next one would push the combined memory estimate of running cells over
+    the memory budget (total RAM by default). a cell whose estimate alone
+    exceeds the budget only runs when nothing else is running
+    """
+    memory_budget = memory_budget or psutil.virtual_memory().total
+    pending = list(cells)
+    running = {"memory": 0, "cells": 0}
+    cond = threading.Condition()
+
+    def _next_cell():
+        with cond:
+            while pending:
+                for i, cell in enumerate(pending):
+                    estimate = estimate_memory_bytes(cell, gb_per_sf=gb_per_sf)
+                    if (
+                        running["cells"] == 0
+                        or running["memory"] + estimate <= memory_budget
+                    ):
+                        running["memory"] += estimate
+                        running["cells"] += 1
+                        return pending.pop(i), estimate
+                cond.wait()
+            return None, 0
+
+    def _slot_loop(slot: int, cpus: list[int]):
+        while True:
+            cell, estimate = _next_cell()
+            if cell is None:
+                break
+
+            try:
+                run_cell(cell, slot, cpus)
+            finally:
+                with cond:
+                    running["memory"] -= estimate
+                    running["cells"] -= 1
+                    cond.notify_all()
+
+    if len(cpu_sets) == 1:
+        _slot_loop(0, cpu_sets[0])
+        return
+
+    log.info(f"scheduling {len(cells)} cells on CPU sets {cpu_sets}")
+    threads = [
+        threading.Thread(target=_slot_loop, args=(slot, cpus))
+        for slot, cpus in enumerate(cpu_sets)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
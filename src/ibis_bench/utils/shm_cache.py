@@ -0,0 +1,189 @@
+import os
+import fcntl
+import shutil
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from contextlib import contextmanager
+
+from ibis_bench.utils.ipc import IPC_EXTENSION
+from ibis_bench.utils.logging import log
+from ibis_bench.utils.manifest import read_manifest
+from ibis_bench.utils.storage import get_dataset, is_url
+
+# shared memory (tmpfs) directory of decoded tables, shared by all processes
+DEFAULT_SHM_DIR = "/dev/shm/ibis-bench"
+# fraction of the tmpfs the cache uses by default
+DEFAULT_SHM_BUDGET_FRACTION = 0.5
+
+# file types tables can be decoded from, without inferring types
+CACHE_FILE_TYPES = ["parquet", "ipc"]
+
+# descriptors of the table directories this process reads, see _pin
+_pins = {}
+
+
+def get_shm_budget(shm_dir: str = DEFAULT_SHM_DIR, budget_gb: float = None) -> int:
+    """
+    bytes the cache may use, by default a fraction of its tmpfs
+    """
+    if budget_gb:
+        return int(budget_gb * 1024**3)
+    return int(shutil.disk_usage(shm_dir).total * DEFAULT_SHM_BUDGET_FRACTION)
+
+
+@contextmanager
+def _lock(shm_dir: str):
+    # NOTE: an exclusive lock across processes, so a table is decoded once and
+    # files aren't evicted while another process is adding its own
+    os.makedirs(shm_dir, exist_ok=True)
+    with open(os.path.join(shm_dir, ".lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _pin(table_directory: str):
+    """
+    pin a cached table for this process, so other processes don't evict it
+
+    the pin is a shared lock on the table directory, held until the process
+    exits or unpins it, since readers (DuckDB views, Polars scans) open the
+    table's file lazily, when queries run
+    """
+    if table_directory in _pins:
+        return
+    # NOTE: the directory itself is locked, since engines reading it (e.g.
+    # DataFusion's external tables) read any other file in it as data
+    fd = os.open(table_directory, os.O_RDONLY)
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    _pins[table_directory] = fd
+
+
+def unpin_tables():
+    """
+    release this process's pins, once it no longer reads the cached tables
+    """
+    for fd in _pins.values():
+        os.close(fd)
+    _pins.clear()
+
+
+def _is_pinned(table_directory: str) -> bool:
+    # NOTE: an exclusive lock conflicts with any shared lock, including this
+    # process's own pins (flock locks are per open file)
+    fd = os.open(table_directory, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+def _get_cached_files(shm_dir: str) -> list[tuple]:
+    """
+    (last used time, bytes, path) of the cached files, least recently used first
+    """
+    cached_files = []
+    for dir_name, _, file_names in os.walk(shm_dir):
+        for file_name in file_names:
+            if file_name.endswith(IPC_EXTENSION) and not file_name.startswith("."):
+                file_path = os.path.join(dir_name, file_name)
+                stat = os.stat(file_path)
+                cached_files.append((stat.st_mtime, stat.st_size, file_path))
+    return sorted(cached_files)
+
+
+def _evict(shm_dir: str, n_bytes: int, budget: int, keep: str = None):
+    """
+    remove the least recently used files until `n_bytes` more fit in the budget,
+    skipping tables pinned by a process reading them
+    """
+    cached_files = _get_cached_files(shm_dir)
+    total_bytes = sum(size for _, size, _ in cached_files)
+    for _, size, file_path in cached_files:
+        if total_bytes + n_bytes <= budget:
+            break
+        table_directory = os.path.dirname(file_path)
+        # NOTE: pins are only taken with the cache locked, so a table that
+        # isn't pinned here can't be pinned before it's removed
+        if file_path == keep or _is_pinned(table_directory):
+            continue
+        os.remove(file_path)
+        total_bytes -= size
+        log.info(f"\tevicted {file_path} from the shared memory cache")
+
+        if not os.listdir(table_directory):
+            os.rmdir(table_directory)
+        if not os.listdir(os.path.dirname(table_directory)):
+            os.rmdir(os.path.dirname(table_directory))
+
+    if total_bytes + n_bytes > budget:
+        log.info(
+            f"\tshared memory cache over budget by {(total_bytes + n_bytes - budget) / 1024**2:,.0f} MB, its other tables are in use"
+        )
+
+
+def get_cached_table(
+    data_directory: str,
+    table_name: str,
+    shm_dir: str = DEFAULT_SHM_DIR,
+    budget_gb: float = None,
+    storage_options: dict = None,
+) -> str:
+    """
+    decode a dataset's table into an uncompressed Arrow IPC file in shared memory,
+    once across processes, so readers can memory-map it without decoding
+
+    tables are keyed by the dataset's manifest checksum, and the least recently
+    used tables not pinned by a process reading them are evicted to stay within
+    the budget, `data_directory` can be a URL (read with the `storage_options`)
+
+    the table is pinned for this process until it exits or calls unpin_tables
+
+    returns the directory of the cached table's file
+    """
+    manifest = read_manifest(data_directory)
+    if manifest is None:
+        raise ValueError(f"no manifest for {data_directory}, can't cache its tables")
+    if manifest["file_type"] not in CACHE_FILE_TYPES:
+        raise ValueError(
+            f"can't cache {manifest['file_type']} tables (one of {CACHE_FILE_TYPES})"
+        )
+
+    table_directory = os.path.join(shm_dir, manifest["checksum"][:16], table_name)
+    file_path = os.path.join(table_directory, f"0000{IPC_EXTENSION}")
+    with _lock(shm_dir):
+        if os.path.exists(file_path):
+            # the file's modification time is when it was last used
+            os.utime(file_path)
+            _pin(table_directory)
+            return table_directory
+
+        budget = get_shm_budget(shm_dir, budget_gb)
+        _evict(shm_dir, manifest["tables"][table_name]["uncompressed_bytes"], budget)
+
+        log.info(f"\tcaching {table_name} in {file_path}...")
+        os.makedirs(table_directory, exist_ok=True)
+        tmp_path = os.path.join(table_directory, f".0000{IPC_EXTENSION}.tmp")
+        # NOTE: hive partition columns aren't read, like the other readers
+        source_directory = os.path.join(data_directory, table_name)
+        if is_url(source_directory):
+            dataset = get_dataset(
+                source_directory, manifest["file_type"], storage_options
+            )
+        else:
+            dataset = ds.dataset(source_directory, format=manifest["file_type"])
+        with pa.ipc.new_file(tmp_path, dataset.schema) as writer:
+            for batch in dataset.to_batches():
+                writer.write_batch(batch)
+        os.replace(tmp_path, file_path)
+        _pin(table_directory)
+
+        _evict(shm_dir, 0, budget, keep=file_path)
+
+    return table_directory
@@ -0,0 +1,356 @@
+import os
+import sys
+import json
+import atexit
+import fsspec
+import posixpath
+import subprocess
+import polars as pl
+import pyarrow.fs as fs
+import pyarrow.dataset as ds
+
+from urllib.parse import urlsplit
+
+from ibis_bench.utils.logging import log
+
+# data root of the local data directories (tpch_data, tpcds_data)
+DEFAULT_DATA_ROOT = "."
+
+# file types read from URLs, CSV readers differ too much between engines
+REMOTE_FILE_TYPES = ["parquet", "ipc"]
+
+# URL schemes the engines read with their own object store clients
+REMOTE_SCHEMES = ["s3"]
+
+
+def is_url(path: str) -> bool:
+    """
+    whether a path is a URL (e.g. s3://), read from object storage rather than
+    by the engines from local disk
+    """
+    return "://" in path
+
+
+def check_remote(url: str, file_type: str = "parquet"):
+    """
+    raise if files of the type can't be read from the URL
+    """
+    scheme = urlsplit(url).scheme
+    if scheme not in REMOTE_SCHEMES:
+        raise ValueError(
+            f"can't read data from {scheme}:// URLs (one of {REMOTE_SCHEMES})"
+        )
+    if file_type not in REMOTE_FILE_TYPES:
+        raise ValueError(
+            f"can't read {file_type} files from URLs (one of {REMOTE_FILE_TYPES})"
+        )
+
+
+def get_storage_options(
+    latency_ms: float = 0, bandwidth_mbps: float = 0, block_cache: str = None
+) -> dict:
+    """
+    options for reading URLs: latency added to each request and a bandwidth
+    limit (0 for none), to simulate object storage with a local server, and a
+    local directory caching fetched blocks
+    """
+    if latency_ms < 0 or bandwidth_mbps < 0:
+        raise ValueError("latency and bandwidth can't be negative")
+
+    return {
+        "latency_ms": latency_ms,
+        "bandwidth_mbps": bandwidth_mbps,
+        "block_cache": block_cache,
+    }
+
+
+_proxies = {}
+# process ids of the proxies, which serve the runs' reads but aren't part of them
+_proxy_pids = set()
+
+
+def start_proxy(upstream: str, storage_options: dict) -> str:
+    """
+    endpoint of a proxy applying the storage options in front of an
+    S3-compatible server, started once per process (see s3_proxy)
+    """
+    key = (upstream, json.dumps(storage_options, sort_keys=True))
+    if key not in _proxies:
+        # NOTE: a subprocess rather than a thread, so the engines' reads aren't
+        # slowed down by the GIL, and rather than multiprocessing since pool
+        # workers can't have children
+        process = subprocess.Popen(
+            [sys.executable, "-m", "ibis_bench.utils.s3_proxy", *key],
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        port = process.stdout.readline().strip()
+        if not port:
+            raise RuntimeError(f"failed to start a proxy in front of {upstream}")
+        atexit.register(process.kill)
+        _proxy_pids.add(process.pid)
+        _proxies[key] = f"http://127.0.0.1:{port}"
+        log.info(f"\tproxying {upstream} at {_proxies[key]} with {storage_options}")
+
+    return _proxies[key]
+
+
+def get_proxy_pids() -> set:
+    """
+    process ids of the proxies started by this process
+    """
+    return set(_proxy_pids)
+
+
+def get_s3_options(storage_options: dict = None) -> dict:
+    """
+    endpoint, region and credentials of S3, from the environment (e.g.
+    AWS_ENDPOINT_URL for a local S3-compatible server)
+
+    with latency, a bandwidth limit or a block cache, the endpoint is a proxy in
+    front of the local server applying them, so every engine pays the same cost
+    """
+    storage_options = storage_options or get_storage_options()
+    endpoint = os.environ.get("AWS_ENDPOINT_URL")
+    if any(storage_options.values()):
+        if endpoint is None:
+            raise ValueError(
+                "storage options need a local S3-compatible server (AWS_ENDPOINT_URL)"
+            )
+        endpoint = start_proxy(endpoint, storage_options)
+
+    return {
+        "endpoint": endpoint,
+        "region": os.environ.get("AWS_REGION")
+        or os.environ.get("AWS_DEFAULT_REGION")
+        or "us-east-1",
+        "access_key_id": os.environ.get("AWS_ACCESS_KEY_ID"),
+        "secret_access_key": os.environ.get("AWS_SECRET_ACCESS_KEY"),
+    }
+
+
+def _quote(value: str) -> str:
+    # SQL string literal
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _get_polars_options(s3_options: dict) -> dict:
+    options = {"aws_region": s3_options["region"]}
+    if s3_options["endpoint"] is not None:
+        options["aws_endpoint_url"] = s3_options["endpoint"]
+        options["aws_allow_http"] = str(
+            s3_options["endpoint"].startswith("http://")
+        ).lower()
+    if s3_options["access_key_id"] is not None:
+        options["aws_access_key_id"] = s3_options["access_key_id"]
+        options["aws_secret_access_key"] = s3_options["secret_access_key"]
+    return options
+
+
+def _get_arrow_filesystem(s3_options: dict) -> fs.S3FileSystem:
+    endpoint = s3_options["endpoint"]
+    return fs.S3FileSystem(
+        access_key=s3_options["access_key_id"],
+        secret_key=s3_options["secret_access_key"],
+        region=s3_options["region"],
+        endpoint_override=endpoint.split("://", 1)[-1] if endpoint else None,
+        scheme="http" if endpoint and endpoint.startswith("http://") else "https",
+    )
+
+
+def _register_duckdb_s3(con, s3_options: dict):
+    try:
+        con.raw_sql("LOAD httpfs")
+    except Exception:
+        # NOTE: without httpfs (it's downloaded on first use), DuckDB reads
+        # s3:// URLs through a registered fsspec filesystem instead
+        if con.con.filesystem_is_registered("s3"):
+            return
+        import s3fs
+
+        log.info("\tDuckDB's httpfs extension isn't available, reading through s3fs")
+        con.con.register_filesystem(
+            s3fs.S3FileSystem(
+                key=s3_options["access_key_id"],
+                secret=s3_options["secret_access_key"],
+                endpoint_url=s3_options["endpoint"],
+                client_kwargs={"region_name": s3_options["region"]},
+            )
+        )
+        return
+
+    secret = {"TYPE": "S3", "REGION": _quote(s3_options["region"])}
+    if s3_options["access_key_id"] is not None:
+        secret["KEY_ID"] = _quote(s3_options["access_key_id"])
+        secret["SECRET"] = _quote(s3_options["secret_access_key"])
+    if s3_options["endpoint"] is not None:
+        endpoint = urlsplit(s3_options["endpoint"])
+        secret["ENDPOINT"] = _quote(endpoint.netloc)
+        secret["URL_STYLE"] = _quote("path")
+        secret["USE_SSL"] = str(endpoint.scheme == "https").lower()
+    con.raw_sql(
+        "CREATE OR REPLACE SECRET ibis_bench_s3 ("
+        + ", ".join(f"{key} {value}" for key, value in secret.items())
+        + ")"
+    )
+
+
+def _register_datafusion_s3(con, bucket: str, s3_options: dict):
+    # NOTE: imported here, DataFusion is only needed for its backend
+    from datafusion.object_store import AmazonS3
+
+    endpoint = s3_options["endpoint"]
+    store = AmazonS3(
+        bucket_name=bucket,
+        region=s3_options["region"],
+        access_key_id=s3_options["access_key_id"],
+        secret_access_key=s3_options["secret_access_key"],
+        endpoint=endpoint,
+        allow_http=endpoint is not None and endpoint.startswith("http://"),
+    )
+    con.con.register_object_store("s3://", store, bucket)
+
+
+def get_filesystem(url: str) -> tuple:
+    """
+    fsspec filesystem and path of a URL, for listing, uploading and reading
+    manifests
+
+    object store credentials and endpoints come from the environment, e.g.
+    AWS_ENDPOINT_URL for a local S3-compatible server
+    """
+    return fsspec.core.url_to_fs(url)
+
+
+def get_dataset(
+    table_directory: str,
+    file_type: str,
+    storage_options: dict = None,
+    partition_columns: list = None,
+) -> ds.Dataset:
+    """
+    Arrow dataset of a table's files at a URL, read with Arrow's S3 client
+    """
+    check_remote(table_directory, file_type)
+
+    return ds.dataset(
+        table_directory.split("://", 1)[-1],
+        filesystem=_get_arrow_filesystem(get_s3_options(storage_options)),
+        format=file_type,
+        partitioning="hive" if partition_columns else None,
+    )
+
+
+def read_remote(
+    con,
+    table_directory: str,
+    table_name: str,
+    file_type: str,
+    storage_options: dict = None,
+    partition_columns: list = None,
+):
+    """
+    read a table's files at a URL with an Ibis backend, through the engine's own
+    object store client where it has one
+
+    `partition_columns` are the files' hive partition columns
+    """
+    check_remote(table_directory, file_type)
+    # NOTE: imported here, ipc reads manifests, which import this module
+    from ibis_bench.utils.ipc import read_ipc_options
+
+    if con.name == "polars":
+        return con.create_table(
+            table_name,
+            scan_remote(table_directory, file_type, storage_options, partition_columns),
+        )
+
+    s3_options = get_s3_options(storage_options)
+
+    if con.name == "duckdb" and file_type == "parquet":
+        # NOTE: Ibis would install httpfs for s3:// URLs, so the view is created
+        # directly
+        _register_duckdb_s3(con, s3_options)
+        glob = "**/*.parquet" if partition_columns else "*.parquet"
+        con.raw_sql(
+            f"CREATE OR REPLACE TEMP VIEW {table_name} AS SELECT * FROM read_parquet("
+            f"{_quote(f'{table_directory}/{glob}')}, "
+            f"hive_partitioning={bool(partition_columns)})"
+        )
+        return con.table(table_name)
+
+    if con.name == "datafusion" and (
+        file_type == "parquet"
+        or read_ipc_options(posixpath.dirname(table_directory))["compression"] is None
+    ):
+        _register_datafusion_s3(con, urlsplit(table_directory).netloc, s3_options)
+        # NOTE: external tables can't be replaced, so it's dropped first
+        con.con.deregister_table(table_name)
+        if file_type == "parquet":
+            con.con.register_parquet(
+                table_name,
+                f"{table_directory}/",
+                table_partition_cols=[
+                    (column, "int") for column in partition_columns or []
+                ],
+                file_extension=".parquet",
+            )
+        else:
+            con.raw_sql(
+                f"CREATE EXTERNAL TABLE {table_name} STORED AS ARROW "
+                f"LOCATION {_quote(f'{table_directory}/')}"
+            )
+        return con.table(table_name)
+
+    # NOTE: otherwise (IPC files for DuckDB, which has no IPC reader, and
+    # compressed IPC files for DataFusion, which is built without IPC
+    # compression) the backend scans an Arrow dataset read with Arrow's S3 client
+    dataset = get_dataset(table_directory, file_type, storage_options)
+    if con.name == "datafusion":
+        con.con.deregister_table(table_name)
+        con.con.register_dataset(table_name, dataset)
+    else:
+        con.con.register(table_name, dataset)
+    return con.table(table_name)
+
+
+def scan_remote(
+    table_directory: str,
+    file_type: str,
+    storage_options: dict = None,
+    partition_columns: list = None,
+    lazy: bool = True,
+):
+    """
+    read a table's files at a URL with Polars' own object store client
+    """
+    check_remote(table_directory, file_type)
+    # NOTE: imported here, ipc reads manifests, which import this module
+    from ibis_bench.utils.ipc import IPC_EXTENSION
+
+    options = _get_polars_options(get_s3_options(storage_options))
+    if file_type == "parquet":
+        glob = "**/*.parquet" if partition_columns else "*.parquet"
+        df = pl.scan_parquet(
+            f"{table_directory}/{glob}",
+            hive_partitioning=bool(partition_columns),
+            storage_options=options,
+        )
+    else:
+        # NOTE: Polars 1.5 takes IPC storage options as key-value pairs, and
+        # reads eagerly through fsspec, so it's scanned and collected instead
+        df = pl.scan_ipc(
+            f"{table_directory}/*{IPC_EXTENSION}", storage_options=list(options.items())
+        )
+
+    return df if lazy else df.collect()
+
+
+def upload_data(data_directory: str, url: str):
+    """
+    copy a local data directory (and its manifest) to a URL
+    """
+    fs, path = get_filesystem(url)
+    log.info(f"uploading {data_directory} to {url}...")
+    fs.put(f"{data_directory}/", f"{path}/", recursive=True)
+    log.info(f"done uploading {data_directory} to {url}")
@@ -0,0 +1,78 @@
+import time
+import psutil
+
+from ibis_bench.utils.logging import log
+
+DEFAULT_POLL_INTERVAL = 0.1
+
+
+def _get_tree(process: psutil.Process) -> list[psutil.Process]:
+    try:
+        return [process, *process.children(recursive=True)]
+    except psutil.NoSuchProcess:
+        return []
+
+
+def get_tree_rss(process: psutil.Process) -> int:
+    rss = 0
+    for p in _get_tree(process):
+        try:
+            rss += p.memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return rss
+
+
+def kill_tree(process: psutil.Process):
+    # kill children first, so they aren't re-parented and left running
+    for p in reversed(_get_tree(process)):
+        try:
+            p.kill()
+        except psutil.NoSuchProcess:
+            continue
+    psutil.wait_procs(_get_tree(process), timeout=10)
+
+
+def watch(
+    pid: int,
+    is_done,
+    timeout: float = None,
+    memory_limit: int = None,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+) -> dict:
+    """
+    watch a process tree until `is_done(poll_interval)` returns True
+
+    `is_done` waits up to `poll_interval` seconds. the process tree is killed if
+    it runs longer than `timeout` seconds or its RSS exceeds `memory_limit` bytes
+
+    returns the status ("ok", "timeout" or "oom"), elapsed seconds and peak RSS
+    """
+    process = psutil.Process(pid)
+    start_time = time.time()
+    peak_rss = 0
+    status = "ok"
+
+    while not is_done(poll_interval):
+        elapsed = time.time() - start_time
+        rss = get_tree_rss(process)
+        peak_rss = max(peak_rss, rss)
+
+        if timeout and elapsed > timeout:
+            status = "timeout"
+        elif memory_limit and rss > memory_limit:
+            status = "oom"
+        else:
+            continue
+
+        log.info(
+            f"killing process {pid} ({status} after {elapsed:.1f}s at {rss / 1024**3:.2f} GB)"
+        )
+        kill_tree(process)
+        break
+
+    return {
+        "status": status,
+        "elapsed_seconds": time.time() - start_time,
+        "peak_rss_bytes": peak_rss,
+    }
@@ -1,10 +1,25 @@
 import os
 import ibis
 import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from ibis_bench.utils.logging import log
 
 
+def materialize_results(res):
+    """
+    execute a query result into memory without writing it
+    """
+    if isinstance(res, ibis.Table):
+        return res.to_pyarrow()
+    elif isinstance(res, pl.LazyFrame):
+        return res.collect()
+
+    # Polars eager results are already in memory
+    return res
+
+
 def write_results(
     res,
     sf: int,
@@ -33,6 +48,14 @@ def write_results(
         log.info(
             f"\tdone writing polars (eager) result to {os.path.join(dirname, f'q_{q_number}.parquet')}..."
         )
+    elif isinstance(res, pa.Table):
+        log.info(
+            f"\twriting arrow result to {os.path.join(dirname, f'q_{q_number}.parquet')}..."
+        )
+        pq.write_table(res, os.path.join(dirname, f"q_{q_number}.parquet"))
+        log.info(
+            f"\tdone writing arrow result to {os.path.join(dirname, f'q_{q_number}.parquet')}..."
+        )
     elif isinstance(res, pl.LazyFrame):
         log.info(
             f"\twriting polars (lazy) result to {os.path.join(dirname, f'q_{q_number}.parquet')}..."
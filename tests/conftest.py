@@ -0,0 +1,34 @@
+import uuid
+
+import pytest
+
+from moto.server import ThreadedMotoServer
+
+from ibis_bench.utils.storage import get_filesystem
+
+
+@pytest.fixture(scope="session")
+def s3_endpoint():
+    # a local S3-compatible server, like the one storage options need
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f"http://{host}:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def s3_bucket(s3_endpoint, monkeypatch) -> str:
+    """
+    URL of a new bucket on the local S3-compatible server
+    """
+    monkeypatch.setenv("AWS_ENDPOINT_URL", s3_endpoint)
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.delenv("AWS_REGION", raising=False)
+
+    url = f"s3://ibis-bench-{uuid.uuid4().hex[:8]}"
+    fs, path = get_filesystem(url)
+    fs.mkdir(path)
+    return url
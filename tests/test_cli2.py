@@ -0,0 +1,72 @@
+from ibis_bench.cli2 import RUN_KEY_DEFAULTS, get_done_counts
+from ibis_bench.utils.monitor import get_results_dir
+from ibis_bench.utils.results_log import ResultsLog
+
+
+def _record(query_number: int, second: int, **fields) -> dict:
+    return {
+        "session_id": "session",
+        "instance_type": "test",
+        "system": "ibis-duckdb",
+        "timestamp": f"2024-08-01T00:00:{second:02d}",
+        "sf": 1,
+        "n_partitions": 1,
+        "query_number": query_number,
+        "file_type": "parquet",
+        "floats": False,
+        "execution_seconds": 1.0,
+        **fields,
+    }
+
+
+def _write(records: list[dict]):
+    results_log = ResultsLog(get_results_dir())
+    for record in records:
+        results_log.append(record)
+    results_log.flush()
+
+
+def _key(query_number: int) -> tuple:
+    return (
+        "ibis-duckdb",
+        1,
+        1,
+        query_number,
+        "parquet",
+        False,
+        *RUN_KEY_DEFAULTS.values(),
+    )
+
+
+def test_done_counts_treat_records_without_status_as_ok(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write(
+        [
+            # from before failures were logged
+            _record(1, 0),
+            _record(1, 1, status="ok"),
+            _record(1, 2, status="timeout"),
+            _record(2, 3, status="oom"),
+        ]
+    )
+
+    done = get_done_counts()
+
+    assert done[_key(1)] == {"ok": 2, "failed": 1}
+    assert done[_key(2)] == {"ok": 0, "failed": 1}
+
+
+def test_done_counts_without_status_column(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write([_record(1, 0), _record(1, 1), _record(3, 2)])
+
+    done = get_done_counts()
+
+    assert done[_key(1)] == {"ok": 2, "failed": 0}
+    assert done[_key(3)] == {"ok": 1, "failed": 0}
+
+
+def test_done_counts_without_results(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    assert get_done_counts() == {}
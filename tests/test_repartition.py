@@ -0,0 +1,62 @@
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ibis_bench.utils.layout import get_layout, get_layout_name
+from ibis_bench.utils.manifest import (
+    build_manifest,
+    read_manifest,
+    validate_manifest,
+    write_manifest,
+)
+from ibis_bench.tpch.gen_data import TABLE_NAMES, get_data_dir
+from ibis_bench.tpch.repartition import repartition_data
+
+
+def _write_dataset(layout_options: dict, n_rows: int = 10):
+    layout = get_layout_name(layout_options)
+    data_directory = get_data_dir(1, 1, layout=layout)
+    for table in TABLE_NAMES:
+        os.makedirs(os.path.join(data_directory, table))
+        pq.write_table(
+            pa.table({"id": list(range(n_rows))}),
+            os.path.join(data_directory, table, "0000.parquet"),
+        )
+    write_manifest(
+        data_directory,
+        build_manifest(
+            data_directory,
+            benchmark="tpch",
+            sf=1,
+            n_partitions=1,
+            file_type="parquet",
+            layout=layout,
+            layout_options=layout_options,
+        ),
+    )
+    return layout
+
+
+def test_repartition_keeps_layout_options(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    layout_options = get_layout(row_group_size=2, compression="zstd")
+    layout = _write_dataset(layout_options)
+
+    repartition_data(1, 1, 2, jobs=1, layout=layout)
+    # a repartitioned dataset can itself be repartitioned
+    repartition_data(1, 2, 3, jobs=1, layout=layout)
+
+    for n_partitions in (2, 3):
+        data_directory = get_data_dir(1, n_partitions, layout=layout)
+        manifest = read_manifest(data_directory)
+        assert manifest["layout_options"] == layout_options
+        assert manifest["rows"] == 10 * len(TABLE_NAMES)
+        assert validate_manifest(data_directory, manifest, checksums=True) == []
+
+    file_path = os.path.join(
+        get_data_dir(1, 3, layout=layout), "lineitem", "0000.parquet"
+    )
+    metadata = pq.read_metadata(file_path)
+    assert metadata.num_row_groups == 2
+    assert metadata.row_group(0).column(0).compression == "ZSTD"
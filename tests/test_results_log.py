@@ -0,0 +1,123 @@
+import os
+import json
+import uuid
+import threading
+
+import ibis
+import pyarrow.dataset as ds
+
+from ibis_bench.utils.results_log import ResultsLog, compact, ingest_raw_json
+
+
+def _record(i: int, session_id: str = "session") -> dict:
+    return {
+        "session_id": session_id,
+        "system": "ibis-duckdb",
+        "sf": 1,
+        "n_partitions": 1,
+        "query_number": i,
+        "timestamp": f"2024-08-01T00:00:{i % 60:02d}.{i:06d}",
+        "execution_seconds": 1.0,
+    }
+
+
+def _read_records(root: str) -> list[dict]:
+    dataset = ds.dataset(
+        root, format="parquet", exclude_invalid_files=True, partitioning=None
+    )
+    return dataset.to_table().to_pylist()
+
+
+def test_flush_writes_records_and_removes_wal(tmp_path):
+    results_log = ResultsLog(str(tmp_path), flush_every=10)
+    for i in range(25):
+        results_log.append(_record(i))
+    results_log.flush()
+
+    assert sorted(r["query_number"] for r in _read_records(str(tmp_path))) == list(
+        range(25)
+    )
+    assert os.listdir(results_log.wal_dir) == []
+
+
+def test_concurrent_appends_are_not_dropped(tmp_path):
+    # flushing every few records, so flushes interleave with other threads' appends
+    results_log = ResultsLog(str(tmp_path), flush_every=3)
+    n_threads, n_records = 8, 50
+
+    def append(thread: int):
+        for i in range(n_records):
+            results_log.append(_record(thread * n_records + i, f"session-{thread}"))
+
+    threads = [threading.Thread(target=append, args=(i,)) for i in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results_log.flush()
+
+    records = _read_records(str(tmp_path))
+    assert len(records) == n_threads * n_records
+    assert os.listdir(results_log.wal_dir) == []
+
+
+def test_compact_recovers_wal_of_dead_process(tmp_path):
+    results_log = ResultsLog(str(tmp_path))
+    for i in range(5):
+        results_log.append(_record(i))
+
+    # a process that no longer exists, with a partially written last record
+    wal_path = os.path.join(results_log.wal_dir, "pid=999999999-dead.jsonl")
+    os.rename(results_log.wal_path, wal_path)
+    with open(wal_path, "a") as f:
+        f.write('{"session_id": "sess')
+
+    compact(str(tmp_path))
+
+    assert len(_read_records(str(tmp_path))) == 5
+    assert os.listdir(results_log.wal_dir) == []
+
+
+def _write_raw_json(raw_json_dir, records: list[dict]):
+    os.makedirs(raw_json_dir, exist_ok=True)
+    for record in records:
+        file_path = os.path.join(raw_json_dir, f"file_id={uuid.uuid4()}.json")
+        with open(file_path, "w") as f:
+            json.dump({**record, "instance_type": "test"}, f)
+
+
+def test_ingest_skips_records_combined_before_the_watermark(tmp_path):
+    raw_json_dir = str(tmp_path / "raw_json")
+    cache_dir = str(tmp_path / "cache")
+    records = [_record(i) for i in range(5)]
+
+    # combined non-incrementally, as a whole, before ingesting was incremental
+    _write_raw_json(raw_json_dir, records[:3])
+    os.makedirs(cache_dir)
+    con = ibis.duckdb.connect()
+    con.read_json(f"{raw_json_dir}/*.json").to_parquet(
+        os.path.join(cache_dir, f"file_id={uuid.uuid4()}.parquet")
+    )
+    _write_raw_json(raw_json_dir, records[3:])
+
+    assert ingest_raw_json(raw_json_dir, cache_dir) == 2
+    assert ingest_raw_json(raw_json_dir, cache_dir) == 0
+
+    _write_raw_json(raw_json_dir, [_record(5)])
+    assert ingest_raw_json(raw_json_dir, cache_dir) == 1
+
+
+def test_ingest_dedupes_only_against_new_records_dates(tmp_path):
+    raw_json_dir = str(tmp_path / "raw_json")
+    cache_dir = str(tmp_path / "cache")
+    _write_raw_json(raw_json_dir, [_record(i) for i in range(3)])
+    assert ingest_raw_json(raw_json_dir, cache_dir) == 3
+
+    # a file in another date's partition isn't read
+    os.makedirs(os.path.join(cache_dir, "date=2024-01-01"))
+    with open(os.path.join(cache_dir, "date=2024-01-01", "part-0.parquet"), "w") as f:
+        f.write("not parquet")
+
+    # a new file with a record already ingested (e.g. a copied log)
+    _write_raw_json(raw_json_dir, [_record(1), _record(3)])
+    assert ingest_raw_json(raw_json_dir, cache_dir) == 1
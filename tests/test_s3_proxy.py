@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from ibis_bench.utils.counters import get_process_tree
+from ibis_bench.utils.s3_proxy import BLOCK_SIZE, parse_range
+from ibis_bench.utils.storage import (
+    _get_arrow_filesystem,
+    get_filesystem,
+    get_proxy_pids,
+    get_s3_options,
+    get_storage_options,
+)
+
+
+@pytest.mark.parametrize(
+    ("header", "expected"),
+    [
+        (None, (0, 99)),
+        ("bytes=0-9", (0, 9)),
+        ("bytes=90-", (90, 99)),
+        ("bytes=90-200", (90, 99)),
+        ("bytes=-10", (90, 99)),
+        ("bytes=-200", (0, 99)),
+        ("bytes=100-", None),
+        ("bytes=0-1,5-6", None),
+        ("items=0-9", None),
+    ],
+)
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+def test_block_cache_serves_ranges_from_aligned_blocks(s3_bucket, tmp_path):
+    block_cache = str(tmp_path / "blocks")
+    size = 2 * BLOCK_SIZE + 1000
+    data = os.urandom(size)
+    fs, path = get_filesystem(s3_bucket)
+    fs.pipe(f"{path}/object", data)
+
+    # read through a proxy caching blocks, with Arrow's S3 client
+    storage_options = get_storage_options(latency_ms=1, block_cache=block_cache)
+    proxied = _get_arrow_filesystem(get_s3_options(storage_options))
+    object_path = f"{s3_bucket.split('://', 1)[-1]}/object"
+    ranges = [
+        (0, 100),
+        (BLOCK_SIZE - 10, 20),
+        (size - 500, 500),
+        (BLOCK_SIZE + 5, BLOCK_SIZE),
+    ]
+    with proxied.open_input_file(object_path) as f:
+        for offset, length in ranges:
+            assert f.read_at(length, offset) == data[offset : offset + length]
+
+    (object_dir,) = os.listdir(block_cache)
+    assert sorted(os.listdir(os.path.join(block_cache, object_dir))) == [
+        "00000000",
+        "00000001",
+        "00000002",
+        "info.json",
+    ]
+
+    # objects are assumed to be immutable, so reads of cached blocks don't
+    # reach the server
+    fs.pipe(f"{path}/object", bytes(size))
+    with proxied.open_input_file(object_path) as f:
+        assert f.read_at(size, 0) == data
+
+
+def test_proxies_arent_sampled(s3_bucket):
+    get_s3_options(get_storage_options(latency_ms=2))
+
+    # NOTE: proxies are started once per process, earlier tests' too
+    proxy_pids = get_proxy_pids()
+    assert proxy_pids
+    assert not proxy_pids & {process.pid for process in get_process_tree()}
@@ -0,0 +1,95 @@
+import os
+
+import ibis
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import pytest
+
+from ibis_bench.utils.storage import (
+    get_dataset,
+    get_storage_options,
+    read_remote,
+    scan_remote,
+    upload_data,
+)
+
+TABLE = pa.table({"id": list(range(10)), "value": [i / 2 for i in range(10)]})
+
+BACKENDS = ["duckdb", "datafusion", "polars"]
+
+
+def _upload(
+    tmp_path, url: str, file_type: str = "parquet", partitioned: bool = False
+) -> str:
+    data_directory = str(tmp_path / "data")
+    table_directory = os.path.join(data_directory, "t")
+    for i, part in enumerate([TABLE.slice(0, 5), TABLE.slice(5)]):
+        # hive partitions, like the partitioned layouts' fact tables
+        part_directory = (
+            os.path.join(table_directory, f"month={i + 1}")
+            if partitioned
+            else table_directory
+        )
+        os.makedirs(part_directory, exist_ok=True)
+        if file_type == "parquet":
+            pq.write_table(part, os.path.join(part_directory, f"{i:04d}.parquet"))
+        else:
+            feather.write_feather(
+                part, os.path.join(part_directory, f"{i:04d}.arrow"), compression="zstd"
+            )
+    upload_data(data_directory, url)
+    return f"{url}/t"
+
+
+@pytest.mark.parametrize(
+    "storage_options",
+    [None, get_storage_options(latency_ms=1)],
+    ids=["direct", "proxy"],
+)
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_read_remote_parquet(s3_bucket, tmp_path, backend, storage_options):
+    table_directory = _upload(tmp_path, s3_bucket)
+    con = getattr(ibis, backend).connect()
+
+    t = read_remote(con, table_directory, "t", "parquet", storage_options)
+
+    assert t.order_by("id").to_pyarrow().equals(TABLE)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_read_remote_hive_partitions(s3_bucket, tmp_path, backend):
+    table_directory = _upload(tmp_path, s3_bucket, partitioned=True)
+    con = getattr(ibis, backend).connect()
+
+    t = read_remote(con, table_directory, "t", "parquet", partition_columns=["month"])
+
+    assert sorted(t.columns) == ["id", "month", "value"]
+    assert t.filter(t.month == 2).count().to_pyarrow().as_py() == 5
+
+
+def test_read_remote_ipc(s3_bucket, tmp_path):
+    table_directory = _upload(tmp_path, s3_bucket, "ipc")
+    # DuckDB has no IPC reader, it scans an Arrow dataset
+    con = ibis.duckdb.connect()
+
+    t = read_remote(con, table_directory, "t", "ipc")
+
+    assert t.order_by("id").to_pyarrow().equals(TABLE)
+    assert get_dataset(table_directory, "ipc").to_table().sort_by("id").equals(TABLE)
+
+
+@pytest.mark.parametrize("lazy", [True, False])
+def test_scan_remote(s3_bucket, tmp_path, lazy):
+    table_directory = _upload(tmp_path, s3_bucket)
+
+    df = scan_remote(table_directory, "parquet", lazy=lazy)
+    if lazy:
+        df = df.collect()
+
+    assert df.sort("id").to_arrow().equals(TABLE)
+
+
+def test_read_remote_rejects_csv(s3_bucket):
+    with pytest.raises(ValueError, match="can't read csv files"):
+        read_remote(ibis.duckdb.connect(), f"{s3_bucket}/t", "t", "csv")